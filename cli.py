@@ -1,26 +1,50 @@
 #!/usr/bin/env python
 
+import logging
 import os
+import shlex
 import sys
-from datetime import datetime
+import time
+from contextlib import ExitStack
 from typing import Any
 
+from core.answers import CONCURRENCY_OPTIONS, AnswersProfile
+from core.apt_backend import APT_BACKENDS, close_apt_backend, open_apt_backend
+from core.apt_profile import APT_PROFILES, AptProfile
+from core.cassette import Cassette, close_cassette, open_cassette
 from core.env import EnvironmentLoader
-from core.exceptions import PackageNotFoundError
+from core.exceptions import SetUpWizeError
+from core.export import export_dockerfile, export_facts, export_shell
+from core.finalizers import get_finalizer_queue
+from core.footprint import FootprintRecorder, uninstall
 from core.interactive_selector import select_packages_to_install
-from core.packages import create_package_from_yaml
-from core.run_cmd import run_command
+from core.packages import create_packages_from_yaml
+from core.prefetch import AptPrefetcher
+from core.qos import background_policies, get_qos_scheduler
+from core.requirements import resolve_requirements
+from core.run_cmd import allow_prompts, run_command
+from core.scheduling import LockAwareQueue
+from core.state import StateStore, package_fingerprint
 from core.tasks import GnomeSettingsTask
+from core.tracers.archive import close_run_archive, open_run_archive, search_logs
+from core.tracers.events import disable_event_stream, emit_event, enable_event_stream
 from core.tracers.log import LogConfig
+from core.tracers.profiler import PhaseProfiler
+from core.tracers.resources import get_resource_ledger
+from core.warmup import PreflightWarmup
+from core.watch import ConfigurationWatcher, configuration_mappings
 from parser.yaml_parser import YamlParser
 from utils import (
+    SystemFacts,
     check_cmd,
     confirm_reboot,
     confirm_system_upgrade,
+    dpkg_lock_options,
     is_running_gnome,
     is_running_on_ubuntu,
     is_ubuntu_version_at_least,
 )
+from utils.facts import DEFAULT_FACTS_CACHE
 
 import click
 from tqdm import tqdm
@@ -34,6 +58,230 @@ DEFAULT_LOG_PATH = os.environ.get("DEFAULT_LOG_PATH", "./logs")
 DEFAULT_PACKAGES = ["mise", "docker"]
 
 
+def watch_configurations(packages_dir: str, cache_facts: bool) -> None:
+    """
+    Watches the configurations of every package in the catalog and re-applies the changed files until interrupted.
+    """
+    catalog_parser = YamlParser(packages_dir)
+    catalog = create_packages_from_yaml(
+        catalog_parser.get_available_packages(),
+        catalog_parser,
+        facts=SystemFacts.collect(DEFAULT_FACTS_CACHE if cache_facts else None),
+    )
+    try:
+        ConfigurationWatcher(configuration_mappings(catalog)).run()
+    except KeyboardInterrupt:
+        logging.getLogger(__name__).info("Stopped watching.")
+
+
+def export_packages(packages_dir: str, package_names: list[str], export_format: str, export_path: str) -> None:
+    """
+    Compiles the packages (all of them by default) and their requirements into a shell script or a Dockerfile.
+    The facts of the manifests are probed where the export runs, not taken from this host.
+    """
+    catalog_parser = YamlParser(packages_dir)
+    names = resolve_requirements(package_names or catalog_parser.get_available_packages(), catalog_parser)
+    packages = create_packages_from_yaml(names, catalog_parser, facts=export_facts())
+    output = export_shell(packages) if export_format == "sh" else export_dockerfile(packages)
+    with click.open_file(export_path, "w") as f:
+        f.write(output)
+    if export_path != "-" and export_format == "sh":
+        os.chmod(export_path, 0o755)  # noqa: S103
+
+
+def uninstall_packages(packages_dir: str, package_names: list[str], verbose: bool, cache_facts: bool) -> None:
+    """
+    Reverses the recorded footprint of each package: configurations, installed files and new apt packages.
+    """
+    logger = logging.getLogger(__name__)
+    state = StateStore()
+    catalog_parser = YamlParser(packages_dir)
+    # apt packages declared by the packages that stay installed are kept
+    remaining = [
+        name for name in state.packages if name not in package_names and name in catalog_parser.get_available_packages()
+    ]
+    keep = {
+        apt_package
+        for package in create_packages_from_yaml(
+            remaining, catalog_parser, facts=SystemFacts.collect(DEFAULT_FACTS_CACHE if cache_facts else None)
+        )
+        for apt_package in package.apt_packages()
+    }
+    # what other installed packages recorded is theirs too: it may have changed during their installation
+    others = [
+        footprint for name in state.packages if name not in package_names and (footprint := state.footprint(name))
+    ]
+    keep.update(apt_package for footprint in others for apt_package in footprint.apt_packages)
+    claimed = {path for footprint in others for path in footprint.paths()}
+    for name in package_names:
+        footprint = state.footprint(name)
+        if footprint is None:
+            logger.warning(f"No footprint recorded for '{name}', it was not installed by setupwize")
+            continue
+        logger.info(f"Uninstalling '{name}'...")
+        uninstall(footprint, keep, verbose, claimed)
+        state.forget(name)
+        logger.info(f"Package '{name}' uninstalled")
+
+
+def print_packages(available_packages_data: list[dict[str, Any]]) -> None:
+    """
+    Lists the available packages with their category.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("Available packages:")
+    for package_data in available_packages_data:
+        for package in package_data["packages"]:
+            logger.info(f"  - {package['name']} (Category: {package.get('category', 'Uncategorized')})")
+
+
+def print_log_search(log_path: str, pattern: str, packages: list[str], failed: bool) -> None:
+    """
+    Prints the archived command outputs of past runs matching a pattern, optionally limited to some packages.
+    """
+    for entry, lines in search_logs(log_path, pattern or None, packages or None, failed):
+        location = f"{entry.get('package') or '-'}/{entry.get('task') or '-'}"
+        command = shlex.join(entry.get("argv", []))
+        click.echo(f"== {entry['run']} {location} exit={entry.get('exit_code', '-')} {command}")
+        for line in lines:
+            click.echo(f"   {line}")
+
+
+def load_profile_file(ctx: click.Context, _: click.Parameter, path: str | None) -> AnswersProfile | None:
+    """
+    Loads the answers profile and uses its pinned settings as the defaults of the matching options.
+    """
+    if path is None:
+        return None
+    try:
+        profile = AnswersProfile.load(path)
+    except SetUpWizeError as e:
+        raise click.BadParameter(str(e)) from e
+    # options given explicitly on the command line still take precedence over the profile
+    ctx.default_map = {**(ctx.default_map or {}), **profile.concurrency}
+    return profile
+
+
+def open_cassette_file(record_path: str | None, replay_path: str | None, replay_speed: float) -> Cassette | None:
+    """
+    Starts recording the executed commands to a cassette, or replaying them from one.
+    """
+    if record_path and replay_path:
+        raise click.UsageError("--record and --replay cannot be used together")
+    if replay_path:
+        return open_cassette(replay_path, "replay", replay_speed)
+    if record_path:
+        return open_cassette(record_path, "record")
+    return None
+
+
+def preflight_checks(cassette: Cassette | None, cache_facts: bool) -> SystemFacts:
+    """
+    Checks that the system is supported and probes its facts.
+
+    A replayed run skips the checks and uses the facts of the recorded system, a recorded run stores them.
+    """
+    logger = logging.getLogger(__name__)
+    if cassette and cassette.replaying:
+        if cassette.facts is None:
+            logger.error(f"The cassette '{cassette.path}' holds no system facts.")
+            exit(1)
+        return SystemFacts(**cassette.facts)
+
+    if not check_cmd("sudo"):
+        logger.error("sudo command not found. Please install sudo and try again.")
+        exit(1)
+    if not check_cmd("apt-get"):
+        logger.error("apt-get command not found.")
+        exit(1)
+    if not is_running_on_ubuntu() or not is_ubuntu_version_at_least(24.04):
+        logger.error("This script requires Ubuntu 24.04 or higher.")
+        exit(1)
+    if not is_running_gnome():
+        logger.error("This script is designed to run on GNOME desktop environment only.")
+        exit(1)
+
+    # Probe the system once; manifests reference these as `{{ facts.<name> }}`
+    facts = SystemFacts.collect(DEFAULT_FACTS_CACHE if cache_facts else None)
+    if cassette:
+        cassette.facts = facts.as_dict()
+    return facts
+
+
+def allow_sleep_and_lock(allow: bool, verbose: bool) -> None:
+    """
+    Enables or disables the GNOME screen lock and idle suspend.
+    """
+    GnomeSettingsTask(
+        "set", "org.gnome.desktop.screensaver", "lock-enabled", "true" if allow else "false", verbose=verbose
+    ).execute()
+    GnomeSettingsTask(
+        "set", "org.gnome.desktop.session", "idle-delay", "300" if allow else "0", verbose=verbose
+    ).execute()
+
+
+def planned_packages(warmup: PreflightWarmup) -> list[str]:
+    """
+    Waits for the selected packages to be checked and their requirements added, each installed once and before
+    its dependents, and reports a dpkg lock held by another process.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        package_names = warmup.package_names()
+    except SetUpWizeError as e:
+        logger.error(str(e))  # noqa: TRY400
+        exit(1)
+    if holder := warmup.lock_holder():
+        logger.info(f"{holder} holds the dpkg lock, packages not needing apt will be installed first")
+    return package_names
+
+
+def upgrade_system() -> None:
+    """
+    Updates the package lists and upgrades the installed packages.
+    """
+    logging.getLogger(__name__).info("Updating and upgrading system packages...")
+    # like the apt tasks, apt waits for the dpkg lock held by another frontend instead of failing
+    options = [arg for key, value in dpkg_lock_options().items() for arg in ("-o", f"{key}={value}")]
+    run_command(["sudo", "apt-get", *options, "-y", "update"], verbose=True)
+    run_command(["sudo", "apt-get", *options, "-y", "upgrade"], verbose=True)
+
+
+def ensure_privileges(warmup: PreflightWarmup, interactive: bool) -> None:
+    """
+    Validates the sudo credentials before the first privileged command; an unattended run needing a password
+    exits instead of prompting.
+    """
+    try:
+        warmup.ensure_sudo(interactive)
+    except SetUpWizeError as e:
+        logging.getLogger(__name__).error(str(e))  # noqa: TRY400
+        exit(1)
+
+
+def choose_packages(
+    packages: list[str],
+    select: bool,
+    profile: AnswersProfile | None,
+    yaml_parser: YamlParser,
+    available_packages_data: list[dict[str, Any]],
+) -> list[str]:
+    """
+    Resolves the packages to install from the command line, the profile file or the interactive selection.
+    """
+    # Interactive selection of the packages
+    if select:
+        # Interactively select packages or use defaults if none specified, showing the last install durations
+        return select_packages_to_install(available_packages_data, DEFAULT_PACKAGES, StateStore().durations())
+    if packages:
+        return packages
+    # The profile pins the selection, unless packages are given on the command line
+    if profile:
+        return profile.select_packages(yaml_parser.get_available_packages())
+    # Default to install all packages
+    return yaml_parser.get_available_packages()
+
+
 @click.command()
 @click.option("--packages-dir", "-p", default=DEFAULT_PACKAGES_DIR, help="Directory containing package YAML files")
 @click.option(
@@ -43,6 +291,120 @@ DEFAULT_PACKAGES = ["mise", "docker"]
 @click.option("--list-packages", "-list", is_flag=True, help="List available packages and exit")
 @click.option("--select-packages", "-select", is_flag=True, help="Interactively select packages to install")
 @click.option("--verbose", "-v", is_flag=True, help="Enable verbose output")
+@click.option(
+    "--watch", "-w", is_flag=True, help="Watch the configurations and re-apply changed files until interrupted"
+)
+@click.option(
+    "--prefetch-depth",
+    "-pd",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=CONCURRENCY_OPTIONS["prefetch_depth"]),
+    help="Number of upcoming packages whose apt archives are downloaded in the background (0 disables)",
+)
+@click.option(
+    "--prefetch-jobs",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=CONCURRENCY_OPTIONS["prefetch_jobs"]),
+    help="Concurrent prefetch downloads",
+)
+@click.option(
+    "--prefetch-rate",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=CONCURRENCY_OPTIONS["prefetch_rate"]),
+    help="Prefetch bandwidth limit in KiB/s (0 means unlimited)",
+)
+@click.option(
+    "--apt-profile",
+    default="default",
+    show_default=True,
+    type=click.Choice(list(APT_PROFILES)),
+    help="Apt tuning: 'fast' skips recommends and defers triggers, 'ephemeral' also skips fsync (throwaway hosts)",
+)
+@click.option(
+    "--apt-backend",
+    default="apt-get",
+    show_default=True,
+    type=click.Choice(APT_BACKENDS),
+    help="How apt tasks run: forking apt-get, or in-process through python3-apt when running as root ('auto')",
+)
+@click.option(
+    "--background",
+    is_flag=True,
+    help="Keep the desktop responsive: run downloads, disk writes and builds at a lower CPU and I/O priority "
+    "(and cgroup weights when a systemd user instance is available)",
+)
+@click.option("--cache-facts", is_flag=True, help="Cache the probed system facts on disk between runs")
+@click.option("--profile", is_flag=True, help="Profile each run phase and write the reports to the log directory")
+@click.option("--profile-memory", is_flag=True, help="Also track Python allocations when profiling")
+@click.option(
+    "--converge", is_flag=True, help="Skip packages that are unchanged and still in place since their last install"
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_format",
+    default="text",
+    show_default=True,
+    type=click.Choice(["text", "json"]),
+    help="Output format; 'json' streams newline-delimited events and runs without prompts",
+)
+@click.option(
+    "--event-fd",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="File descriptor receiving the JSON events",
+)
+@click.option(
+    "--profile-file",
+    type=click.Path(exists=True, dir_okay=False),
+    is_eager=True,
+    expose_value=True,
+    callback=load_profile_file,
+    help="YAML file answering every prompt (packages, upgrade, reboot) for an unattended run",
+)
+@click.option(
+    "--export",
+    "export_format",
+    type=click.Choice(["sh", "dockerfile"]),
+    help="Compile the packages into a POSIX shell script or a Dockerfile instead of installing them, then exit",
+)
+@click.option("--export-path", default="-", show_default=True, help="Where to write the export ('-' for stdout)")
+@click.option(
+    "--search-logs",
+    "search_pattern",
+    metavar="REGEX",
+    help="Search the archived command output of past runs (of the given packages, if any), then exit; '' matches all",
+)
+@click.option(
+    "--uninstall",
+    "uninstall_mode",
+    is_flag=True,
+    help="Remove what installing the given packages changed (files, configurations, new apt packages), then exit",
+)
+@click.option("--search-failed", is_flag=True, help="With --search-logs, only search the output of failed commands")
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False),
+    help="Record every executed command (output, exit code, timing) and the system facts to a cassette file",
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Replay the commands of a cassette file instead of executing them; configuration copies still run",
+)
+@click.option(
+    "--replay-speed",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Factor applied to the recorded command durations when replaying (0 replays instantly)",
+)
 @click.argument("packages_to_install", nargs=-1)
 def main(
     packages_dir: str,
@@ -51,6 +413,28 @@ def main(
     list_packages: bool,
     select_packages: bool,
     verbose: bool,
+    watch: bool,
+    prefetch_depth: int,
+    prefetch_jobs: int,
+    prefetch_rate: int,
+    apt_profile: str,
+    apt_backend: str,
+    background: bool,
+    cache_facts: bool,
+    converge: bool,
+    profile: bool,
+    profile_memory: bool,
+    output_format: str,
+    event_fd: int,
+    profile_file: AnswersProfile | None,
+    export_format: str | None,
+    export_path: str,
+    search_pattern: str | None,
+    search_failed: bool,
+    uninstall_mode: bool,
+    record_path: str | None,
+    replay_path: str | None,
+    replay_speed: float,
     packages_to_install: list[str],
 ) -> None:
     """
@@ -58,100 +442,197 @@ def main(
     """
 
     # Configure logging
-    logger = LogConfig(log_path=log_path, logger_source=__file__, log_level=log_level.upper()).get_logger()
+    # In JSON mode the terminal only receives events, human-readable logs still go to the log file
+    json_output = output_format == "json"
+    log_config = LogConfig(
+        log_path=log_path, logger_source=__file__, log_level=log_level.upper(), console=not json_output
+    )
+    logger = log_config.get_logger()
+    if json_output:
+        # Command output is kept next to the log file and referenced by byte range from the events
+        enable_event_stream(event_fd, log_config.log_path / f"{log_config.log_file_path.stem}.output")
 
-    # Preliminary checks
-    if not check_cmd("sudo"):
-        logger.error("sudo command not found. Please install sudo and try again.")
-        exit(1)
-    if not check_cmd("apt-get"):
-        logger.error("apt-get command not found.")
-        exit(1)
-    if not is_running_on_ubuntu() or not is_ubuntu_version_at_least(24.04):
-        logger.error("This script requires Ubuntu 24.04 or higher.")
-        exit(1)
-    if not is_running_gnome():
-        logger.error("This script is designed to run on GNOME desktop environment only.")
-        exit(1)
+    # Profile reports are stored next to the run's log file
+    profiler = PhaseProfiler(
+        log_config.log_path / f"{log_config.log_file_path.stem}-profile", enabled=profile, trace_memory=profile_memory
+    )
 
-    if confirm_system_upgrade():
-        logger.info("Updating and upgrading system packages...")
-        run_command(["sudo", "apt-get", "-y", "update"], verbose=True)
-        run_command(["sudo", "apt-get", "-y", "upgrade"], verbose=True)
-
-    # List available packages if requested
-    yaml_parser: YamlParser = YamlParser(packages_dir)
-    available_packages_data: list[dict[str, Any]] = yaml_parser.load_all_packages()
-    if list_packages:
-        logger.info("Available packages:")
-        for package_data in available_packages_data:
-            for package in package_data["packages"]:
-                logger.info(f"  - {package['name']} (Category: {package.get('category', 'Uncategorized')})")
-        exit(0)
+    # From here on every exit, the early ones included, flushes the reports and archives the run log
+    try:
+        # The output of every command and the run log are stored in a compressed, indexed archive
+        archive = open_run_archive(log_config.log_path, log_config.log_file_path.stem)
 
-    # Default to install all packages
-    if not packages_to_install and not select_packages:
-        packages_to_install = yaml_parser.get_available_packages()
+        # Sync configuration changes only: no system checks, prompts or apt
+        if watch:
+            watch_configurations(packages_dir, cache_facts)
+            exit(0)
 
-    # Interactive selection of the packages
-    if select_packages:
-        # Interactively select packages or use defaults if none specified
-        packages_to_install = select_packages_to_install(available_packages_data, DEFAULT_PACKAGES)
-
-    # specify the specific package to install
-    if packages_to_install:
-        # Check if specified packages are valid
-        invalid_packages = [p for p in packages_to_install if p not in yaml_parser.get_available_packages()]
-        if invalid_packages:
-            logger.error(f"Invalid packages: {', '.join(invalid_packages)}")
-            exit(1)
-    try:
-        # Prevent sleep/lock during installation
-        logger.info("Preventing the system from going to sleep or locking...")
-        GnomeSettingsTask("set", "org.gnome.desktop.screensaver", "lock-enabled", "false", verbose=verbose).execute()
-        GnomeSettingsTask("set", "org.gnome.desktop.session", "idle-delay", "0", verbose=verbose).execute()
-
-        # Install packages
-        with tqdm(
-            total=len(packages_to_install),
-            desc="Installing Packages",
-            unit="pkg",
-            position=0,
-            leave=True,
-            dynamic_ncols=True,
-            file=sys.stderr,
-        ) as pbar:
-            for package_name in packages_to_install:
-                try:
-                    create_package_from_yaml(
-                        package_name,
-                        yaml_parser,
-                        verbose,
-                    ).install()
-                except PackageNotFoundError:
-                    logger.exception(f"Package '{package_name}' not found.")
-                finally:
-                    pbar.update(1)
-                    pbar.refresh()
-    except (Exception, KeyboardInterrupt) as e:
-        log_file = os.path.join(log_path, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-        if isinstance(e, KeyboardInterrupt):
-            logger.warning("Installation interrupted.")
-        else:
-            logger.exception(
-                f"An unexpected error occurred during installation. Please check the log_file `{log_file}` for more details."  # noqa: E501
+        # Query the archived runs only
+        if search_pattern is not None:
+            print_log_search(log_path, search_pattern, list(packages_to_install), search_failed)
+            exit(0)
+
+        # Compile the manifests only: no system checks, prompts or installation
+        if export_format:
+            export_packages(packages_dir, list(packages_to_install), export_format, export_path)
+            exit(0)
+
+        # Reverse recorded footprints only: no system checks, prompts or installation
+        if uninstall_mode:
+            uninstall_packages(packages_dir, list(packages_to_install), verbose, cache_facts)
+            exit(0)
+
+        # Commands are recorded to, or served from, a cassette for deterministic regression runs
+        cassette = open_cassette_file(record_path, replay_path, replay_speed)
+        replaying = cassette is not None and cassette.replaying
+        if replaying:
+            # the recorded commands already contain the downloads
+            prefetch_depth = 0
+
+        # Commands yield the CPU and the disk to the desktop, depending on what limits their task
+        if background:
+            get_qos_scheduler().configure(background_policies())
+
+        # Preliminary checks
+        with profiler.phase("preflight"):
+            facts = preflight_checks(cassette, cache_facts)
+            logger.debug(f"System facts: {facts}")
+
+        # Unattended runs take every answer from the profile file and never prompt
+        interactive = profile_file is None and not json_output
+        allow_prompts(interactive)
+        selecting = select_packages and interactive
+        yaml_parser: YamlParser = YamlParser(packages_dir)
+        prefetcher = AptPrefetcher(depth=prefetch_depth, jobs=prefetch_jobs, rate_limit=prefetch_rate * 1024)
+        apt_tuning = AptProfile(apt_profile)
+        apt_options = {**prefetcher.apt_options, **apt_tuning.options}
+
+        # The catalog is parsed, the sudo credentials checked and the dpkg lock probed while the first prompt waits;
+        # the prefetcher and apt profile are cleaned up on an early exit, otherwise handed to the installation
+        with (
+            ExitStack() as early_exit,
+            PreflightWarmup(
+                yaml_parser,
+                facts,
+                apt_options,
+                prefetcher,
+                verbose,
+                sudo=not replaying and not list_packages,
+                profiler=profiler,
+            ) as warmup,
+        ):
+            early_exit.callback(prefetcher.close)
+            early_exit.callback(apt_tuning.close)
+            # Packages known upfront are resolved, created and prefetched in the background as well
+            if not selecting and not list_packages:
+                warmup.plan(choose_packages(list(packages_to_install), False, profile_file, yaml_parser, []))
+            upgrade = profile_file.upgrade if profile_file else interactive and confirm_system_upgrade()
+            ensure_privileges(warmup, interactive)
+            if upgrade:
+                upgrade_system()
+
+            # List available packages if requested
+            available_packages_data: list[dict[str, Any]] = warmup.catalog()
+            if list_packages:
+                print_packages(available_packages_data)
+                exit(0)
+            if selecting:
+                warmup.plan(choose_packages([], True, profile_file, yaml_parser, available_packages_data))
+
+            packages_to_install = planned_packages(warmup)
+            early_exit.pop_all()
+        try:
+            prevent_sleep = profile_file.prevent_sleep if profile_file else True
+
+            # Install packages while the archives of the next ones are downloaded in the background
+            with (
+                prefetcher,
+                apt_tuning,
+                tqdm(
+                    total=len(packages_to_install),
+                    desc="Installing Packages",
+                    unit="pkg",
+                    position=0,
+                    leave=True,
+                    dynamic_ncols=True,
+                    file=sys.stderr,
+                    disable=json_output,
+                ) as pbar,
+            ):
+                # Prevent sleep/lock during installation
+                if prevent_sleep:
+                    logger.info("Preventing the system from going to sleep or locking...")
+                    allow_sleep_and_lock(False, verbose)
+
+                # Apt tasks share one package cache when the in-process backend is used
+                open_apt_backend(apt_backend)
+
+                with profiler.phase("planning"):
+                    packages = warmup.packages()
+
+                    # Fingerprint the inputs of every package; unchanged, intact packages are skipped in converge mode
+                    state = StateStore(persistent=not replaying)
+                    fingerprints = {
+                        package.name: package_fingerprint(package.data, yaml_parser.package_path(package.name), facts)
+                        for package in packages
+                    }
+                    if converge:
+                        packages = state.pending(packages, fingerprints)
+                    pbar.update(len(packages_to_install) - len(packages))
+                    apt_packages = sorted({name for package in packages for name in package.apt_packages()})
+                    if not replaying:
+                        apt_tuning.measure(apt_packages, apt_options)
+                    emit_event("run_start", packages=[package.name for package in packages])
+
+                # Packages not needing apt go first while another process holds the dpkg lock
+                queue = LockAwareQueue(packages)
+                for package in queue:
+                    try:
+                        prefetcher.schedule(queue.pending)
+                        prefetcher.wait(package)
+                        # what the installation changes is recorded, so `--uninstall` can reverse it
+                        started = time.monotonic()
+                        with profiler.phase(f"package:{package.name}"), FootprintRecorder(package, state):
+                            package.install()
+                        state.record(package.name, fingerprints[package.name], time.monotonic() - started)
+                    finally:
+                        pbar.update(1)
+                        pbar.refresh()
+                # Font caches, service restarts, group changes... requested by the tasks, each run once
+                get_finalizer_queue().flush(verbose=verbose)
+                apt_tuning.log_summary()
+                emit_event("run_end", status="ok")
+        except (Exception, KeyboardInterrupt) as e:
+            emit_event(
+                "run_end", status="interrupted" if isinstance(e, KeyboardInterrupt) else "failed", message=str(e)
             )
+            if isinstance(e, KeyboardInterrupt):
+                logger.warning("Installation interrupted.")
+            else:
+                logger.exception(
+                    "An unexpected error occurred during installation. The run log and the output of every command "
+                    f"are archived in `{archive.path}`, search them with `--search-logs <pattern> --search-failed`."
+                )
+                # the packages installed before the failure still get their finalizers
+                get_finalizer_queue().flush(verbose=verbose)
 
-        # Revert sleep/lock settings
-        logger.info("Reverting to normal idle and lock settings...")
-        GnomeSettingsTask("set", "org.gnome.desktop.screensaver", "lock-enabled", "true", verbose=verbose).execute()
-        GnomeSettingsTask("set", "org.gnome.desktop.session", "idle-delay", "300", verbose=verbose).execute()
+            # Revert sleep/lock settings
+            if prevent_sleep:
+                logger.info("Reverting to normal idle and lock settings...")
+                allow_sleep_and_lock(True, verbose)
 
-        sys.exit(1)
+            sys.exit(1)
 
-    if confirm_reboot():
-        logger.info("Rebooting the system...")
-        run_command(["sudo", "reboot"], verbose=True)
+        if profile_file.reboot if profile_file else interactive and confirm_reboot():
+            logger.info("Rebooting the system...")
+            run_command(["sudo", "reboot"], verbose=True)
+    finally:
+        profiler.write_summary()
+        get_resource_ledger().log_summary()
+        disable_event_stream()
+        close_apt_backend()
+        close_run_archive(log_config.log_file_path)
+        close_cassette()
 
 
 if __name__ == "__main__":
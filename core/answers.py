@@ -0,0 +1,114 @@
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from core.exceptions import InvalidYamlFormatError, MissingAnswerError
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# The questions an interactive run asks; an unattended run must answer every one of them
+REQUIRED_ANSWERS = ("packages", "upgrade", "reboot")
+
+# Settings a profile may pin, named after the CLI options they provide defaults for, with the minimum value
+# both accept
+CONCURRENCY_OPTIONS = {"prefetch_depth": 0, "prefetch_jobs": 1, "prefetch_rate": 0}
+
+
+@dataclass(frozen=True)
+class AnswersProfile:
+    """
+    The answers and settings of an unattended run, loaded from a YAML profile file.
+
+    Example:
+        ```yaml
+        packages: all          # or a list of package names
+        upgrade: false         # upgrade the system before installing
+        reboot: false          # reboot once the installation is done
+        gnome:
+          prevent_sleep: true  # disable screen lock and idle suspend during the installation
+        concurrency:
+          prefetch_depth: 2
+          prefetch_jobs: 4
+          prefetch_rate: 0
+        ```
+
+    Attributes:
+        packages: The package names to install, or None to install every available package.
+        upgrade: Whether to upgrade the system before installing.
+        reboot: Whether to reboot after installing.
+        prevent_sleep: Whether to prevent the screen lock and idle suspend during the installation.
+        concurrency: The CLI option defaults pinned by the profile (e.g. `prefetch_jobs`).
+    """
+
+    packages: list[str] | None
+    upgrade: bool
+    reboot: bool
+    prevent_sleep: bool = True
+    concurrency: dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "AnswersProfile":
+        """
+        Loads and validates a profile file.
+
+        Args:
+            path: The YAML profile file.
+
+        Returns:
+            The loaded profile.
+
+        Raises:
+            MissingAnswerError: If the profile does not answer every question of an interactive run.
+            InvalidYamlFormatError: If the file cannot be parsed or holds unknown or invalid values.
+        """
+        try:
+            data = yaml.safe_load(Path(path).read_text()) or {}
+        except (OSError, yaml.YAMLError) as e:
+            raise InvalidYamlFormatError(f"Error reading profile file '{path}': {e}") from e
+        if not isinstance(data, dict):
+            raise InvalidYamlFormatError(f"Profile file '{path}' must contain a mapping")
+
+        unknown = set(data) - {*REQUIRED_ANSWERS, "gnome", "concurrency"}
+        if unknown:
+            raise InvalidYamlFormatError(f"Unknown keys in profile file '{path}': {', '.join(sorted(unknown))}")
+        missing = [key for key in REQUIRED_ANSWERS if data.get(key) is None]
+        if missing:
+            raise MissingAnswerError(f"Profile file '{path}' does not answer: {', '.join(missing)}")
+
+        packages = data["packages"]
+        if packages != "all" and not (
+            isinstance(packages, list) and packages and all(isinstance(name, str) for name in packages)
+        ):
+            raise InvalidYamlFormatError(f"'packages' in '{path}' must be 'all' or a non-empty list of package names")
+
+        gnome: dict[str, Any] = data.get("gnome") or {}
+        concurrency: dict[str, Any] = data.get("concurrency") or {}
+        if set(gnome) - {"prevent_sleep"}:
+            raise InvalidYamlFormatError(f"'gnome' in '{path}' only accepts: prevent_sleep")
+        if set(concurrency) - set(CONCURRENCY_OPTIONS):
+            raise InvalidYamlFormatError(f"'concurrency' in '{path}' only accepts: {', '.join(CONCURRENCY_OPTIONS)}")
+
+        values = {"upgrade": data["upgrade"], "reboot": data["reboot"], **gnome}
+        if not all(isinstance(value, bool) for value in values.values()):
+            raise InvalidYamlFormatError(f"The answers in '{path}' must be booleans (true/false)")
+        for key, value in concurrency.items():
+            minimum = CONCURRENCY_OPTIONS[key]
+            if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+                raise InvalidYamlFormatError(f"'{key}' in '{path}' must be an integer of at least {minimum}")
+
+        return cls(
+            packages=None if packages == "all" else packages,
+            upgrade=data["upgrade"],
+            reboot=data["reboot"],
+            prevent_sleep=gnome.get("prevent_sleep", True),
+            concurrency=concurrency,
+        )
+
+    def select_packages(self, available_packages: list[str]) -> list[str]:
+        """
+        Returns the packages pinned by the profile, or every available package if it selects them all.
+        """
+        return list(available_packages) if self.packages is None else list(self.packages)
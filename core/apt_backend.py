@@ -0,0 +1,287 @@
+import logging
+import os
+import signal
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from core.cassette import get_cassette
+from core.exceptions import CommandTimeoutError, TaskExecutionFailedError
+from core.run_cmd import KILL_GRACE_PERIOD, LimitTracker
+from core.tracers.events import emit_event, get_output_spool, record_exit_code
+
+from tqdm import tqdm
+
+try:
+    # the python3-apt bindings are only shipped as a distribution package
+    import apt
+    import apt.progress.base
+    import apt_pkg
+
+    PYTHON_APT = True
+except ImportError:
+    PYTHON_APT = False
+
+logger = logging.getLogger(__name__)
+
+APT_BACKENDS = ["apt-get", "python-apt", "auto"]
+
+
+class AptProgress:
+    """
+    Reports the download and installation progress of an apt transaction as events and on a progress bar.
+    """
+
+    def __init__(self, phase: str):
+        self.phase = phase
+        self._percent = -1
+        self._bar = tqdm(
+            total=100,
+            desc=phase.capitalize(),
+            unit="%",
+            position=1,
+            leave=False,
+            dynamic_ncols=True,
+            file=sys.stderr,
+            # in machine-readable mode the progress is only reported as events
+            disable=get_output_spool() is not None,
+        )
+
+    def update(self, percent: float, detail: str = "") -> None:
+        """
+        Reports the overall progress of the phase; events are only emitted when the whole percentage changes.
+        """
+        percent = max(0, min(int(percent), 100))
+        if percent == self._percent:
+            return
+        self._bar.update(percent - max(self._percent, 0))
+        if detail:
+            self._bar.set_postfix_str(detail[:40], refresh=False)
+        self._percent = percent
+        emit_event("apt_progress", phase=self.phase, percent=percent, detail=detail)
+
+    def close(self) -> None:
+        self._bar.close()
+
+
+if PYTHON_APT:
+
+    class _AcquireProgress(apt.progress.base.AcquireProgress):
+        def __init__(self, progress: AptProgress, limits: LimitTracker):
+            super().__init__()
+            self.progress = progress
+            self.limits = limits
+            self._received = 0
+
+        def pulse(self, owner: Any) -> bool:  # noqa: ANN401
+            if self.total_bytes:
+                self.progress.update(
+                    100 * self.current_bytes / self.total_bytes, f"{self.current_items}/{self.total_items} items"
+                )
+            if self.current_bytes > self._received:
+                self._received = self.current_bytes
+                self.limits.touch()
+            # returning False cancels the downloads once the limits of the task expired
+            return not self.limits.check()
+
+        def fail(self, item: Any) -> None:  # noqa: ANN401
+            logger.warning(f"Failed to fetch {item.shortdesc}: {item.owner.error_text}")
+
+    class _InstallProgress(apt.progress.base.InstallProgress):
+        def __init__(self, progress: AptProgress, limits: LimitTracker):
+            super().__init__()
+            self.progress = progress
+            self.limits = limits
+            self._terminated: float | None = None
+
+        def status_change(self, pkg: str, percent: float, status: str) -> None:
+            self.progress.update(percent, f"{pkg}: {status}")
+            self.limits.touch()
+
+        def update_interface(self) -> None:
+            super().update_interface()
+            # like run_command, dpkg is terminated once the limits expire, then killed after the grace period
+            if not self.child_pid or not self.limits.check():
+                return
+            now = time.monotonic()
+            if self._terminated is None or now - self._terminated >= KILL_GRACE_PERIOD:
+                sig = signal.SIGTERM if self._terminated is None else signal.SIGKILL
+                self._terminated = self._terminated or now
+                try:
+                    os.kill(self.child_pid, sig)
+                except ProcessLookupError:
+                    pass
+
+        def error(self, pkg: str, errormsg: str) -> None:
+            logger.error(f"dpkg failed on '{pkg}': {errormsg}")
+
+
+class PythonAptBackend:
+    """
+    Runs apt transactions in-process through the python3-apt bindings instead of forking `apt-get`.
+
+    The package cache is opened once per run and only reopened after a transaction changed the system, every
+    install task is marked and committed as a single transaction, and the download and installation progress
+    is reported through structured callbacks rather than scraped from the terminal output. The bindings need
+    root, so the backend is only used when setupwize itself runs as root.
+
+    The timeout and stall timeout of the task apply as they do to `apt-get`: the downloads are cancelled and
+    dpkg is killed once they expire, and CommandTimeoutError is raised.
+    """
+
+    def __init__(self) -> None:
+        self._cache: Any = None
+
+    @staticmethod
+    def available() -> bool:
+        """
+        Checks whether the bindings are importable and the process may commit transactions.
+        """
+        return PYTHON_APT and os.geteuid() == 0
+
+    @property
+    def cache(self) -> Any:  # noqa: ANN401
+        if self._cache is None:
+            self._cache = apt.Cache()
+        return self._cache
+
+    @staticmethod
+    @contextmanager
+    def _configured(options: dict[str, str]) -> Iterator[None]:
+        """
+        Applies the configuration `apt-get -o key=value` would for a single transaction, then restores the
+        previous values: the configuration is global to the process, and keys ending in "::" append to a list.
+        """
+        config = apt_pkg.config
+        saved: list[tuple[str, list[str] | None, bool, str]] = []
+        for key, value in options.items():
+            name = key.rstrip(":")
+            values = config.value_list(name) if key.endswith("::") else None
+            saved.append((name, values, config.exists(name), config.find(name)))
+            config.set(key, value)
+        try:
+            yield
+        finally:
+            # in reverse, so an entry named by several keys ends up with its value from before the transaction
+            for name, values, existed, value in reversed(saved):
+                config.clear(name)
+                if values is not None:
+                    for item in values:
+                        config.set(f"{name}::", item)
+                elif existed:
+                    config.set(name, value)
+
+    def update(self, options: dict[str, str], sources_list: Path | None = None) -> None:
+        """
+        Refreshes the package indexes, of every source or of a single source file.
+        """
+        progress, limits = AptProgress("update"), LimitTracker()
+        try:
+            with self._configured(options):
+                self.cache.update(
+                    _AcquireProgress(progress, limits), sources_list=str(sources_list) if sources_list else None
+                )
+                self.cache.open()
+        except (apt.cache.FetchFailedException, apt.cache.LockFailedException, SystemError) as e:
+            record_exit_code(1)
+            _raise_if_expired(limits, "apt update")
+            raise TaskExecutionFailedError(f"apt update failed: {e}")
+        finally:
+            progress.close()
+        record_exit_code(0)
+
+    def install(self, packages: list[str], options: dict[str, str]) -> None:
+        """
+        Marks every package for installation and commits them in one transaction.
+        """
+        with self._configured(options):
+            self._install(packages)
+
+    def _install(self, packages: list[str]) -> None:
+        cache = self.cache
+        with cache.actiongroup():
+            for name in packages:
+                providers = cache.get_providing_packages(name) if name not in cache else []
+                name = providers[0].name if providers else name
+                if name not in cache:
+                    raise TaskExecutionFailedError(f"apt package not found: {name}")
+                cache[name].mark_install()
+        if cache.broken_count:
+            cache.clear()
+            raise TaskExecutionFailedError(f"Unresolvable dependencies installing: {', '.join(packages)}")
+        if not cache.get_changes():
+            logger.info(f"Already installed: {', '.join(packages)}")
+            record_exit_code(0)
+            return
+
+        logger.info(
+            f"Installing {cache.install_count} package(s), {cache.required_download / 1_000_000:.1f} MB to download"
+        )
+        download, installation, limits = AptProgress("download"), AptProgress("install"), LimitTracker()
+        try:
+            cache.commit(_AcquireProgress(download, limits), _InstallProgress(installation, limits))
+        except (apt.cache.FetchFailedException, apt.cache.LockFailedException, SystemError) as e:
+            record_exit_code(1)
+            _raise_if_expired(limits, "apt install")
+            raise TaskExecutionFailedError(f"apt install failed: {e}")
+        finally:
+            download.close()
+            installation.close()
+            # the transaction changed the system, the next one needs a fresh view of it
+            cache.open()
+        # a killed dpkg does not always make the commit fail
+        _raise_if_expired(limits, "apt install")
+        record_exit_code(0)
+
+    def close(self) -> None:
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+
+def _raise_if_expired(limits: LimitTracker, transaction: str) -> None:
+    if limits.expired:
+        record_exit_code(1)
+        emit_event("error", message=f"{transaction} {limits.expired}")
+        raise CommandTimeoutError(f"{transaction} {limits.expired}")
+
+
+_apt_backend: PythonAptBackend | None = None
+
+
+def open_apt_backend(name: str = "apt-get") -> PythonAptBackend | None:
+    """
+    Selects the backend of the apt tasks: "apt-get" forks apt-get, "python-apt" uses the bindings and "auto"
+    uses them when possible. The bindings fall back to apt-get when unavailable, and when commands are recorded
+    to or replayed from a cassette, since only commands run through `run_command` are recorded.
+    """
+    global _apt_backend  # noqa: PLW0603
+    if name == "apt-get":
+        return None
+    if get_cassette() or not PythonAptBackend.available():
+        if name == "python-apt":
+            logger.warning("The python-apt backend needs root, python3-apt and no cassette; using apt-get")
+        return None
+    _apt_backend = PythonAptBackend()
+    logger.info("Using the python-apt backend for apt tasks")
+    return _apt_backend
+
+
+def get_apt_backend() -> PythonAptBackend | None:
+    """
+    Returns the in-process apt backend, or None when apt tasks fork apt-get.
+    """
+    return _apt_backend
+
+
+def close_apt_backend() -> None:
+    """
+    Releases the package cache and goes back to forking apt-get.
+    """
+    global _apt_backend  # noqa: PLW0603
+    if _apt_backend:
+        _apt_backend.close()
+        _apt_backend = None
@@ -0,0 +1,164 @@
+import logging
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from types import TracebackType
+
+from core.prefetch import resolve_archives
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AptTweak:
+    """
+    A group of apt options applied together by an apt profile.
+
+    Attributes:
+        name: The tweak name shown in the summary.
+        options: The apt configuration passed as `-o key=value`.
+        avoids: What the tweak saves, shown in the summary when the saving cannot be measured.
+    """
+
+    name: str
+    options: dict[str, str]
+    avoids: str
+
+
+APT_TWEAKS: dict[str, AptTweak] = {
+    tweak.name: tweak
+    for tweak in (
+        AptTweak(
+            "no_recommends",
+            {"APT::Install-Recommends": "false", "APT::Install-Suggests": "false"},
+            "recommended packages",
+        ),
+        AptTweak(
+            "lean_indexes",
+            {"Acquire::Languages": "none", "Acquire::PDiffs": "false"},
+            "translation indexes and index diff chains on update",
+        ),
+        AptTweak("no_pty", {"Dpkg::Use-Pty": "0"}, "dpkg progress rendering through a pseudo-terminal"),
+        AptTweak(
+            "deferred_triggers",
+            {"DPkg::NoTriggers": "true", "DPkg::ConfigurePending": "true", "DPkg::TriggersPending": "true"},
+            "running the same triggers (man-db, ldconfig, ...) once per unpacked package",
+        ),
+        AptTweak("unsafe_io", {"DPkg::Options::": "--force-unsafe-io"}, "fsync calls while unpacking archives"),
+    )
+}
+
+# `fast` is safe on any host; `ephemeral` also trades crash safety for speed and is meant for throwaway VMs
+APT_PROFILES: dict[str, list[str]] = {
+    "default": [],
+    "fast": ["no_recommends", "lean_indexes", "no_pty", "deferred_triggers"],
+    "ephemeral": ["no_recommends", "lean_indexes", "no_pty", "deferred_triggers", "unsafe_io"],
+}
+
+
+class AptProfile:
+    """
+    A named set of apt options trading defaults for installation speed, applied to every apt task of the run.
+
+    The `ephemeral` profile also runs dpkg under `eatmydata` when it is installed, through a dpkg wrapper
+    configured with `Dir::Bin::dpkg`, so maintainer scripts skip their fsync calls too.
+
+    Example:
+        ```python
+        with AptProfile("fast") as apt_profile:
+            apt_profile.measure(["git", "curl"])
+            AptTask("install", ["git", "curl"], options=apt_profile.options).execute()
+            logger.info(apt_profile.summary())
+        ```
+    """
+
+    def __init__(self, name: str = "default"):
+        """
+        Initializes the AptProfile.
+
+        Args:
+            name: The profile name, one of `APT_PROFILES`.
+        """
+        if name not in APT_PROFILES:
+            raise ValueError(f"Invalid apt profile: {name}")
+        self.name = name
+        self.tweaks: list[AptTweak] = [APT_TWEAKS[tweak] for tweak in APT_PROFILES[name]]
+        self.savings: dict[str, str] = {}
+        self._wrapper_dir: Path | None = None
+
+        if name == "ephemeral" and shutil.which("eatmydata"):
+            self._wrapper_dir = Path(tempfile.mkdtemp(prefix="setupwize-dpkg-"))
+            wrapper = self._wrapper_dir / "dpkg"
+            wrapper.write_text('#!/bin/sh\nexec eatmydata /usr/bin/dpkg "$@"\n')
+            wrapper.chmod(0o755)
+            self.tweaks.append(
+                AptTweak("eatmydata", {"Dir::Bin::dpkg": str(wrapper)}, "fsync calls of dpkg and maintainer scripts")
+            )
+
+    @property
+    def options(self) -> dict[str, str]:
+        """
+        The apt configuration of every tweak of the profile.
+        """
+        return {key: value for tweak in self.tweaks for key, value in tweak.options.items()}
+
+    def __enter__(self) -> "AptProfile":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Removes the dpkg wrapper, if any.
+        """
+        if self._wrapper_dir:
+            shutil.rmtree(self._wrapper_dir, ignore_errors=True)
+
+    def measure(self, apt_packages: list[str], options: dict[str, str] | None = None) -> None:
+        """
+        Measures the savings that can be computed before installing, by resolving the installation with and
+        without the tweak. Only `no_recommends` is measurable this way; it must run before the installation.
+
+        Args:
+            apt_packages: Every apt package the run installs.
+            options: (Optional) The other apt options of the run, such as the prefetch archive directory.
+        """
+        if not apt_packages or "no_recommends" not in APT_PROFILES[self.name]:
+            return
+        try:
+            resolved = {
+                recommends: resolve_archives(apt_packages, {**(options or {}), "APT::Install-Recommends": recommends})
+                for recommends in ("true", "false")
+            }
+        except subprocess.CalledProcessError as e:
+            logger.debug(f"Could not measure the apt profile savings: {e.stderr}")
+            return
+        packages = len(resolved["true"]) - len(resolved["false"])
+        size = sum(archive[2] for archive in resolved["true"]) - sum(archive[2] for archive in resolved["false"])
+        self.savings["no_recommends"] = f"saved {packages} package(s), {size / 1_000_000:.1f} MB of downloads"
+
+    def summary(self) -> str:
+        """
+        Formats the applied tweaks and what each of them saved.
+        """
+        lines = [f"Apt profile '{self.name}':"]
+        for tweak in self.tweaks:
+            options = " ".join(f"{key}={value}" for key, value in tweak.options.items())
+            saved = self.savings.get(tweak.name, f"avoided {tweak.avoids} (not measured)")
+            lines.append(f"  {tweak.name:<18} {saved}\n  {'':<18} {options}")
+        return "\n".join(lines)
+
+    def log_summary(self) -> None:
+        """
+        Logs the summary, unless the profile applies no tweak.
+        """
+        if self.tweaks:
+            logger.info(self.summary())
@@ -0,0 +1,163 @@
+import json
+import logging
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any
+
+from core.exceptions import CassetteMismatchError
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+
+class Cassette:
+    """
+    Records the commands executed by `run_command`, or replays them without executing anything.
+
+    In record mode every command is stored with its environment delta, exit code, output and duration. In
+    replay mode `run_command` serves the recorded result instead of starting a process, sleeping for the
+    recorded duration multiplied by `speed` (0 replays instantly). A replayed run therefore exercises the
+    scheduling, streaming and logging code with the timings of the recorded machine, on any Linux box.
+
+    Commands are matched on their argv and environment delta. Identical commands are served in recording
+    order. Apt options pointing into setupwize's temporary directories (e.g. the prefetch archive directory)
+    and the dpkg lock timeout left after waiting for the lock differ between runs and are ignored when
+    matching.
+    """
+
+    def __init__(self, path: str | Path, mode: str, speed: float = 1.0):
+        """
+        Initializes the Cassette.
+
+        Args:
+            path: The cassette file.
+            mode: "record" or "replay".
+            speed: The factor applied to the recorded durations when replaying.
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        if speed < 0:
+            raise ValueError("Replay speed cannot be negative")
+        self.path = Path(path)
+        self.mode = mode
+        self.speed = speed
+        self.facts: dict[str, Any] | None = None
+        self.interactions: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._queues: dict[str, deque[dict[str, Any]]] = defaultdict(deque)
+
+        if mode == "replay":
+            data = json.loads(self.path.read_text())
+            if data.get("version") != CASSETTE_VERSION:
+                raise CassetteMismatchError(f"Unsupported cassette version in '{self.path}'")
+            self.facts = data.get("facts")
+            self.interactions = data["interactions"]
+            for interaction in self.interactions:
+                self._queues[_key(interaction["argv"], interaction["env"])].append(interaction)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(
+        self, argv: list[str], env: dict[str, str] | None, exit_code: int, output: bytes, duration: float
+    ) -> None:
+        """
+        Records the result of an executed command.
+        """
+        with self._lock:
+            self.interactions.append(
+                {
+                    "argv": argv,
+                    "env": env or {},
+                    "exit_code": exit_code,
+                    "duration": round(duration, 6),
+                    # surrogateescape keeps undecodable bytes, json escapes them
+                    "output": output.decode(errors="surrogateescape"),
+                }
+            )
+
+    def replay(self, argv: list[str], env: dict[str, str] | None) -> tuple[bytes, int]:
+        """
+        Serves the next recorded result of a command, after waiting for its scaled duration.
+
+        Returns:
+            The recorded output and exit code.
+
+        Raises:
+            CassetteMismatchError: If the command was not recorded, or was replayed more often than recorded.
+        """
+        with self._lock:
+            queue = self._queues.get(_key(argv, env or {}))
+            if not queue:
+                raise CassetteMismatchError(f"No recorded result left in '{self.path}' for: {argv}")
+            interaction = queue.popleft()
+        if self.speed:
+            time.sleep(interaction["duration"] * self.speed)
+        return interaction["output"].encode(errors="surrogateescape"), interaction["exit_code"]
+
+    def save(self) -> None:
+        """
+        Writes the recorded commands to the cassette file atomically.
+        """
+        if self.replaying:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(f".{self.path.name}.part")
+        partial.write_text(
+            json.dumps({"version": CASSETTE_VERSION, "facts": self.facts, "interactions": self.interactions}, indent=1)
+        )
+        partial.replace(self.path)
+        logger.info(f"Recorded {len(self.interactions)} command(s) to '{self.path}'")
+
+
+def _key(argv: list[str], env: dict[str, str]) -> str:
+    """
+    Builds the matching key of a command, without the apt options that differ between runs.
+    """
+    run_local = f"{tempfile.gettempdir()}/setupwize-"
+    normalized: list[str] = []
+    skip = False
+    for index, arg in enumerate(argv):
+        if skip:
+            skip = False
+            continue
+        option = argv[index + 1] if arg == "-o" and index + 1 < len(argv) else ""
+        if run_local in option or option.startswith("DPkg::Lock::Timeout="):
+            skip = True
+            continue
+        normalized.append(arg)
+    return json.dumps([normalized, sorted(env.items())])
+
+
+_cassette: Cassette | None = None
+
+
+def open_cassette(path: str | Path, mode: str, speed: float = 1.0) -> Cassette:
+    """
+    Starts recording the commands run by `run_command` to the cassette, or replaying them from it.
+    """
+    global _cassette  # noqa: PLW0603
+    _cassette = Cassette(path, mode, speed)
+    return _cassette
+
+
+def get_cassette() -> Cassette | None:
+    """
+    Returns the cassette in use, or None when commands are executed normally.
+    """
+    return _cassette
+
+
+def close_cassette() -> None:
+    """
+    Saves the recorded commands, if any, and goes back to executing commands normally.
+    """
+    global _cassette  # noqa: PLW0603
+    if _cassette:
+        _cassette.save()
+        _cassette = None
@@ -0,0 +1,195 @@
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Shell commands that download something, counted as downloads in the cost estimate
+DOWNLOAD_COMMAND = re.compile(r"\b(?:curl|wget)\b")
+
+# The weight of each field when the query matches it, a hit on the name beats one on the category or description,
+# and whether its characters may be scattered: in a sentence almost any short term would match as a subsequence
+SEARCH_FIELDS = (("name", 3.0, True), ("category", 2.0, True), ("description", 1.0, False))
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    """
+    A package of the catalog, with everything the picker searches and displays.
+
+    Attributes:
+        name: The package name.
+        description: The package description, empty when the manifest has none.
+        category: The package category.
+        apt_packages: The number of apt packages installed, dependencies included.
+        downloads: The number of downloads outside of apt (archives, artifacts, signing keys and curl/wget commands).
+        commands: The number of shell commands run.
+        duration: The wall time of the last successful installation in seconds, if recorded.
+    """
+
+    name: str
+    description: str
+    category: str
+    apt_packages: int = 0
+    downloads: int = 0
+    commands: int = 0
+    duration: float | None = None
+
+    @classmethod
+    def from_manifest(cls, package: dict[str, Any], duration: float | None = None) -> "CatalogEntry":
+        """
+        Builds the entry of a package from its raw manifest, without expanding the facts or creating the tasks.
+        """
+        tasks: list[dict[str, Any]] = package.get("tasks") or []
+        apt_packages = set(package.get("dependencies") or [])
+        downloads = len(package.get("artifacts") or [])
+        commands = 0
+        for task in tasks:
+            if task.get("type") == "apt" and task.get("action") == "install":
+                apt_packages.update(task.get("packages") or [])
+            downloads += bool(task.get("url") or task.get("key_url"))
+            if task.get("command"):
+                commands += 1
+                downloads += len(DOWNLOAD_COMMAND.findall(task["command"]))
+        return cls(
+            name=package["name"],
+            description=package.get("description") or "",
+            category=package.get("category") or "Uncategorized",
+            apt_packages=len(apt_packages),
+            downloads=downloads,
+            commands=commands,
+            duration=duration,
+        )
+
+    @property
+    def cost(self) -> str:
+        """
+        The estimated install cost: the last recorded duration, or what the manifest installs and downloads.
+        """
+        if self.duration is not None:
+            minutes, seconds = divmod(round(self.duration), 60)
+            return f"~{minutes}m{seconds:02d}s" if minutes else f"~{seconds}s"
+        parts = [f"{self.apt_packages} apt"] if self.apt_packages else []
+        if self.downloads:
+            parts.append(f"{self.downloads} dl")
+        return ", ".join(parts) or "light"
+
+
+class CatalogIndex:
+    """
+    An in-memory index of the catalog for incremental fuzzy search.
+
+    The lowercased fields of every entry, and the entries holding each character, are computed once when the
+    index is built. A query is matched as a subsequence of a name or category ("lzg" finds lazygit) and as a
+    substring of a description. Only the entries holding every character of the query are scored, and a query
+    extending the previous one only searches the previous results; single characters are ranked in advance.
+    Each keystroke therefore costs a few milliseconds, even with thousands of packages.
+    """
+
+    def __init__(self, entries: list[CatalogEntry]):
+        """
+        Initializes the CatalogIndex.
+
+        Args:
+            entries: The catalog entries, in their browsing order.
+        """
+        self.entries = entries
+        self._fields = [
+            tuple((getattr(entry, field).lower(), weight, fuzzy) for field, weight, fuzzy in SEARCH_FIELDS)
+            for entry in entries
+        ]
+        self._postings: dict[str, set[int]] = {}
+        for index, fields in enumerate(self._fields):
+            for char in set("".join(text for text, _, _ in fields)):
+                self._postings.setdefault(char, set()).add(index)
+        # the first keystroke matches most of the catalog, its results are ranked in advance
+        self._first_keystroke = {char: self._rank(char, sorted(indexes)) for char, indexes in self._postings.items()}
+        self._last_query = ""
+        self._last_matches = list(range(len(entries)))
+
+    @classmethod
+    def from_catalog(
+        cls, available_packages_data: list[dict[str, Any]], durations: dict[str, float] | None = None
+    ) -> "CatalogIndex":
+        """
+        Builds the index from the parsed package files, sorted by category then name.
+
+        Args:
+            available_packages_data: The parsed YAML files, each holding a list of packages.
+            durations: (Optional) The recorded install duration of the packages, by name.
+        """
+        durations = durations or {}
+        entries = [
+            CatalogEntry.from_manifest(package, durations.get(package["name"]))
+            for package_data in available_packages_data
+            for package in package_data.get("packages") or []
+        ]
+        return cls(sorted(entries, key=lambda entry: (entry.category.lower(), entry.name)))
+
+    def search(self, query: str) -> list[CatalogEntry]:
+        """
+        Returns the entries matching a query, best match first; every entry, in browsing order, for an empty query.
+
+        Whitespace separates terms that must all match, in any field.
+        """
+        query = query.lower().strip()
+        if not query:
+            self._last_query, self._last_matches = "", list(range(len(self.entries)))
+            return list(self.entries)
+
+        if len(query) == 1:
+            matches = self._first_keystroke.get(query, [])
+        # typing one more character can only narrow the previous results
+        elif self._last_query and query.startswith(self._last_query):
+            matches = self._rank(query, self._last_matches)
+        else:
+            # the entries holding every character of the query, intersected from the per-character postings
+            postings = (self._postings.get(char, set()) for char in set(query) - {" "})
+            matches = self._rank(query, sorted(set.intersection(*postings)))
+
+        self._last_query, self._last_matches = query, sorted(matches)
+        return [self.entries[index] for index in matches]
+
+    def _rank(self, query: str, candidates: list[int]) -> list[int]:
+        """
+        Scores the candidate entries against every term of a query and returns the matching ones, best first.
+        """
+        # scattered characters are found by the regex engine, only the matches are scored in Python
+        terms = [(term, re.compile(".*?".join(map(re.escape, term)))) for term in query.split()]
+        scored: list[tuple[float, int]] = []
+        for index in candidates:
+            score = 0.0
+            for term, subsequence in terms:
+                term_score = 0.0
+                for text, weight, fuzzy in self._fields[index]:
+                    field_score = _match(term, text, subsequence if fuzzy else None) * weight
+                    if field_score > term_score:
+                        term_score = field_score
+                if not term_score:
+                    break
+                score += term_score
+            else:
+                scored.append((score, index))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [index for _, index in scored]
+
+
+def _match(term: str, text: str, subsequence: re.Pattern[str] | None) -> float:
+    """
+    Scores a term found in a text: 0 when it does not match, higher for matches at the start of the text or of
+    a word. With a subsequence pattern the term may also match as scattered characters, scored on how many of
+    them follow each other.
+    """
+    position = text.find(term)
+    if position >= 0:
+        return 4.0 if position == 0 else 3.0 if not text[position - 1].isalnum() else 2.0
+    if subsequence is None or not subsequence.search(text):
+        return 0.0
+
+    score, start, previous = 0.0, 0, -2
+    for char in term:
+        position = text.find(char, start)
+        score += 1.0 if position == previous + 1 or position == 0 or not text[position - 1].isalnum() else 0.5
+        previous, start = position, position + 1
+    return score / len(term)
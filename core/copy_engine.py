@@ -0,0 +1,155 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# ioctl request to share the data blocks of two files on copy-on-write filesystems (btrfs, xfs, bcachefs)
+FICLONE = 0x40049409
+
+# errors meaning "this fast path is not available here", the copy falls back to the next strategy
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF}
+
+
+@dataclass
+class CopyStats:
+    """
+    Statistics of a copy operation.
+    """
+
+    files: int = 0
+    bytes: int = 0
+    reflinked: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 1_000_000 / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.files} file(s), {self.bytes / 1_000_000:.2f} MB in {self.seconds:.3f}s "
+            f"({self.files_per_second:.0f} files/s, {self.mb_per_second:.2f} MB/s, {self.reflinked} reflinked)"
+        )
+
+
+class CopyEngine:
+    """
+    Copies files and directory trees using a thread pool.
+
+    The source tree is walked once, directories are created up front and the files are copied concurrently,
+    which hides the per-file syscall latency that dominates trees of many small files. Each file is copied with
+    the cheapest mechanism available: a reflink when source and destination share a copy-on-write filesystem,
+    `copy_file_range` (in-kernel copy) otherwise, and a plain read/write loop as a last resort. Permissions and
+    timestamps are applied through the open file descriptors using the stat results collected by the walk,
+    instead of re-reading them per file like `shutil.copy2`.
+    """
+
+    def __init__(self, workers: int | None = None):
+        """
+        Initializes the CopyEngine.
+
+        Args:
+            workers: The number of copy threads. Defaults to the number of CPUs plus four, capped at 32.
+        """
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+
+    def copy(self, source: str | Path, destination: str | Path) -> CopyStats:
+        """
+        Copies a file or a directory tree, following symbolic links like `shutil.copytree` does by default.
+
+        Args:
+            source: The file or directory to copy.
+            destination: The destination path. Directories are merged into existing ones.
+
+        Returns:
+            The statistics of the copy.
+        """
+        source, destination = Path(source), Path(destination)
+        start = time.perf_counter()
+        stats = CopyStats()
+
+        if not source.is_dir():
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            stat = source.stat()
+            stats.reflinked += self._copy_file(source, destination, stat)
+            stats.files, stats.bytes = 1, stat.st_size
+            stats.seconds = time.perf_counter() - start
+            return stats
+
+        files: list[tuple[Path, Path, os.stat_result]] = []
+        directories: list[tuple[Path, os.stat_result]] = []
+        for root, _, filenames in os.walk(source, followlinks=True):
+            root_path = Path(root)
+            target = destination / root_path.relative_to(source)
+            target.mkdir(parents=True, exist_ok=True)
+            directories.append((target, root_path.stat()))
+            for filename in filenames:
+                file_path = root_path / filename
+                files.append((file_path, target / filename, file_path.stat()))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="copy") as pool:
+            # consuming the results also propagates the exceptions raised by the workers
+            stats.reflinked = sum(pool.map(lambda item: self._copy_file(*item), files))
+        stats.files = len(files)
+        stats.bytes = sum(stat.st_size for _, _, stat in files)
+
+        # directory timestamps change while their content is written, so they are applied last
+        for target, stat in reversed(directories):
+            os.chmod(target, stat.st_mode)
+            os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    @staticmethod
+    def _copy_file(source: Path, destination: Path, stat: os.stat_result) -> bool:
+        """
+        Copies a single file and its metadata.
+
+        Returns:
+            True if the file was reflinked, False if its content was copied.
+        """
+        reflinked = False
+        with source.open("rb") as src, destination.open("wb") as dst:
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                reflinked = True
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                _copy_range(src_fd, dst_fd, stat.st_size, src, dst)
+
+            os.fchmod(dst_fd, stat.st_mode)
+            os.utime(dst_fd, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        return reflinked
+
+
+def _copy_range(src_fd: int, dst_fd: int, size: int, src: BinaryIO, dst: BinaryIO) -> None:
+    """
+    Copies the file content in the kernel with copy_file_range, falling back to a userspace copy.
+    """
+    copied = 0
+    try:
+        while copied < size:
+            count = os.copy_file_range(src_fd, dst_fd, size - copied)
+            if count == 0:
+                break
+            copied += count
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRNOS or copied:
+            raise
+        shutil.copyfileobj(src, dst)
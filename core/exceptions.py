@@ -29,3 +29,27 @@ class PackageNameMismatchError(SetUpWizeError):
     """Raised when the package name in the YAML file does not match the filename."""
 
     pass
+
+
+class MissingAnswerError(SetUpWizeError):
+    """Raised when an unattended run needs an answer that the profile file does not provide."""
+
+    pass
+
+
+class DependencyCycleError(SetUpWizeError):
+    """Raised when packages require each other in a cycle."""
+
+    pass
+
+
+class CassetteMismatchError(SetUpWizeError):
+    """Raised when a replayed command was not recorded in the cassette."""
+
+    pass
+
+
+class CommandTimeoutError(SetUpWizeError):
+    """Raised when a command is killed for exceeding its timeout or stall timeout."""
+
+    pass
@@ -0,0 +1,272 @@
+import re
+import shlex
+from dataclasses import dataclass, field
+from typing import Any
+
+from core.finalizers import IMAGE_FINALIZER_KINDS, Finalizer, finalizer_commands, shell_command
+from core.packages import Package
+from core.tasks import AptTask, ArchiveTask, ConfigurationTask, GnomeSettingsTask, Task
+from utils import SystemFacts
+
+DEFAULT_BASE_IMAGE = "ubuntu:24.04"
+
+# Makes the configurations available to a RUN instruction without copying them into a layer
+CONFIGURATIONS_MOUNT = "--mount=type=bind,source=configurations,target=configurations "
+
+# Terminates the heredoc of a Dockerfile RUN instruction, chosen not to clash with the manifests' own heredocs
+HEREDOC_DELIMITER = "SETUPWIZE_EOF"
+
+# How an exported script probes each fact on the system it runs on, rather than using the exporting host's
+SHELL_FACTS = {
+    "distro": '$(. /etc/os-release && echo "$ID")',
+    "version": '$(. /etc/os-release && echo "$VERSION_ID")',
+    "codename": '$(. /etc/os-release && echo "$VERSION_CODENAME")',
+    "arch": "$(dpkg --print-architecture)",
+    "machine": "$(uname -m)",
+    "desktop": '"${XDG_CURRENT_DESKTOP:-}"',
+    "session_type": '"${XDG_SESSION_TYPE:-tty}"',
+    "cpu_count": "$(nproc)",
+    "memory_mb": "$(awk '/^MemTotal:/ { print int($2 / 1024) }' /proc/meminfo)",
+}
+
+# Stands for a fact in the rendered manifests; only made of characters shlex.quote leaves unquoted
+FACT_PLACEHOLDER = re.compile(r"@facts\.(\w+)@")
+
+
+@dataclass
+class ExportPlan:
+    """
+    The tasks of the selected packages, split by how often they change.
+
+    Attributes:
+        names: The exported packages, in installation order.
+        apt_packages: The apt packages installed up front, sorted: they only change with the package selection.
+        steps: The install steps of every package, in installation order.
+        configurations: The configuration tasks, which change most often and therefore run last.
+        finalizers: The finalizers requested by the apt installs hoisted into the apt layer.
+    """
+
+    names: list[str]
+    apt_packages: list[str] = field(default_factory=list)
+    steps: list[tuple[str, list[Task]]] = field(default_factory=list)
+    configurations: list[tuple[str, list[Task]]] = field(default_factory=list)
+    finalizers: list[Finalizer] = field(default_factory=list)
+
+
+def export_facts() -> SystemFacts:
+    """
+    Returns the facts to render exported manifests with: placeholders that the exporters replace with shell
+    variables, set by probing the system the script or image is built on.
+    """
+    placeholders: dict[str, Any] = {name: f"@facts.{name}@" for name in SHELL_FACTS}
+    return SystemFacts(**placeholders)
+
+
+def _expand_facts(lines: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Replaces the fact placeholders of a shell script with variables, expanded in any quoting context.
+
+    Returns:
+        The assignments of the variables used, which must run first, and the script.
+    """
+    script = "\n".join(lines)
+    used: list[str] = []
+    output: list[str] = []
+    quote = ""
+    position = 0
+    while position < len(script):
+        char = script[position]
+        match = FACT_PLACEHOLDER.match(script, position) if char == "@" else None
+        if match:
+            name = match.group(1)
+            used.extend([name] if name not in used else [])
+            variable = f"${{SETUPWIZE_{name.upper()}}}"
+            # a single-quoted string is closed around the double-quoted expansion
+            output.append({"'": f"'\"{variable}\"'", '"': variable}.get(quote, f'"{variable}"'))
+            position = match.end()
+            continue
+        if char == "\\" and quote != "'":
+            output.append(script[position : position + 2])
+            position += 2
+            continue
+        if char == "#" and not quote and (position == 0 or script[position - 1] in " \t\n;"):
+            # comments are copied as they are, their quotes do not open strings
+            end = script.find("\n", position)
+            end = len(script) if end < 0 else end
+            output.append(script[position:end])
+            position = end
+            continue
+        if char in "'\"" and quote in ("", char):
+            quote = "" if quote else char
+        output.append(char)
+        position += 1
+    if not used:
+        return [], lines
+    return [f"SETUPWIZE_{name.upper()}={SHELL_FACTS[name]}" for name in used], "".join(output).split("\n")
+
+
+def plan_export(packages: list[Package]) -> ExportPlan:
+    """
+    Splits the tasks of the packages into the stable apt layer, the install steps and the configuration copies.
+
+    Only the unguarded apt installs leading a package (and its `dependencies`) are hoisted into the apt layer; an apt
+    install following a shell task, such as one adding a repository, stays in place. Likewise, only the
+    configuration tasks ending a package are moved after every install step, so no step runs before one it
+    may depend on.
+
+    Args:
+        packages: The packages to export, in installation order.
+
+    Returns:
+        The export plan.
+    """
+    plan = ExportPlan(names=[package.name for package in packages])
+    apt_packages: set[str] = set()
+    for package in packages:
+        apt_packages.update(package.dependencies)
+
+        leading = 0
+        for task in package.tasks:
+            # the apt layer refreshes the package lists itself, leading updates are dropped
+            if not isinstance(task, AptTask) or task.action not in ("install", "update") or task.guard:
+                break
+            if task.action == "install":
+                apt_packages.update(task.package)
+            plan.finalizers.extend(finalizer for finalizer in task.finalize if finalizer not in plan.finalizers)
+            leading += 1
+        tasks = package.tasks[leading:]
+
+        # the compiled archive and repository tasks download and extract with these tools
+        for task in tasks:
+            if isinstance(task, AptTask) and task.key_url:
+                apt_packages.update(["ca-certificates", "curl"])
+            if isinstance(task, ArchiveTask):
+                apt_packages.update(["ca-certificates", "curl"] if "://" in task.source else [])
+                apt_packages.update(["unzip"] if task.archive_format == "zip" else [])
+
+        configurations: list[Task] = []
+        while tasks and isinstance(tasks[-1], ConfigurationTask):
+            configurations.insert(0, tasks.pop())
+
+        if tasks:
+            plan.steps.append((package.name, tasks))
+        if configurations:
+            plan.configurations.append((package.name, configurations))
+
+    plan.apt_packages = sorted(apt_packages)
+    return plan
+
+
+def export_shell(packages: list[Package]) -> str:
+    """
+    Compiles the packages into a standalone POSIX shell script.
+
+    The script expects the `configurations` directory next to it, like setupwize itself. The packages are
+    expected to be rendered with `export_facts()`: the facts are probed by the script where it runs.
+
+    Args:
+        packages: The packages to export, in installation order.
+
+    Returns:
+        The script.
+    """
+    plan = plan_export(packages)
+    header = [
+        "#!/bin/sh",
+        f"# Generated by setupwize for: {' '.join(plan.names)}",
+        "set -e",
+        "export DEBIAN_FRONTEND=noninteractive",
+        "# configuration sources are relative to the directory of the script",
+        'cd "$(dirname "$0")"',
+        "",
+    ]
+    lines: list[str] = []
+    if plan.apt_packages:
+        lines += [
+            "# apt packages",
+            "sudo apt-get update -y",
+            shlex.join(["sudo", "apt-get", "install", "-y", *plan.apt_packages]),
+            "",
+        ]
+    # like a run, each finalizer runs once: before the first task needing it, or at the end
+    pending = list(plan.finalizers)
+    for name, tasks in [*plan.steps, *plan.configurations]:
+        lines.append(f"# {name}")
+        for task in tasks:
+            due = [finalizer for finalizer in pending if finalizer in task.needs]
+            lines.extend(shell_command(command) for command in finalizer_commands(due, for_shell=True))
+            pending = [finalizer for finalizer in pending if finalizer not in due]
+            lines.extend(task.to_guarded_shell())
+            pending.extend(finalizer for finalizer in task.finalize if finalizer not in pending)
+        lines.append("")
+    if pending:
+        lines += ["# finalizers", *(shell_command(command) for command in finalizer_commands(pending, True)), ""]
+    assignments, lines = _expand_facts(lines)
+    if assignments:
+        header += ["# system facts, probed where the script runs", *assignments, ""]
+    return "\n".join([*header, *lines])
+
+
+def export_dockerfile(packages: list[Package], base_image: str = DEFAULT_BASE_IMAGE) -> str:
+    """
+    Compiles the packages into a Dockerfile layered for cache hits.
+
+    The layers go from the most stable to the most volatile: one layer installing every apt package (sorted,
+    so it only changes with the selection), one layer per package for its install steps, then the
+    configurations, so editing a configuration file only rebuilds the last layers. The configurations are bind
+    mounted into the steps that copy them instead of being copied into a layer of their own. The build context
+    is the setupwize directory. GNOME settings are skipped, there is no desktop session in an image build, and
+    so are the service and group finalizers; the cache finalizers run once, in the last layer. Like with
+    `export_shell`, the facts are probed in the image, by each instruction using them.
+
+    Args:
+        packages: The packages to export, in installation order.
+        base_image: The image to build on.
+
+    Returns:
+        The Dockerfile.
+    """
+    plan = plan_export(packages)
+    lines = [
+        "# syntax=docker/dockerfile:1",
+        f"# Generated by setupwize for: {' '.join(plan.names)}",
+        f"FROM {base_image}",
+        "ENV DEBIAN_FRONTEND=noninteractive",
+        "",
+        "# apt packages: the most stable layer, sudo is used by the manifests' commands",
+        "RUN " + " && ".join(_apt_layer(plan.apt_packages)),
+        "",
+    ]
+    for name, tasks in plan.steps:
+        lines += [f"# {name}", *_run_instruction(tasks), ""]
+
+    if plan.configurations:
+        lines += ["# configurations change most often, they come last", "WORKDIR /tmp/setupwize", ""]
+        for name, tasks in plan.configurations:
+            lines += [f"# {name}", *_run_instruction(tasks, CONFIGURATIONS_MOUNT), ""]
+        lines += ["WORKDIR /", ""]
+
+    # services and group memberships do not exist at build time, only the caches are refreshed, once
+    requested = list(plan.finalizers)
+    for _, tasks in [*plan.steps, *plan.configurations]:
+        requested.extend(finalizer for task in tasks for finalizer in task.finalize)
+    finalizers = [finalizer for finalizer in requested if finalizer.kind in IMAGE_FINALIZER_KINDS]
+    if finalizers:
+        commands = [shell_command(command) for command in finalizer_commands(finalizers, for_shell=True)]
+        lines += ["# finalizers", "RUN " + " && ".join(commands), ""]
+    return "\n".join(lines)
+
+
+def _run_instruction(tasks: list[Task], flags: str = "") -> list[str]:
+    body = [line for task in tasks if not isinstance(task, GnomeSettingsTask) for line in task.to_guarded_shell()]
+    if not body:
+        return ["# (only GNOME settings, skipped)"]
+    assignments, body = _expand_facts(body)
+    return [f"RUN {flags}<<'{HEREDOC_DELIMITER}'", "set -e", *assignments, *body, HEREDOC_DELIMITER]
+
+
+def _apt_layer(apt_packages: list[str]) -> list[str]:
+    assignments, commands = _expand_facts(
+        ["apt-get update -y", shlex.join(["apt-get", "install", "-y", "sudo", *apt_packages])]
+    )
+    return [*assignments, *commands]
@@ -0,0 +1,184 @@
+import getpass
+import logging
+import os
+import shlex
+import shutil
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from core.cassette import get_cassette
+from core.exceptions import SetUpWizeError
+from core.qos import FINALIZER_RESOURCE_CLASSES, resource_class
+from core.run_cmd import run_command
+from core.tracers.events import emit_event, task_scope
+
+logger = logging.getLogger(__name__)
+
+# The finalizer kinds, in the order they run: caches first, then groups, then the services
+FINALIZER_KINDS = ("fc-cache", "desktop-database", "group", "systemctl daemon-reload", "systemctl restart")
+
+# The finalizers that make sense in an image build, without a systemd instance or a login user
+IMAGE_FINALIZER_KINDS = ("fc-cache", "desktop-database")
+
+APPLICATIONS_DIR = "~/.local/share/applications"
+
+
+@dataclass(frozen=True)
+class Finalizer:
+    """
+    An idempotent post-install step that several tasks may request, run once instead of after each of them.
+
+    Attributes:
+        kind: One of `FINALIZER_KINDS`.
+        argument: The unit to restart or the group to join, empty for the other kinds.
+    """
+
+    kind: str
+    argument: str = ""
+
+    @classmethod
+    def parse(cls, spec: str) -> "Finalizer":
+        """
+        Parses a finalizer as written in a manifest: `fc-cache`, `desktop-database`, `group <name>`,
+        `systemctl daemon-reload` or `systemctl restart <unit>`.
+
+        Raises:
+            ValueError: If the finalizer is not recognized.
+        """
+        words = spec.split()
+        for kind in FINALIZER_KINDS:
+            kind_words = kind.split()
+            if words[: len(kind_words)] != kind_words:
+                continue
+            arguments = words[len(kind_words) :]
+            takes_argument = kind in ("group", "systemctl restart")
+            if len(arguments) == int(takes_argument):
+                return cls(kind, arguments[0] if arguments else "")
+        raise ValueError(f"Unrecognized finalizer: {spec}")
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.argument}".strip()
+
+
+def finalizer_commands(finalizers: Iterable[Finalizer], for_shell: bool = False) -> list[list[str]]:
+    """
+    Builds the commands running the finalizers, in `FINALIZER_KINDS` order. Finalizers of the same kind share a
+    single command: every unit is restarted by one `systemctl restart`, every group joined by one `usermod`.
+
+    Args:
+        finalizers: The finalizers to run, duplicates are ignored.
+        for_shell: Whether the commands are exported, with `$USER` and `~` left to the shell to expand and a plain
+            `sudo`.
+
+    Returns:
+        The commands, as argument lists.
+    """
+    arguments: dict[str, list[str]] = {}
+    for finalizer in finalizers:
+        kind_arguments = arguments.setdefault(finalizer.kind, [])
+        if finalizer.argument not in kind_arguments:
+            kind_arguments.append(finalizer.argument)
+
+    # an exported script may run where `sudo -S` cannot read a password from the standard input
+    sudo = ["sudo"] if for_shell else ["sudo", "-S"]
+    user = "$USER" if for_shell else os.environ.get("USER") or getpass.getuser()
+    commands: list[list[str]] = []
+    for kind in (kind for kind in FINALIZER_KINDS if kind in arguments):
+        if kind == "fc-cache":
+            commands.append(["fc-cache", "-f"])
+        elif kind == "desktop-database":
+            applications = APPLICATIONS_DIR if for_shell else str(Path(APPLICATIONS_DIR).expanduser())
+            commands.append(["update-desktop-database", applications])
+        elif kind == "group":
+            commands.append([*sudo, "usermod", "-aG", ",".join(arguments[kind]), user])
+        else:
+            commands.append([*sudo, *kind.split(), *arguments[kind]])
+    return commands
+
+
+def shell_command(command: list[str]) -> str:
+    """
+    Compiles an exported finalizer command into a shell line skipping it when its program is not installed,
+    like a run does, and leaving `$USER` and a leading `~` to the shell.
+    """
+    line = " ".join(
+        '"$USER"' if arg == "$USER" else f"~/{shlex.quote(arg[2:])}" if arg.startswith("~/") else shlex.quote(arg)
+        for arg in command
+    )
+    return f"if command -v {_program(command)} >/dev/null 2>&1; then {line}; fi"
+
+
+def _program(command: list[str]) -> str:
+    return next(arg for arg in command if arg != "sudo" and not arg.startswith("-"))
+
+
+class FinalizerQueue:
+    """
+    Collects the finalizers requested by the tasks of the run and runs each of them once: before the first
+    later task that needs it, or at the end of the run.
+
+    A finalizer requested again after it ran is queued again, since the task requesting it changed the system
+    since then (e.g. a second service configuration needs a second restart).
+    """
+
+    def __init__(self) -> None:
+        # the pending finalizers, in request order, with the packages that requested them
+        self.pending: dict[Finalizer, list[str]] = {}
+
+    def request(self, finalizers: list[Finalizer], package: str) -> None:
+        """
+        Queues the finalizers requested by a task of a package.
+        """
+        for finalizer in finalizers:
+            requested_by = self.pending.setdefault(finalizer, [])
+            if package not in requested_by:
+                requested_by.append(package)
+
+    def flush(self, finalizers: list[Finalizer] | None = None, verbose: bool = False) -> None:
+        """
+        Runs the pending finalizers, all of them or only the given ones if they are pending.
+
+        A failing finalizer is logged and does not stop the others, like the inline commands it replaces.
+
+        Args:
+            finalizers: (Optional) The finalizers needed now; every pending one when omitted.
+            verbose: Whether to display the output of the commands.
+        """
+        due = [finalizer for finalizer in self.pending if finalizers is None or finalizer in finalizers]
+        if not due:
+            return
+        requested_by = sorted({package for finalizer in due for package in self.pending.pop(finalizer)})
+        logger.info(f"Running finalizers {', '.join(map(str, due))} (requested by {', '.join(requested_by)})")
+
+        cassette = get_cassette()
+        for command in finalizer_commands(due):
+            program = _program(command)
+            # a replayed run serves the recorded result, the program does not need to exist here
+            if not (cassette and cassette.replaying) and not shutil.which(program):
+                logger.warning(f"Skipping finalizer '{shlex.join(command)}': {program} is not installed")
+                continue
+            try:
+                with (
+                    task_scope("finalize", program, -1),
+                    resource_class(FINALIZER_RESOURCE_CLASSES.get(program, "disk")),
+                ):
+                    _, returncode = run_command(command, verbose=verbose)
+            except SetUpWizeError as e:
+                logger.warning(f"Finalizer '{shlex.join(command)}' failed: {e}")
+                continue
+            emit_event("finalizer", command=command, requested_by=requested_by, exit_code=returncode)
+            if returncode != 0:
+                logger.warning(f"Finalizer '{shlex.join(command)}' exited with code {returncode}")
+        if any(finalizer.kind == "group" for finalizer in due):
+            logger.info("Log out and back in for the new group memberships to take effect")
+
+
+_finalizer_queue = FinalizerQueue()
+
+
+def get_finalizer_queue() -> FinalizerQueue:
+    """
+    Returns the finalizers requested so far in the run.
+    """
+    return _finalizer_queue
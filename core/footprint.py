@@ -0,0 +1,369 @@
+import logging
+import os
+import shutil
+import subprocess
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from types import TracebackType
+from typing import TYPE_CHECKING, Any
+
+from core.packages import Package
+from core.run_cmd import run_command
+from core.tasks import ConfigurationTask
+from utils import installed_apt_packages
+
+if TYPE_CHECKING:
+    from core.state import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Where packages install files outside of apt. ~/.config is left out on purpose: running applications change
+# it all the time, configuration destinations are tracked from the manifests instead.
+WATCHED_PREFIXES = (
+    "/usr/local/bin",
+    "/usr/local/share",
+    "/opt",
+    "/etc/apt/sources.list.d",
+    "/etc/apt/keyrings",
+    "~/.local/bin",
+    "~/.local/share/fonts",
+)
+
+
+@dataclass
+class Footprint:
+    """
+    What installing a package changed on the system.
+
+    Attributes:
+        apt_packages: The apt packages that were not installed before, automatic dependencies included.
+        created: The files and directories created under the watched prefixes.
+        modified: The files changed under the watched prefixes; their previous content is not kept.
+        configurations: The configuration destinations written, each with the copy of what it replaced, kept
+            next to the state file (None when the destination did not exist).
+    """
+
+    apt_packages: list[str] = field(default_factory=list)
+    created: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    configurations: list[tuple[str, str | None]] = field(default_factory=list)
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Footprint":
+        return cls(
+            apt_packages=data.get("apt_packages", []),
+            created=data.get("created", []),
+            modified=data.get("modified", []),
+            configurations=[(destination, backup) for destination, backup in data.get("configurations", [])],
+        )
+
+    def merge(self, other: "Footprint") -> "Footprint":
+        """
+        Combines the footprints of two installations of the same package, e.g. a reinstall after a change.
+        """
+        configurations = dict(self.configurations)
+        for destination, backup in other.configurations:
+            # the first record holds what was there before setupwize, later installs replaced its own files
+            configurations.setdefault(destination, backup)
+        created = sorted({*self.created, *other.created})
+        return Footprint(
+            apt_packages=sorted({*self.apt_packages, *other.apt_packages}),
+            created=created,
+            modified=sorted({*self.modified, *other.modified} - set(created)),
+            configurations=list(configurations.items()),
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.apt_packages or self.created or self.modified or self.configurations)
+
+    def paths(self) -> set[str]:
+        """
+        Returns the paths uninstalling the package would remove: its created files and its configurations.
+        """
+        return {*self.created, *(destination for destination, _ in self.configurations)}
+
+
+def scan(prefixes: tuple[str, ...] = WATCHED_PREFIXES) -> dict[str, tuple[int, int]]:
+    """
+    Lists every file and directory under the prefixes with its modification time and size, without following
+    symbolic links.
+    """
+    entries: dict[str, tuple[int, int]] = {}
+    stack = [Path(prefix).expanduser() for prefix in prefixes]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    stat = entry.stat(follow_symlinks=False)
+                    entries[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+        except OSError:
+            continue
+    return entries
+
+
+def _configuration_targets(package: Package) -> list[tuple[Path, Path]]:
+    """
+    Lists the paths the configuration tasks of a package write, with the backup they make of an existing one.
+    """
+    targets: list[tuple[Path, Path]] = []
+    for task in package.tasks:
+        if not isinstance(task, ConfigurationTask):
+            continue
+        for config_path, dest in zip(task.config_paths or [], task.destinations or [], strict=False):
+            source, destination = Path(config_path).expanduser(), Path(dest).expanduser()
+            # like ConfigurationTask, a file copied onto a directory lands inside it
+            if source.is_file() and destination.is_dir():
+                destination = destination / source.name
+            targets.append((destination, destination.with_suffix(".bak")))
+    return targets
+
+
+class FootprintRecorder:
+    """
+    Records the footprint of a package installation by comparing the system before and after it, and adds it
+    to the package's state. The scan only stats the watched prefixes, it does not read any file.
+
+    The configuration destinations setupwize has not written yet are copied to a `backups` directory next to
+    the state file before the installation: the `.bak` files of the configuration tasks are overwritten on
+    every re-apply, so they only hold the user's original until then. The `.bak` files are setupwize's own
+    and part of the footprint.
+
+    Whatever else changes the watched prefixes during the installation, other processes included, shows up in
+    the scan as well. Files owned by a dpkg package are therefore left out, apt removes them, and `uninstall`
+    keeps the paths another package's footprint claims.
+
+    Example:
+        ```python
+        with FootprintRecorder(package, state):
+            package.install()
+        ```
+    """
+
+    def __init__(self, package: Package, state: "StateStore", prefixes: tuple[str, ...] = WATCHED_PREFIXES):
+        """
+        Initializes the FootprintRecorder.
+
+        Args:
+            package: The package about to be installed.
+            state: The state store receiving the footprint.
+            prefixes: The directories scanned for created and modified files.
+        """
+        self.package = package
+        self.state = state
+        self.prefixes = prefixes
+        self.footprint = Footprint()
+
+    def __enter__(self) -> "FootprintRecorder":
+        self._apt_before = installed_apt_packages()
+        self._files_before = scan(self.prefixes)
+        previous = self.state.footprint(self.package.name)
+        recorded = {destination for destination, _ in previous.configurations} if previous else set()
+        backups_dir = self.state.backups_dir(self.package.name)
+        self._targets = [
+            (
+                destination,
+                backup,
+                destination.exists(),
+                _stat(backup),
+                None if str(destination) in recorded else _save_original(destination, backups_dir),
+            )
+            for destination, backup in _configuration_targets(self.package)
+        ]
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        # a failed installation leaves a partial footprint, which is recorded all the same
+        files_after = scan(self.prefixes)
+        self.footprint.apt_packages = sorted(installed_apt_packages() - self._apt_before)
+        created = [path for path in files_after if path not in self._files_before]
+        self.footprint.created = sorted(set(created) - _dpkg_owned(created))
+        self.footprint.modified = sorted(
+            path
+            for path, stat in files_after.items()
+            if path in self._files_before and stat != self._files_before[path] and not Path(path).is_dir()
+        )
+        for destination, backup, existed, backup_stat, original in self._targets:
+            replaced = backup.exists() and _stat(backup) != backup_stat
+            if not existed and destination.exists():
+                self.footprint.configurations.append((str(destination), None))
+            elif existed and replaced:
+                self.footprint.configurations.append((str(destination), str(original or backup)))
+            elif original:
+                # the destination was left as it was, its copy is not needed
+                _remove([str(original)], verbose=False)
+            if replaced:
+                self.footprint.created.append(str(backup))
+        if self.footprint:
+            self.state.record_footprint(self.package.name, self.footprint)
+
+
+def _save_original(destination: Path, backups_dir: Path) -> Path | None:
+    """
+    Copies an existing configuration destination under the backups directory, keeping its absolute path.
+
+    Returns:
+        The copy, or None if the destination does not exist or cannot be copied.
+    """
+    if not destination.exists() and not destination.is_symlink():
+        return None
+    copy = backups_dir / destination.relative_to(destination.anchor)
+    try:
+        if copy.exists() or copy.is_symlink():
+            _remove([str(copy)], verbose=False)
+        copy.parent.mkdir(parents=True, exist_ok=True)
+        if destination.is_dir() and not destination.is_symlink():
+            shutil.copytree(destination, copy, symlinks=True)
+        else:
+            shutil.copy2(destination, copy, follow_symlinks=False)
+    except OSError as e:
+        logger.warning(f"Could not keep a copy of '{destination}', its '.bak' file is the only backup: {e}")
+        return None
+    return copy
+
+
+def _dpkg_owned(paths: list[str], batch_size: int = 512) -> set[str]:
+    """
+    Returns the paths that belong to an installed dpkg package, e.g. the files of a .deb unpacked under /opt.
+    """
+    owned: set[str] = set()
+    for start in range(0, len(paths), batch_size):
+        try:
+            result = subprocess.run(  # noqa: S603
+                ["dpkg-query", "-S", *paths[start : start + batch_size]],  # noqa: S607
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+        except OSError:
+            return owned
+        # 'package1, package2: /path' lines, unowned paths are reported on the standard error
+        owned.update(
+            line.split(": ", 1)[1]
+            for line in result.stdout.splitlines()
+            if ": " in line and not line.startswith("diversion")
+        )
+    return owned
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.lstat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def uninstall(
+    footprint: Footprint,
+    keep_apt_packages: set[str] | None = None,
+    verbose: bool = False,
+    keep_paths: set[str] | None = None,
+) -> None:
+    """
+    Reverses a footprint: restores or removes the configurations, removes the created files, then removes the
+    apt packages that were newly installed.
+
+    Args:
+        footprint: The footprint recorded when the package was installed.
+        keep_apt_packages: (Optional) Apt packages still needed by other installed packages.
+        verbose: Whether to display the output of the commands.
+        keep_paths: (Optional) Paths claimed by the footprints of other installed packages; neither they nor
+            the directories holding them are removed.
+    """
+    claimed = keep_paths or set()
+    shared = sorted(path for path in footprint.paths() if _is_claimed(path, claimed))
+    if shared:
+        logger.warning(f"Keeping the paths other packages also installed: {', '.join(shared)}")
+
+    for destination, backup in footprint.configurations:
+        if destination in shared:
+            continue
+        _remove([destination], verbose)
+        if backup and Path(backup).exists():
+            shutil.move(backup, destination)
+            logger.info(f"Restored '{destination}' from '{backup}'")
+
+    # deepest paths first, so directories are empty by the time they are removed
+    created = sorted(
+        (path for path in footprint.created if path not in shared), key=lambda path: path.count("/"), reverse=True
+    )
+    _remove([path for path in created if not Path(path).is_dir() or Path(path).is_symlink()], verbose)
+    for directory in (path for path in created if Path(path).is_dir() and not Path(path).is_symlink()):
+        try:
+            Path(directory).rmdir()
+        except PermissionError:
+            run_command(["sudo", "-S", "rmdir", "--ignore-fail-on-non-empty", directory], verbose=verbose)
+        except OSError:
+            logger.warning(f"Keeping '{directory}', it is not empty")
+
+    if footprint.modified:
+        logger.warning(f"Files modified by the package were left in place: {', '.join(footprint.modified)}")
+
+    installed = installed_apt_packages()
+    apt_packages = [
+        name for name in footprint.apt_packages if name in installed and name not in (keep_apt_packages or set())
+    ]
+    if apt_packages:
+        _remove_apt_packages(apt_packages, verbose)
+
+
+def _is_claimed(path: str, claimed: set[str]) -> bool:
+    return path in claimed or any(other.startswith(f"{path}/") for other in claimed)
+
+
+def _remove_apt_packages(apt_packages: list[str], verbose: bool) -> None:
+    """
+    Removes the packages installed explicitly, then those of their automatic dependencies nothing else needs.
+
+    The automatic dependencies are not removed by name: one of them may still be needed by a package installed
+    later. Only the ones `apt-get autoremove` would remove are, leaving every unrelated orphan in place.
+    """
+    automatic = set(_apt_query(["apt-mark", "showauto", *apt_packages]).split())
+    manual = [name for name in apt_packages if name not in automatic]
+    if manual:
+        run_command(["sudo", "-S", "apt-get", "remove", "-y", *manual], verbose=verbose)
+
+    # 'Remv libfoo1 [1.2-3]' lines of the simulated autoremove
+    orphans = {
+        line.split()[1] for line in _apt_query(["apt-get", "-s", "autoremove"]).splitlines() if line.startswith("Remv ")
+    }
+    dependencies = [name for name in apt_packages if name in automatic and name in orphans]
+    if dependencies:
+        run_command(["sudo", "-S", "apt-get", "remove", "-y", *dependencies], verbose=verbose)
+
+
+def _apt_query(cmd: list[str]) -> str:
+    """
+    Runs a read-only apt command, which needs neither root nor the dpkg lock, and returns its output.
+    """
+    return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout  # noqa: S603
+
+
+def _remove(paths: list[str], verbose: bool) -> None:
+    """
+    Removes files, symbolic links or directory trees, through sudo when the parent directory is not writable.
+    """
+    privileged: list[str] = []
+    for path in paths:
+        target = Path(path)
+        if not target.exists() and not target.is_symlink():
+            continue
+        if not os.access(target.parent, os.W_OK):
+            privileged.append(path)
+        elif target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        else:
+            target.unlink()
+    if privileged:
+        run_command(["sudo", "-S", "rm", "-rf", "--", *privileged], verbose=verbose)
@@ -1,7 +1,15 @@
 import logging
 from typing import Any
 
+from core.catalog import CatalogEntry, CatalogIndex
+
 import questionary
+from prompt_toolkit.application import Application
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.key_binding import KeyBindings, KeyPressEvent
+from prompt_toolkit.layout import BufferControl, Dimension, FormattedTextControl, HSplit, Layout, Window
+from prompt_toolkit.layout.processors import BeforeInput
 
 logger = logging.getLogger(__name__)
 
@@ -17,14 +25,163 @@ questionary_style = questionary.Style(
     ]
 )
 
+# Lines taken by the prompt, the search field and the status line
+PICKER_CHROME_LINES = 4
+
+
+class PackagePicker:
+    """
+    A single-screen package picker: typing filters the catalog with a fuzzy search, Tab toggles the package
+    under the cursor and Enter confirms the selection, which survives changing the query.
+    """
+
+    def __init__(self, index: CatalogIndex, default_packages: list[str]):
+        """
+        Initializes the PackagePicker.
+
+        Args:
+            index: The catalog index searched on every keystroke.
+            default_packages: The package names pre-selected.
+        """
+        self.index = index
+        self.selected = {entry.name for entry in index.entries if entry.name in default_packages}
+        self.results: list[CatalogEntry] = index.entries
+        self.cursor = 0
+        self.offset = 0
+        self._name_width = max((len(entry.name) for entry in index.entries), default=0)
+        self._category_width = max((len(entry.category) for entry in index.entries), default=0)
+
+        self.search = Buffer(multiline=False, on_text_changed=self._on_search)
+        self.app: Application[list[str] | None] = Application(
+            layout=Layout(
+                HSplit(
+                    [
+                        Window(FormattedTextControl(self._prompt), height=1),
+                        Window(
+                            BufferControl(self.search, input_processors=[BeforeInput("Search: ", "class:question")]),
+                            height=1,
+                        ),
+                        Window(FormattedTextControl(self._rows), height=lambda: Dimension(max=self._visible_rows())),
+                        Window(FormattedTextControl(self._status), height=1),
+                    ]
+                ),
+                focused_element=self.search,
+            ),
+            key_bindings=self._key_bindings(),
+            style=questionary_style,
+            full_screen=False,
+        )
+
+    def run(self) -> list[str] | None:
+        """
+        Shows the picker until the selection is confirmed.
+
+        Returns:
+            The selected package names in catalog order, or None if the picker was cancelled.
+        """
+        return self.app.run()
+
+    def _on_search(self, buffer: Buffer) -> None:
+        self.results = self.index.search(buffer.text)
+        self.cursor = self.offset = 0
+
+    def _visible_rows(self) -> int:
+        return max(1, min(len(self.results), self.app.output.get_size().rows - PICKER_CHROME_LINES))
+
+    def _move(self, delta: int) -> None:
+        if not self.results:
+            return
+        self.cursor = max(0, min(self.cursor + delta, len(self.results) - 1))
+        rows = self._visible_rows()
+        if self.cursor < self.offset:
+            self.offset = self.cursor
+        elif self.cursor >= self.offset + rows:
+            self.offset = self.cursor - rows + 1
+
+    def _prompt(self) -> StyleAndTextTuples:
+        return [
+            ("class:qmark", "? "),
+            ("class:question", "Select packages to install "),
+            ("class:instruction", "(type to search, <tab> to toggle, <enter> to confirm, <esc> to cancel)"),
+        ]
+
+    def _rows(self) -> StyleAndTextTuples:
+        width = self.app.output.get_size().columns
+        fragments: StyleAndTextTuples = []
+        for position in range(self.offset, min(self.offset + self._visible_rows(), len(self.results))):
+            entry = self.results[position]
+            current, checked = position == self.cursor, entry.name in self.selected
+            line = (
+                f"{entry.name:<{self._name_width}}  {entry.category:<{self._category_width}}  "
+                f"{entry.cost:>14}  {entry.description}"
+            )
+            fragments.append(("class:pointer", "» " if current else "  "))
+            fragments.append(("class:selected" if checked else "", "● " if checked else "○ "))
+            fragments.append(("class:selected" if checked else "", line[: max(width - 5, 0)]))
+            fragments.append(("", "\n"))
+        if not self.results:
+            return [("class:instruction", "  No package matches the search")]
+        # no newline after the last row
+        return fragments[:-1]
+
+    def _status(self) -> StyleAndTextTuples:
+        return [
+            (
+                "class:instruction",
+                f"  {len(self.selected)} selected, {len(self.results)}/{len(self.index.entries)} shown",
+            )
+        ]
+
+    def _key_bindings(self) -> KeyBindings:
+        bindings = KeyBindings()
+
+        @bindings.add("up")
+        def _(event: KeyPressEvent) -> None:
+            self._move(-1)
+
+        @bindings.add("down")
+        def _(event: KeyPressEvent) -> None:
+            self._move(1)
+
+        @bindings.add("pageup")
+        def _(event: KeyPressEvent) -> None:
+            self._move(-self._visible_rows())
+
+        @bindings.add("pagedown")
+        def _(event: KeyPressEvent) -> None:
+            self._move(self._visible_rows())
+
+        @bindings.add("tab")
+        def _(event: KeyPressEvent) -> None:
+            if self.results:
+                self.selected ^= {self.results[self.cursor].name}
+                self._move(1)
+
+        @bindings.add("enter")
+        def _(event: KeyPressEvent) -> None:
+            event.app.exit(result=[entry.name for entry in self.index.entries if entry.name in self.selected])
+
+        @bindings.add("escape", eager=True)
+        @bindings.add("c-c")
+        def _(event: KeyPressEvent) -> None:
+            event.app.exit(result=None)
 
-def select_packages_to_install(available_packages_data: list[dict[str, Any]], default_packages: list[str]) -> list[str]:
+        return bindings
+
+
+def select_packages_to_install(
+    available_packages_data: list[dict[str, Any]],
+    default_packages: list[str],
+    durations: dict[str, float] | None = None,
+) -> list[str]:
     """
-    Prompts the user to select packages to install interactively, grouped by category.
+    Prompts the user to select packages to install on a single screen with a fuzzy search over the name,
+    description and category of every package.
 
     Args:
         available_packages_data: A list of dictionaries containing package data (including 'name' and 'category').
         default_packages: A list of default package names to be pre-selected.
+        durations: (Optional) The recorded install duration of the packages, shown as their estimated cost.
 
     Returns:
         A list of selected package names to install.
@@ -33,34 +190,11 @@ def select_packages_to_install(available_packages_data: list[dict[str, Any]], de
         logger.warning("No packages available for installation.")
         return []
 
-    # Group packages by category
-    packages_by_category: dict[str, list[str]] = {}
-    for package_data in available_packages_data:
-        for package in package_data["packages"]:
-            category: str = package.get("category", "Uncategorized")
-            packages_by_category.setdefault(category, []).append(package)
-
-    selected_packages: list[str] = []
-    for category, package_data_list in packages_by_category.items():
-        logger.info(f"Selecting packages from category: {category}")
-
-        # Create choices for this category with default packages pre-selected
-        choices = [
-            questionary.Choice(
-                title=f"{pd['name']}: {pd['description']}" if pd.get("description") else pd["name"],  # type: ignore
-                value=pd["name"],  # type: ignore
-                checked=pd["name"] in default_packages,  # type: ignore
-            )
-            for pd in package_data_list
-        ]
-
-        # Prompt for package selection within this category
-        category_selected = questionary.checkbox(
-            f"Select packages from '{category}':",  # noqa: S608
-            choices=choices,
-            style=questionary_style,
-        ).ask()
-
-        selected_packages.extend(category_selected or [])
-
-    return selected_packages
+    # Built once: every keystroke is served from the index
+    index = CatalogIndex.from_catalog(available_packages_data, durations)
+    selected = PackagePicker(index, default_packages).run()
+    if selected is None:
+        logger.warning("Package selection cancelled.")
+        return []
+    logger.info(f"Selected packages: {', '.join(selected) or 'none'}")
+    return selected
@@ -1,12 +1,25 @@
 import logging
+import random
+import time
+from pathlib import Path
 from typing import Any
 
-from core.exceptions import PackageNameMismatchError, PackageNotFoundError
-from core.tasks import AptTask, Task, create_task_from_config
-from parser import YamlParser
+from core.exceptions import PackageNameMismatchError, PackageNotFoundError, SetUpWizeError
+from core.finalizers import get_finalizer_queue
+from core.qos import resource_class
+from core.run_cmd import command_limits, run_command
+from core.tasks import AptTask, CommandTask, ConfigurationTask, Task, create_task_from_config
+from core.tracers.events import emit_event, last_exit_code, task_scope
+from core.tracers.resources import get_resource_ledger
+from parser import YamlParser, render_template
+from utils import SystemFacts, download_file, installed_apt_packages, uses_dpkg
 
 logger = logging.getLogger(__name__)
 
+# Backoff between the attempts of a task: doubled after every attempt, capped, and jittered
+RETRY_INITIAL_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
 
 # TODO add validation to package
 class Package:
@@ -15,18 +28,29 @@ class Package:
     holding its metadata and installation tasks.
     """
 
-    def __init__(self, package_data: dict[str, Any], verbose: bool = False):
+    def __init__(
+        self,
+        package_data: dict[str, Any],
+        verbose: bool = False,
+        apt_options: dict[str, str] | None = None,
+    ):
         """
         Initializes a Package object from parsed YAML data.
 
         Args:
             package_data: A dictionary containing the package's metadata and tasks.
+            apt_options: (Optional) Extra apt configuration applied to every apt task of the package.
         """
+        self.data: dict[str, Any] = package_data
         self.name: str = package_data["name"]
         self.description: str = package_data.get("description", "")
         self.verbose: bool = verbose
+        self.apt_options: dict[str, str] = apt_options or {}
         self.tasks: list[Task] = self._create_tasks(package_data["tasks"])
         self.dependencies: list[str] = package_data.get("dependencies", [])
+        self.requires: list[str] = package_data.get("requires", [])
+        self.artifacts: list[dict[str, str]] = package_data.get("artifacts", [])
+        self.check: str | None = package_data.get("check")
 
     def _create_tasks(self, tasks_data: list[dict[str, Any]]) -> list[Task]:
         """
@@ -38,32 +62,176 @@ class Package:
         Returns:
             A list of Task objects.
         """
-        return [create_task_from_config(task_data, self.verbose) for task_data in tasks_data]
+        return [create_task_from_config(task_data, self.verbose, self.apt_options) for task_data in tasks_data]
+
+    def apt_packages(self) -> list[str]:
+        """
+        Returns every apt package this package installs, dependencies first and without duplicates.
+        """
+        packages: list[str] = list(self.dependencies)
+        for task in self.tasks:
+            if isinstance(task, AptTask) and task.action == "install":
+                packages.extend(task.package)
+        return list(dict.fromkeys(packages))
+
+    def uses_dpkg(self) -> bool:
+        """
+        Checks whether installing this package runs apt or dpkg, and therefore needs the dpkg lock.
+        """
+        return bool(self.dependencies) or any(
+            isinstance(task, AptTask) or (isinstance(task, CommandTask) and uses_dpkg(task.command))
+            for task in self.tasks
+        )
+
+    def fetch_artifacts(self) -> None:
+        """
+        Downloads the declared artifacts that are not already present (e.g. fetched by the prefetcher).
+        """
+        for artifact in self.artifacts:
+            path = Path(artifact["path"]).expanduser()
+            if path.exists():
+                continue
+            logger.info(f"Downloading artifact '{artifact['url']}' to '{path}'")
+            download_file(artifact["url"], path, checksum=artifact.get("checksum"))
+
+    def is_satisfied(self) -> bool:
+        """
+        Cheaply verifies that the package is still in place, without running any of its tasks.
+
+        Checks that its apt packages are installed, that configuration destinations and the `creates` paths
+        of the tasks exist, and finally runs the manifest's optional `check` command.
+
+        Returns:
+            True if the package looks installed, False otherwise.
+        """
+        installed = installed_apt_packages()
+        missing = [name for name in self.apt_packages() if name not in installed]
+        if missing:
+            logger.debug(f"Package '{self.name}' is missing apt packages: {', '.join(missing)}")
+            return False
+
+        expected_paths: list[str] = []
+        for task in self.tasks:
+            if isinstance(task, ConfigurationTask):
+                expected_paths.extend(task.destinations or [])
+            if task.guard.creates:
+                expected_paths.append(task.guard.creates)
+        if not all(Path(path).expanduser().exists() for path in expected_paths):
+            logger.debug(f"Package '{self.name}' is missing some of: {', '.join(expected_paths)}")
+            return False
+
+        if self.check:
+            _, returncode = run_command(["/bin/sh", "-c", self.check], verbose=False)
+            return returncode == 0
+        return True
 
     def install(self) -> None:
         """
         Executes the installation tasks for this package.
         """
         logger.info(f"Starting installation of package '{self.name}'...")
-        if self.dependencies:
-            # assume all dependencies are installed using apt
-            AptTask(
-                action="install",
-                package=self.dependencies,
-                verbose=self.verbose,
-            ).execute()
+        emit_event("package_start", package=self.name)
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            if self.dependencies:
+                # assume all dependencies are installed using apt
+                dependencies = AptTask(
+                    action="install",
+                    package=self.dependencies,
+                    verbose=self.verbose,
+                    options=self.apt_options,
+                )
+                with task_scope(self.name, "dependencies", -1), resource_class(dependencies.resource_class):
+                    dependencies.execute()
 
-        for task in self.tasks:
-            task.execute()
-            logger.info(f"Task: '{task.task_name}' completed successfully for package '{self.name}'")
+            self.fetch_artifacts()
+
+            for index, task in enumerate(self.tasks):
+                self._execute_task(task, index)
+                logger.info(f"Task: '{task.task_name}' completed successfully for package '{self.name}'")
+            status = "ok"
+        finally:
+            emit_event("package_end", package=self.name, status=status, duration=round(time.perf_counter() - start, 6))
 
         logger.info(f"Package '{self.name}' installed successfully!")
 
+    def _execute_task(self, task: Task, index: int) -> None:
+        """
+        Executes a task within its timeouts, retrying it with exponential backoff and jitter.
+
+        A task whose guard holds is skipped before anything is spawned. Otherwise the pending finalizers the task
+        needs run first; the ones it requests are queued once it succeeded.
+
+        A task with retries is also retried when its last command exits with a non-zero code, since shell commands
+        such as a download in a pipeline rarely raise. Like a task without retries, it does not fail on that code
+        once its attempts are exhausted.
+
+        Raises:
+            SetUpWizeError: If the last attempt failed.
+        """
+        reason = task.guard.skip_reason()
+        if reason:
+            logger.info(f"Skipping '{task.task_name}' of '{self.name}': {reason}")
+            emit_event("task_skipped", package=self.name, task=task.task_name, index=index, reason=reason)
+            return
+        # finalizers requested by earlier tasks that this one depends on, e.g. a service restart
+        get_finalizer_queue().flush(task.needs, self.verbose)
+        attempts = task.retries + 1
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            error: SetUpWizeError | None = None
+            exit_code = 0
+            try:
+                with (
+                    task_scope(self.name, task.task_name, index),
+                    command_limits(task.timeout, task.stall_timeout),
+                    resource_class(task.resource_class),
+                ):
+                    task.execute()
+                    exit_code = last_exit_code() if task.retries else 0
+            except SetUpWizeError as e:
+                error = e
+            duration = time.perf_counter() - start
+            # the resources used by the task's commands so far, every attempt included
+            usage = get_resource_ledger().get(self.name, task.task_name, index)
+            if usage:
+                logger.info(f"Task '{task.task_name}' of '{self.name}' used {usage.describe()}")
+            emit_event(
+                "task_attempt",
+                package=self.name,
+                task=task.task_name,
+                index=index,
+                attempt=attempt,
+                status="failed" if error or exit_code else "ok",
+                duration=round(duration, 6),
+                message=str(error) if error else f"exited with code {exit_code}" if exit_code else None,
+                usage=usage.as_dict() if usage else None,
+            )
+
+            if error is None and (exit_code == 0 or attempt == attempts):
+                if exit_code:
+                    logger.warning(f"'{task.task_name}' still exited with code {exit_code} after {attempts} attempts")
+                elif attempt > 1:
+                    logger.info(f"Attempt {attempt}/{attempts} of '{task.task_name}' succeeded after {duration:.1f}s")
+                get_finalizer_queue().request(task.finalize, self.name)
+                return
+            if error is not None and attempt == attempts:
+                raise error
+            delay = min(RETRY_INITIAL_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY) * random.uniform(0.5, 1)  # noqa: S311
+            logger.warning(
+                f"Attempt {attempt}/{attempts} of '{task.task_name}' failed after {duration:.1f}s: "
+                f"{error or f'exited with code {exit_code}'}. Retrying in {delay:.1f}s..."
+            )
+            time.sleep(delay)
+
 
 def create_package_from_yaml(
     package_name: str,
     yaml_parser: YamlParser,
     verbose: bool = False,
+    apt_options: dict[str, str] | None = None,
+    facts: SystemFacts | None = None,
 ) -> Package:
     """
     Creates a Package object by loading and parsing the YAML file.
@@ -71,11 +239,15 @@ def create_package_from_yaml(
     Args:
         package_name: The name of the package (without the .yaml extension).
         yaml_parser: An instance of YamlParser for loading YAML data.
+        apt_options: (Optional) Extra apt configuration applied to every apt task of the package.
+        facts: (Optional) The system facts used to expand `{{ facts.<name> }}` placeholders in the manifest.
 
     Returns:
         A Package object representing the parsed package.
     """
     all_packages_data: dict[str, Any] = yaml_parser.load_package(package_name)
+    if facts:
+        all_packages_data = render_template(all_packages_data, {"facts": facts.as_dict()})
 
     # Find the specific package data from the list
     for package_data in all_packages_data["packages"]:
@@ -83,6 +255,34 @@ def create_package_from_yaml(
             raise PackageNameMismatchError(
                 f"Package name mismatch: Expected '{package_name}', got '{package_data['name']}'"
             )
-        return Package(package_data, verbose)
+        return Package(package_data, verbose, apt_options)
 
     raise PackageNotFoundError(f"Package '{package_name}' not found in the YAML data.")
+
+
+def create_packages_from_yaml(
+    package_names: list[str],
+    yaml_parser: YamlParser,
+    verbose: bool = False,
+    apt_options: dict[str, str] | None = None,
+    facts: SystemFacts | None = None,
+) -> list[Package]:
+    """
+    Creates the Package objects of several packages, logging and skipping the ones that cannot be found.
+
+    Args:
+        package_names: The names of the packages, in installation order.
+        yaml_parser: An instance of YamlParser for loading YAML data.
+        apt_options: (Optional) Extra apt configuration applied to every apt task.
+        facts: (Optional) The system facts used to expand `{{ facts.<name> }}` placeholders in the manifests.
+
+    Returns:
+        A list of Package objects in the same order.
+    """
+    packages: list[Package] = []
+    for package_name in package_names:
+        try:
+            packages.append(create_package_from_yaml(package_name, yaml_parser, verbose, apt_options, facts))
+        except PackageNotFoundError:
+            logger.exception(f"Package '{package_name}' not found.")
+    return packages
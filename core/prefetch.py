@@ -0,0 +1,175 @@
+import logging
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import TracebackType
+
+from core.packages import Package
+from utils import RateLimiter, download_file
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_archives(apt_packages: list[str], options: dict[str, str] | None = None) -> list[tuple[str, str, int, str]]:
+    """
+    Asks apt which archives an installation would download, without downloading or locking anything.
+
+    Args:
+        apt_packages: The apt packages to install.
+        options: (Optional) Apt configuration passed as `-o key=value`, so the resolution matches the installation.
+
+    Returns:
+        A list of (url, filename, size, checksum) tuples.
+    """
+    cmd = ["apt-get", "install", "-y", "-qq", "--print-uris"]
+    for key, value in (options or {}).items():
+        cmd.extend(["-o", f"{key}={value}"])
+    cmd.extend(apt_packages)
+    logger.debug(f"Resolving archives: {shlex.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)  # noqa: S603
+
+    archives: list[tuple[str, str, int, str]] = []
+    for line in result.stdout.splitlines():
+        # 'http://archive.ubuntu.com/.../curl_8.5.0_amd64.deb' curl_8.5.0_amd64.deb 226888 SHA512:0a1b...
+        fields = line.split()
+        if len(fields) >= 4 and fields[0].startswith("'"):
+            archives.append((fields[0].strip("'"), fields[1], int(fields[2]), fields[3]))
+    return archives
+
+
+class AptPrefetcher:
+    """
+    Downloads the apt archives and declared artifacts of upcoming packages in the background.
+
+    The prefetcher resolves what apt would download with `apt-get install --print-uris`, which neither needs
+    root nor takes the dpkg lock, and downloads the archives itself into a private archive directory. Every
+    apt task of the run is pointed at the same directory (`Dir::Cache::Archives`), so apt finds the verified
+    archives in its cache and only has to unpack them. Because the prefetcher never runs apt as root, it can
+    never contend with the dpkg lock held by the package that is currently being installed.
+
+    The archive directory is only created once prefetching is used. Root apt may hand its `partial/`
+    subdirectory over to the `_apt` user, so the directory is removed through sudo when needed.
+    """
+
+    def __init__(self, depth: int = 2, jobs: int = 2, rate_limit: int = 0):
+        """
+        Initializes the AptPrefetcher.
+
+        Args:
+            depth: How many upcoming packages to prefetch while the current one installs.
+            jobs: The maximum number of concurrent downloads.
+            rate_limit: The combined bandwidth limit in bytes per second (0 means unlimited).
+        """
+        if depth < 0 or jobs < 1:
+            raise ValueError("Prefetch depth must be positive and at least one job is required")
+        self.depth = depth
+        self.rate_limiter: RateLimiter | None = RateLimiter(rate_limit) if rate_limit else None
+        self._archives_dir: Path | None = None
+        self._archives_lock = threading.Lock()
+
+        # one worker resolves and schedules packages, the others perform the downloads
+        self._scheduler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._downloader = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="prefetch-download")
+        self._pending: dict[str, Future[None]] = {}
+
+    @property
+    def archives_dir(self) -> Path:
+        """
+        The private archive directory, created on first use.
+        """
+        with self._archives_lock:
+            if self._archives_dir is None:
+                self._archives_dir = Path(tempfile.mkdtemp(prefix="setupwize-archives-"))
+                (self._archives_dir / "partial").mkdir()
+            return self._archives_dir
+
+    @property
+    def apt_options(self) -> dict[str, str]:
+        """
+        The apt configuration that makes apt-get use the prefetched archives, none when prefetching is disabled.
+        """
+        return {"Dir::Cache::Archives": str(self.archives_dir)} if self.depth else {}
+
+    def __enter__(self) -> "AptPrefetcher":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Cancels outstanding downloads and removes the archive directory.
+        """
+        self._scheduler.shutdown(wait=True, cancel_futures=True)
+        self._downloader.shutdown(wait=True, cancel_futures=True)
+        archives_dir, self._archives_dir = self._archives_dir, None
+        if archives_dir is None:
+            return
+        shutil.rmtree(archives_dir, ignore_errors=True)
+        if archives_dir.exists():
+            # what root apt created or handed over to `_apt` in the directory; never prompts for a password
+            cmd = ["sudo", "-n", "rm", "-rf", "--", str(archives_dir)]
+            if subprocess.run(cmd, capture_output=True, check=False).returncode != 0:  # noqa: S603
+                logger.warning(f"Could not remove the prefetched archives in '{archives_dir}'")
+
+    def schedule(self, packages: list[Package]) -> None:
+        """
+        Starts prefetching the given packages, skipping the ones that are already scheduled.
+
+        Args:
+            packages: The upcoming packages in installation order.
+        """
+        for package in packages[: self.depth]:
+            if package.name not in self._pending:
+                self._pending[package.name] = self._scheduler.submit(self._prefetch, package)
+
+    def wait(self, package: Package) -> None:
+        """
+        Waits until the prefetch of a package finished, so apt does not download the same archives again.
+
+        Prefetching is an optimization only: failures are logged and the installation downloads as usual.
+
+        Args:
+            package: The package that is about to be installed.
+        """
+        future = self._pending.pop(package.name, None)
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            logger.debug(f"Prefetch of package '{package.name}' failed: {e}")
+
+    def _prefetch(self, package: Package) -> None:
+        downloads: list[Future[Path]] = []
+        apt_packages = package.apt_packages()
+        if apt_packages:
+            options = {**package.apt_options, "Dir::Cache::Archives": str(self.archives_dir)}
+            for url, filename, _, checksum in resolve_archives(apt_packages, options):
+                downloads.append(
+                    self._downloader.submit(
+                        download_file, url, self.archives_dir / filename, checksum, self.rate_limiter
+                    )
+                )
+        for artifact in package.artifacts:
+            path = Path(artifact["path"]).expanduser()
+            if not path.exists():
+                downloads.append(
+                    self._downloader.submit(
+                        download_file, artifact["url"], path, artifact.get("checksum"), self.rate_limiter
+                    )
+                )
+
+        for download in downloads:
+            download.result()
+        if downloads:
+            logger.debug(f"Prefetched {len(downloads)} file(s) for package '{package.name}'")
@@ -0,0 +1,169 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# What limits a task: its downloads, its writes to the disk or its computations
+RESOURCE_CLASSES = ("network", "disk", "cpu")
+
+# The resource class of the finalizer programs, the others write small files
+FINALIZER_RESOURCE_CLASSES = {"fc-cache": "cpu"}
+
+_current = threading.local()
+
+
+@dataclass(frozen=True)
+class QosPolicy:
+    """
+    How the commands of a resource class are scheduled.
+
+    Weights are work-conserving: on an idle machine the commands run at full speed, they only yield to the
+    desktop when it needs the CPU or the disk.
+
+    Attributes:
+        nice: The CPU niceness of the commands (0 to 19).
+        io_level: The best-effort I/O priority of the commands (0, highest, to 7).
+        cpu_weight: (Optional) The cgroup v2 CPU weight of the commands (1 to 10000, 100 being the default).
+        io_weight: (Optional) The cgroup v2 I/O weight of the commands (1 to 10000, 100 being the default).
+        cpu_quota: (Optional) The CPU time the commands may use, in percent of one CPU.
+    """
+
+    nice: int = 0
+    io_level: int = 4
+    cpu_weight: int | None = None
+    io_weight: int | None = None
+    cpu_quota: int | None = None
+
+    def cgroup_properties(self) -> list[str]:
+        """
+        Returns the systemd unit properties applying the cgroup weights and limits of the policy.
+        """
+        properties = [f"CPUWeight={self.cpu_weight}"] if self.cpu_weight else []
+        if self.io_weight:
+            properties.append(f"IOWeight={self.io_weight}")
+        if self.cpu_quota:
+            properties.append(f"CPUQuota={self.cpu_quota}%")
+        return properties
+
+
+def background_policies(cpu_count: int | None = None) -> dict[str, QosPolicy]:
+    """
+    Returns the policies of the `--background` mode: downloads are barely slowed down, disk writes yield to
+    the desktop's I/O and computations to its CPU use. CPU-bound commands are also kept off one CPU, so the
+    desktop always has a free one and the run takes at most cpu_count / (cpu_count - 1) times longer.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return {
+        "network": QosPolicy(nice=5, io_level=4, cpu_weight=50, io_weight=50),
+        "disk": QosPolicy(nice=10, io_level=7, cpu_weight=50, io_weight=10),
+        "cpu": QosPolicy(
+            nice=19, io_level=7, cpu_weight=10, io_weight=50, cpu_quota=(cpu_count - 1) * 100 if cpu_count > 1 else None
+        ),
+    }
+
+
+@contextmanager
+def resource_class(name: str | None) -> Iterator[None]:
+    """
+    Schedules the commands run by the current thread inside the block with the policy of a resource class.
+    """
+    previous = getattr(_current, "value", None)
+    _current.value = name
+    try:
+        yield
+    finally:
+        _current.value = previous
+
+
+class QosScheduler:
+    """
+    Applies the policy of the current resource class to the commands about to be spawned, by prefixing them
+    with `nice`, `ionice` and, when a systemd user instance manages a cgroup v2 hierarchy, a transient
+    `systemd-run --scope` carrying the cgroup weights. Each wrapper execs the command, which keeps its pid.
+
+    The setupwize process itself runs with the mildest policy, its in-process work (archive extraction, the
+    python-apt backend) included.
+    """
+
+    def __init__(self) -> None:
+        self.policies: dict[str, QosPolicy] = {}
+        self.cgroups = False
+        self._own_nice = 0
+        self._nice = False
+        self._ionice = False
+
+    def configure(self, policies: dict[str, QosPolicy], cgroups: bool = True) -> None:
+        """
+        Enables the policies for the rest of the run.
+
+        Args:
+            policies: The policy of each resource class; a class without one runs unchanged.
+            cgroups: Whether to apply the cgroup weights and limits, when the system supports them.
+        """
+        self.policies = policies
+        self._nice = shutil.which("nice") is not None
+        self._ionice = shutil.which("ionice") is not None
+        self.cgroups = cgroups and _cgroups_available()
+        if cgroups and not self.cgroups:
+            logger.info("No systemd user instance on a cgroup v2 hierarchy, only the CPU and I/O priorities apply")
+
+        mildest = min(policies.values(), key=lambda policy: policy.nice, default=None)
+        if mildest:
+            self._own_nice = os.nice(max(mildest.nice - os.nice(0), 0))
+            if self._ionice:
+                ionice = ["ionice", "-c", "2", "-n", str(mildest.io_level), "-p", str(os.getpid())]
+                subprocess.run(ionice, capture_output=True, check=False)  # noqa: S603
+        logger.info(
+            "Background mode: "
+            + ", ".join(f"{name} tasks at nice {policy.nice}" for name, policy in policies.items())
+            + (" with cgroup weights" if self.cgroups else "")
+        )
+
+    def wrap(self, args: list[str]) -> list[str]:
+        """
+        Prefixes a command with the wrappers applying the policy of the current resource class.
+        """
+        policy = self.policies.get(getattr(_current, "value", None) or "")
+        if policy is None:
+            return args
+        prefix: list[str] = []
+        if self.cgroups and policy.cgroup_properties():
+            properties = [f"--property={prop}" for prop in policy.cgroup_properties()]
+            prefix += ["systemd-run", "--user", "--scope", "--quiet", "--collect", *properties]
+        # the niceness is inherited, only what the class adds to the run's own is applied
+        if self._nice and policy.nice > self._own_nice:
+            prefix += ["nice", "-n", str(policy.nice - self._own_nice)]
+        if self._ionice:
+            prefix += ["ionice", "-c", "2", "-n", str(policy.io_level)]
+        return [*prefix, *args]
+
+
+def _cgroups_available() -> bool:
+    """
+    Checks, without spawning anything, for a unified cgroup hierarchy and a systemd user instance to create
+    transient scopes with.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    return (
+        shutil.which("systemd-run") is not None
+        and Path("/sys/fs/cgroup/cgroup.controllers").is_file()
+        and bool(runtime_dir)
+        and Path(runtime_dir or "", "systemd", "private").exists()
+    )
+
+
+_qos_scheduler = QosScheduler()
+
+
+def get_qos_scheduler() -> QosScheduler:
+    """
+    Returns the scheduler applying the resource class policies of the run.
+    """
+    return _qos_scheduler
@@ -0,0 +1,73 @@
+import logging
+
+from core.exceptions import DependencyCycleError, InvalidYamlFormatError, PackageNotFoundError
+from parser import YamlParser
+
+logger = logging.getLogger(__name__)
+
+
+def package_requirements(package_name: str, yaml_parser: YamlParser) -> list[str]:
+    """
+    Returns the setupwize packages a package declares in its `requires` field.
+    """
+    requires: list[str] = []
+    for package_data in yaml_parser.load_package(package_name).get("packages", []):
+        value = package_data.get("requires") or []
+        if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+            raise InvalidYamlFormatError(f"'requires' of package '{package_name}' must be a list of package names")
+        requires.extend(value)
+    return requires
+
+
+def resolve_requirements(package_names: list[str], yaml_parser: YamlParser) -> list[str]:
+    """
+    Adds the packages required by the selected ones and orders them so every package comes after its
+    requirements.
+
+    The packages and their `requires` form a directed acyclic graph that is sorted topologically with a depth
+    first search. The selection order is kept wherever the requirements allow it, and a package required by
+    several others appears only once, so it is installed exactly once per run.
+
+    Args:
+        package_names: The selected packages.
+        yaml_parser: An instance of YamlParser for loading YAML data.
+
+    Returns:
+        The packages to install, requirements first and without duplicates.
+
+    Raises:
+        PackageNotFoundError: If a selected or required package does not exist.
+        DependencyCycleError: If packages require each other in a cycle.
+    """
+    available = set(yaml_parser.get_available_packages())
+    invalid_packages = [name for name in package_names if name not in available]
+    if invalid_packages:
+        raise PackageNotFoundError(f"Invalid packages: {', '.join(invalid_packages)}")
+
+    order: list[str] = []
+    done: set[str] = set()
+    path: list[str] = []  # the packages being visited, a package seen again on this path closes a cycle
+
+    def visit(name: str, required_by: str | None) -> None:
+        if name in done:
+            return
+        if name in path:
+            cycle = [*path[path.index(name) :], name]
+            raise DependencyCycleError(f"Packages require each other in a cycle: {' -> '.join(cycle)}")
+        if name not in available:
+            raise PackageNotFoundError(f"Package '{name}' required by '{required_by}' not found.")
+
+        path.append(name)
+        for requirement in package_requirements(name, yaml_parser):
+            visit(requirement, name)
+        path.pop()
+        done.add(name)
+        order.append(name)
+
+    for name in package_names:
+        visit(name, None)
+
+    added = [name for name in order if name not in package_names]
+    if added:
+        logger.info(f"Adding required packages: {', '.join(added)}")
+    return order
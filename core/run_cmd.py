@@ -1,37 +1,177 @@
 import logging
 import os
 import shlex
+import signal
 import subprocess
 import sys
+import threading
 import time
-from collections.abc import Callable
-from typing import Any
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import IO, Any
+
+from core.cassette import Cassette, get_cassette
+from core.exceptions import CommandTimeoutError
+from core.qos import get_qos_scheduler
+from core.tracers.archive import RunArchive, get_run_archive
+from core.tracers.events import OutputSpool, current_scope, emit_event, get_output_spool, record_exit_code
+from core.tracers.resources import record_usage, wait_with_usage
 
 logger = logging.getLogger(__name__)
 
+# Time given to a process group to exit after SIGTERM before it is killed
+KILL_GRACE_PERIOD = 5.0
+
+_limits = threading.local()
+
+# Whether the commands may read the terminal; unattended runs close their standard input instead
+_prompts = True
+
+
+def allow_prompts(enabled: bool) -> None:
+    """
+    Sets whether the commands may read the terminal. Without prompts they run with their standard input closed,
+    so a command asking for an answer (`sudo -S` for a password) fails at once instead of waiting for it.
+    """
+    global _prompts  # noqa: PLW0603
+    _prompts = enabled
+
+
+@contextmanager
+def command_limits(timeout: float | None = None, stall_timeout: float | None = None) -> Iterator[None]:
+    """
+    Limits the commands run by the current thread inside the block.
+
+    Args:
+        timeout: The time in seconds every command of the block may take together.
+        stall_timeout: The time in seconds a command may run without producing output.
+    """
+    previous = getattr(_limits, "value", (None, None))
+    _limits.value = (time.monotonic() + timeout if timeout else None, stall_timeout)
+    try:
+        yield
+    finally:
+        _limits.value = previous
+
+
+class LimitTracker:
+    """
+    Tracks the deadline and the stall timeout of a unit of work against the `command_limits` of the thread that
+    created it, for the work that does not run through `run_command` (streamed downloads, in-process apt).
+    """
+
+    def __init__(self, timeout: float | None = None, stall_timeout: float | None = None):
+        self.deadline, self.stall_timeout = _resolve_limits(timeout, stall_timeout)
+        self.last_progress = time.monotonic()
+        self.expired: str | None = None
+
+    def __bool__(self) -> bool:
+        return self.deadline is not None or bool(self.stall_timeout)
+
+    def touch(self) -> None:
+        """
+        Records progress, which restarts the stall timeout.
+        """
+        self.last_progress = time.monotonic()
+
+    def check(self) -> str | None:
+        """
+        Returns why the limits expired, if they did.
+        """
+        now = time.monotonic()
+        if self.deadline is not None and now >= self.deadline:
+            self.expired = "timed out"
+        elif self.stall_timeout and now - self.last_progress >= self.stall_timeout:
+            self.expired = f"produced no output for {self.stall_timeout:g}s"
+        return self.expired
+
+    def remaining(self) -> float | None:
+        """
+        Returns the time left before the limits expire if no progress is made, None when not limited.
+        """
+        now = time.monotonic()
+        left = [self.deadline - now] if self.deadline is not None else []
+        if self.stall_timeout:
+            left.append(self.last_progress + self.stall_timeout - now)
+        return max(min(left), 0.0) if left else None
+
+
+class _Watchdog(threading.Thread):
+    """
+    Kills the process group of a command when its deadline passes or its output stalls.
+    """
+
+    def __init__(self, proc: subprocess.Popen, limits: LimitTracker):
+        super().__init__(name=f"watchdog-{proc.pid}", daemon=True)
+        self.proc = proc
+        self.limits = limits
+        self._done = threading.Event()
+
+    @property
+    def expired(self) -> str | None:
+        return self.limits.expired
+
+    def touch(self) -> None:
+        self.limits.touch()
+
+    def stop(self) -> None:
+        self._done.set()
+
+    def run(self) -> None:
+        while not self._done.wait(0.5):
+            if self.limits.check():
+                self._kill()
+                return
+
+    def _kill(self) -> None:
+        # the command runs in its own process group, which holds every process it started
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except ProcessLookupError:
+                return
+            if self._done.wait(KILL_GRACE_PERIOD):
+                return
+
 
 def run_command(
     args: list[str] | Callable[[], list[str]],
     env: dict[str, str] | None = None,
     verbose: bool = True,
     capture_output: bool = True,
+    timeout: float | None = None,
+    stall_timeout: float | None = None,
     **kwargs: Any,  # noqa: ANN401
 ) -> tuple[str, int]:
     """
     Runs a command and captures its output.
 
+    The command is spawned with the priorities of the current resource class; it is logged, recorded and
+    reported as given.
+
+    When a timeout applies, the command is started in its own process group, keeping the controlling terminal
+    (sudo can still prompt for a password); on expiry the whole group is terminated, then killed after
+    KILL_GRACE_PERIOD seconds, and CommandTimeoutError is raised. The group is also killed when the run is
+    interrupted while the command runs, since the terminal's Ctrl+C no longer reaches it.
+
     Args:
         args: A list of strings representing the command and its arguments, or a callable that returns such a list.
         env: An optional dictionary specifying environment variables.
         verbose: A boolean indicating whether to log command execution details.
         capture_output: A boolean indicating whether to capture the command's output.
+        timeout: (Optional) The maximum run time in seconds; defaults to the time left in `command_limits`.
+        stall_timeout: (Optional) The maximum time in seconds without output; defaults to `command_limits`.
         **kwargs: Additional keyword arguments to pass to subprocess.Popen.
 
     Returns:
         A tuple containing the captured output (if any) and the command's exit code.
+
+    Raises:
+        CommandTimeoutError: If the command was killed by its timeout or stall timeout.
     """
-    if verbose:
-        start_time = time.time()
+    start_time = time.time()
+    limits = LimitTracker(timeout, stall_timeout)
+    deadline, stall_timeout = limits.deadline, limits.stall_timeout
 
     if callable(args):
         args = args()
@@ -45,39 +185,59 @@ def run_command(
     if verbose:
         logger.info(f"Running: {shlex.join(args)}")
 
+    # In machine-readable mode the output is stored in the spool and referenced by events, never printed
+    spool = get_output_spool() if capture_output else None
+    # The output of every command is also kept in the compressed run archive
+    archive = get_run_archive() if capture_output else None
+    # Commands are recorded to, or replayed from, the cassette in use
+    cassette = get_cassette()
+    recorded = b""
+
+    if cassette and cassette.replaying:
+        return _replay_command(cassette, args, env, spool, archive, verbose, start_time)
+
+    # Stalls are detected on the binary chunks of the output
+    binary = spool is not None or archive is not None or cassette is not None or stall_timeout is not None
+    _set_spawn_options(kwargs, own_process_group=bool(deadline or stall_timeout))
     if capture_output:
         kwargs.setdefault("stdout", subprocess.PIPE)
         kwargs.setdefault("stderr", subprocess.STDOUT)
         # Unbuffered output for maximum responsiveness
         # Use a smaller bufsize for more responsive output
         kwargs.setdefault("bufsize", 0)
-        kwargs.setdefault("universal_newlines", True)
+        kwargs.setdefault("universal_newlines", not binary)
 
+    emit_event("command_start", argv=args)
+    watchdog: _Watchdog | None = None
     try:
-        with subprocess.Popen(args, **kwargs) as proc:  # noqa: S603
-            # if proc.stdout and (verbose or "sudo" in args):
-            if proc.stdout and (verbose):
-                while True:
-                    output = proc.stdout.read(1)  # Read one character at a time
-                    if output == "" and proc.poll() is not None:
-                        break
-                    if output == "\r":  # Carriage return, likely an in-place update
-                        sys.stdout.write("\r")  # Move cursor to beginning of line
-                        sys.stdout.flush()
-                    else:
-                        sys.stdout.write(output)
-                        sys.stdout.flush()
-
-            if proc.stderr:
-                while True:
-                    error = proc.stderr.readline()
-                    if error == "" and proc.poll() is not None:
-                        break
-                    if error:
+        with subprocess.Popen(get_qos_scheduler().wrap(args), **kwargs) as proc:  # noqa: S603
+            try:
+                if deadline or stall_timeout:
+                    # without captured output there is nothing to detect a stall on
+                    limits.stall_timeout = stall_timeout if capture_output else None
+                    limits.touch()
+                    watchdog = _Watchdog(proc, limits)
+                    watchdog.start()
+                if binary and proc.stdout:
+                    recorded = _read_output(_read_chunks(proc.stdout, watchdog), spool, verbose)
+
+                # if proc.stdout and (verbose or "sudo" in args):
+                elif proc.stdout and (verbose):
+                    _echo_text_output(proc.stdout)
+
+                if proc.stderr:
+                    # read to the end of the output, polling would reap the process before wait4
+                    while error := proc.stderr.readline():
                         sys.stderr.write(error)
                         sys.stderr.flush()
 
-        returncode = proc.wait()
+                returncode, rusage = wait_with_usage(proc)
+            except BaseException:
+                # a command in its own process group does not receive the terminal's SIGINT, it must not outlive
+                # the run (Popen would otherwise wait for it on exit)
+                if deadline or stall_timeout:
+                    _kill_process_group(proc)
+                raise
 
     except subprocess.CalledProcessError as exc:
         logger.exception(
@@ -90,10 +250,137 @@ def run_command(
     #     raise SystemExit(1) from exc
     except Exception as exc:
         logger.exception(f"Failed to run command '{shlex.join(args)}'")
+        emit_event("error", argv=args, message=str(exc))
         raise SystemExit(1) from exc
+    finally:
+        if watchdog:
+            watchdog.stop()
+
+    runtime = time.time() - start_time
+    if rusage:
+        record_usage(rusage, runtime)
+    if cassette:
+        cassette.record(args, env, returncode, recorded, runtime)
+    result = _finish_command(args, recorded, returncode, archive, verbose, runtime)
+    if watchdog and watchdog.expired:
+        emit_event("error", argv=args, message=watchdog.expired)
+        raise CommandTimeoutError(f"'{shlex.join(args)}' {watchdog.expired}, killed after {runtime:.1f}s")
+    return result
+
+
+def _set_spawn_options(kwargs: dict[str, Any], own_process_group: bool) -> None:
+    """
+    Closes the standard input of the command when prompts are not allowed and, for a limited command, starts
+    it in a new process group of the current session, so it can be killed with everything it started without
+    losing the controlling terminal.
+    """
+    if not _prompts:
+        kwargs.setdefault("stdin", subprocess.DEVNULL)
+    if not own_process_group:
+        return
+    if sys.version_info >= (3, 11):
+        kwargs.setdefault("process_group", 0)
+    else:
+        kwargs.setdefault("preexec_fn", _new_process_group)
+
 
+def _new_process_group() -> None:
+    os.setpgid(0, 0)
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _resolve_limits(timeout: float | None, stall_timeout: float | None) -> tuple[float | None, float | None]:
+    """
+    Combines the limits of a command with the `command_limits` of the thread, the earliest deadline wins.
+
+    Returns:
+        The monotonic deadline and the stall timeout, each None when not limited.
+    """
+    deadline, default_stall_timeout = getattr(_limits, "value", (None, None))
+    if timeout:
+        deadline = min(filter(None, (deadline, time.monotonic() + timeout)))
+    return deadline, stall_timeout or default_stall_timeout
+
+
+def _echo_text_output(stdout: IO[str]) -> None:
+    # read to the end of the output, polling would reap the process before wait4
+    while output := stdout.read(1):  # Read one character at a time
+        if output == "\r":  # Carriage return, likely an in-place update
+            sys.stdout.write("\r")  # Move cursor to beginning of line
+            sys.stdout.flush()
+        else:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+
+def _replay_command(
+    cassette: Cassette,
+    args: list[str],
+    env: dict[str, str] | None,
+    spool: OutputSpool | None,
+    archive: RunArchive | None,
+    verbose: bool,
+    start_time: float,
+) -> tuple[str, int]:
+    """
+    Serves a command from the cassette in use, through the same output sinks as an executed command.
+    """
+    emit_event("command_start", argv=args)
+    output, returncode = cassette.replay(args, env)
+    if spool or archive or verbose:
+        output = _read_output([output], spool, verbose)
+    return _finish_command(args, output, returncode, archive, verbose, time.time() - start_time)
+
+
+def _finish_command(
+    args: list[str],
+    recorded: bytes,
+    returncode: int,
+    archive: RunArchive | None,
+    verbose: bool,
+    runtime: float,
+) -> tuple[str, int]:
+    record_exit_code(returncode)
+    if archive:
+        archive.add(recorded, **current_scope(), argv=args, exit_code=returncode)
+    emit_event("command_end", argv=args, exit_code=returncode, duration=round(runtime, 6))
     if verbose:
-        runtime = time.time() - start_time
         logger.info(f"Execution time: {runtime:.3f} seconds")
 
     return "", returncode
+
+
+def _read_chunks(stdout: IO[bytes], watchdog: _Watchdog | None = None) -> Iterator[bytes]:
+    while chunk := os.read(stdout.fileno(), 64 * 1024):
+        if watchdog:
+            watchdog.touch()
+        yield chunk
+
+
+def _read_output(chunks: Iterable[bytes], spool: OutputSpool | None, verbose: bool) -> bytes:
+    """
+    Reads the output of a command in binary chunks, storing it in the event spool or echoing it when verbose.
+
+    Returns:
+        The whole output.
+    """
+    output = bytearray()
+    offset, length = -1, 0
+    for chunk in chunks:
+        output += chunk
+        if spool:
+            chunk_offset = spool.write(chunk)
+            offset = chunk_offset if offset < 0 else offset
+            length = chunk_offset + len(chunk) - offset
+        elif verbose:
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
+    if spool and length:
+        spool.reference(offset, length)
+    return bytes(output)
@@ -0,0 +1,63 @@
+import logging
+from collections.abc import Callable, Iterator
+
+from core.packages import Package
+from utils import LockHolder, dpkg_lock_holder
+
+logger = logging.getLogger(__name__)
+
+
+class LockAwareQueue:
+    """
+    Yields the packages to install in order, except while another process holds the dpkg lock: packages that
+    do not need the lock (and whose requirements are installed) are then moved ahead, so the run keeps making
+    progress instead of waiting idle. Once only packages needing the lock are left, their apt tasks wait for it
+    with backoff.
+
+    Example:
+        ```python
+        queue = LockAwareQueue(packages)
+        for package in queue:
+            prefetcher.schedule(queue.pending)
+            package.install()
+        ```
+    """
+
+    def __init__(self, packages: list[Package], probe: Callable[[], LockHolder | None] = dpkg_lock_holder):
+        """
+        Initializes the LockAwareQueue.
+
+        Args:
+            packages: The packages to install, in order.
+            probe: Returns the current dpkg lock holder, if any.
+        """
+        self.pending: list[Package] = list(packages)
+        self.probe = probe
+
+    def __iter__(self) -> Iterator[Package]:
+        while self.pending:
+            package = self._next()
+            self.pending.remove(package)
+            yield package
+
+    def _next(self) -> Package:
+        head = self.pending[0]
+        if not head.uses_dpkg():
+            return head
+        holder = self.probe()
+        if holder is None:
+            return head
+        # a package can only move ahead once none of its requirements is still pending
+        pending_names = {package.name for package in self.pending}
+        runnable = next(
+            (
+                package
+                for package in self.pending
+                if not package.uses_dpkg() and not pending_names.intersection(package.requires)
+            ),
+            None,
+        )
+        if runnable is None:
+            return head
+        logger.info(f"The dpkg lock is held by {holder}, installing '{runnable.name}' first")
+        return runnable
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Any
+
+from core.footprint import Footprint
+from core.packages import Package
+from utils import SystemFacts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = Path("~/.setupwize/state.json")
+
+# Paths into the bundled configurations that a manifest references, in task options or inside shell commands
+CONFIGURATION_REFERENCE = re.compile(r"(?:\./)?configurations/[\w./-]+")
+
+# Facts that change what a package installs; session facts such as the desktop are deliberately left out
+FINGERPRINT_FACTS = ("distro", "version", "codename", "arch")
+
+
+def package_fingerprint(
+    package_data: dict[str, Any],
+    manifest_path: str | Path,
+    facts: SystemFacts | None = None,
+) -> str:
+    """
+    Computes a fingerprint of everything a package installation depends on.
+
+    The fingerprint covers the manifest file, the metadata (path, size and modification time) of every file
+    under the `configurations/` paths the manifest references, and the system facts that influence the result.
+    File contents are not read, so fingerprinting a whole catalog only costs a few stat calls.
+
+    Args:
+        package_data: The parsed package definition.
+        manifest_path: The path to the package's YAML manifest.
+        facts: (Optional) The system facts of the run.
+
+    Returns:
+        A hex digest identifying the package inputs.
+    """
+    digest = hashlib.sha256()
+    digest.update(Path(manifest_path).read_bytes())
+
+    for reference in sorted(set(CONFIGURATION_REFERENCE.findall(json.dumps(package_data)))):
+        digest.update(reference.encode())
+        for path in _walk(Path(reference)):
+            stat = path.stat()
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    if facts:
+        digest.update(json.dumps([getattr(facts, name) for name in FINGERPRINT_FACTS]).encode())
+
+    return digest.hexdigest()
+
+
+def _walk(path: Path) -> list[Path]:
+    if path.is_file():
+        return [path]
+    if not path.is_dir():
+        return []
+    files: list[Path] = []
+    for root, _, filenames in os.walk(path):
+        files.extend(Path(root) / filename for filename in sorted(filenames))
+    return sorted(files)
+
+
+class StateStore:
+    """
+    Persists the fingerprints of the packages that were installed successfully.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_STATE_PATH, persistent: bool = True):
+        """
+        Initializes the StateStore and loads the existing state, if any.
+
+        Args:
+            path: The JSON file holding the state.
+            persistent: Whether the state file is used; a non-persistent store starts empty and is never saved.
+        """
+        self.path = Path(path).expanduser()
+        self.persistent = persistent
+        self.packages: dict[str, dict[str, Any]] = {}
+        if persistent and self.path.is_file():
+            try:
+                self.packages = json.loads(self.path.read_text()).get("packages", {})
+            except ValueError as e:
+                logger.warning(f"Ignoring corrupted state file '{self.path}': {e}")
+
+    def is_current(self, package_name: str, fingerprint: str) -> bool:
+        """
+        Checks whether a package was last installed successfully with the same fingerprint.
+        """
+        return self.packages.get(package_name, {}).get("fingerprint") == fingerprint
+
+    def pending(self, packages: list[Package], fingerprints: dict[str, str]) -> list[Package]:
+        """
+        Filters out the packages that are converged: unchanged since their last successful install and still
+        passing their post-condition check.
+
+        Args:
+            packages: The packages to install.
+            fingerprints: The current fingerprint of every package, by name.
+
+        Returns:
+            The packages that still need to be installed, in the same order.
+        """
+        converged = [
+            package.name
+            for package in packages
+            if self.is_current(package.name, fingerprints[package.name]) and package.is_satisfied()
+        ]
+        if converged:
+            logger.info(f"Already converged, skipping: {', '.join(converged)}")
+        return [package for package in packages if package.name not in converged]
+
+    def record(self, package_name: str, fingerprint: str, duration: float | None = None) -> None:
+        """
+        Records a successful installation, with how long it took, and writes the state file atomically.
+        """
+        entry = self.packages.get(package_name, {})
+        self.packages[package_name] = {**entry, "fingerprint": fingerprint, "installed_at": time.time()}
+        if duration is not None:
+            self.packages[package_name]["duration"] = round(duration, 3)
+        self.save()
+
+    def durations(self) -> dict[str, float]:
+        """
+        Returns the wall time of the last successful installation of every package that recorded one.
+        """
+        return {name: entry["duration"] for name, entry in self.packages.items() if "duration" in entry}
+
+    def record_footprint(self, package_name: str, footprint: Footprint) -> None:
+        """
+        Adds what an installation changed to the footprint of the package, and writes the state file.
+        """
+        entry = self.packages.setdefault(package_name, {})
+        previous = self.footprint(package_name)
+        entry["footprint"] = (previous.merge(footprint) if previous else footprint).as_dict()
+        self.save()
+
+    def footprint(self, package_name: str) -> Footprint | None:
+        """
+        Returns the recorded footprint of a package, if any.
+        """
+        data = self.packages.get(package_name, {}).get("footprint")
+        return Footprint.from_dict(data) if data else None
+
+    def backups_dir(self, package_name: str) -> Path:
+        """
+        Returns where the originals of the configurations replaced by a package are kept.
+        """
+        return self.path.parent / "backups" / package_name
+
+    def forget(self, package_name: str) -> None:
+        """
+        Removes a package from the state, and the copies of what it replaced, after it was uninstalled.
+        """
+        shutil.rmtree(self.backups_dir(package_name), ignore_errors=True)
+        if self.packages.pop(package_name, None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        if not self.persistent:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_suffix(".part")
+        partial.write_text(json.dumps({"packages": self.packages}, indent=2))
+        partial.replace(self.path)
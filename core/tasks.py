@@ -1,32 +1,241 @@
 # ruff: noqa: ANN201
 import filecmp
+import fnmatch
 import logging
+import os
+import re
+import shlex
 import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import zipfile
 from abc import ABC, abstractmethod
-from pathlib import Path
-from typing import Any
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, cast
 
-from core.exceptions import TaskExecutionFailedError
-from core.run_cmd import run_command
+from core.apt_backend import get_apt_backend
+from core.cassette import get_cassette
+from core.copy_engine import CopyEngine
+from core.exceptions import CommandTimeoutError, SetUpWizeError, TaskExecutionFailedError
+from core.finalizers import Finalizer
+from core.qos import RESOURCE_CLASSES
+from core.run_cmd import LimitTracker, run_command
+from utils import command_exists, dpkg_lock_options, file_contains, uses_dpkg, wait_for_dpkg_lock
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class TaskGuard:
+    """
+    The conditions under which a task has nothing to do, checked in-process before any of its commands is
+    spawned. The task is skipped as soon as one of them holds.
+
+    Attributes:
+        creates: A path; the task is skipped when it exists.
+        unless_command_exists: A command name; the task is skipped when it is found in PATH.
+        unless_file_contains: A file path and a POSIX extended regular expression (as in `grep -E`, which
+            exported scripts use); the task is skipped when a line of the file matches it.
+    """
+
+    creates: str | None = None
+    unless_command_exists: str | None = None
+    unless_file_contains: tuple[str, str] | None = None
+
+    @classmethod
+    def from_config(cls, task_data: dict[str, Any]) -> "TaskGuard":
+        """
+        Reads the guards of a task from its manifest entry.
+
+        Raises:
+            ValueError: If `unless_file_contains` lacks its `path` or `pattern`, or the pattern is not a POSIX
+                extended regular expression that Python reads the same way.
+        """
+        contains = task_data.get("unless_file_contains")
+        if contains and not (contains.get("path") and contains.get("pattern")):
+            raise ValueError("'unless_file_contains' requires a 'path' and a 'pattern'")
+        if contains:
+            _check_extended_regex(contains["pattern"])
+        return cls(
+            creates=task_data.get("creates"),
+            unless_command_exists=task_data.get("unless_command_exists"),
+            unless_file_contains=(contains["path"], contains["pattern"]) if contains else None,
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.creates or self.unless_command_exists or self.unless_file_contains)
+
+    def skip_reason(self) -> str | None:
+        """
+        Evaluates the guards, recorded and replayed as a pseudo-command like the other in-process work.
+
+        Returns:
+            Why the task can be skipped, or None if it must run.
+        """
+        if not self:
+            return None
+        argv = ["setupwize-guard", *self.__describe()]
+        cassette = get_cassette()
+        if cassette and cassette.replaying:
+            output, exit_code = cassette.replay(argv, None)
+            return output.decode(errors="replace") if exit_code == 0 else None
+
+        start_time = time.time()
+        reason = self.__evaluate()
+        if cassette:
+            cassette.record(argv, None, 0 if reason else 1, (reason or "").encode(), time.time() - start_time)
+        return reason
+
+    def __evaluate(self) -> str | None:
+        if self.creates and Path(self.creates).expanduser().exists():
+            return f"'{self.creates}' already exists"
+        if self.unless_command_exists and command_exists(self.unless_command_exists):
+            return f"'{self.unless_command_exists}' is already installed"
+        if self.unless_file_contains and file_contains(*self.unless_file_contains):
+            path, pattern = self.unless_file_contains
+            return f"'{path}' already contains '{pattern}'"
+        return None
+
+    def __describe(self) -> list[str]:
+        described = [f"creates={self.creates}"] if self.creates else []
+        if self.unless_command_exists:
+            described.append(f"unless_command_exists={self.unless_command_exists}")
+        if self.unless_file_contains:
+            described.append("unless_file_contains={}:{}".format(*self.unless_file_contains))
+        return described
+
+    def to_shell(self) -> str:
+        """
+        Compiles the guards into a shell condition, true when the task must run.
+        """
+        conditions = [f"[ ! -e {_shell_path(self.creates)} ]"] if self.creates else []
+        if self.unless_command_exists:
+            conditions.append(f"! command -v {shlex.quote(self.unless_command_exists)} >/dev/null 2>&1")
+        if self.unless_file_contains:
+            path, pattern = self.unless_file_contains
+            conditions.append(f"! grep -qE {shlex.quote(pattern)} {_shell_path(path)} 2>/dev/null")
+        return " && ".join(conditions)
+
+
+def _check_extended_regex(pattern: str) -> None:
+    """
+    Checks that a pattern means the same to Python's `re`, which evaluates it during a run, and to `grep -E`,
+    which evaluates it in exported scripts.
+
+    Raises:
+        ValueError: If the pattern is invalid or uses a construct only one of them supports: escapes such as
+            `\\d` or `\\b`, `(?...)` groups (lookarounds, flags), lazy or possessive quantifiers, POSIX character
+            classes or backslashes in bracket expressions.
+    """
+    unsupported: str | None = None
+    index, after_quantifier = 0, False
+    while index < len(pattern) and unsupported is None:
+        char = pattern[index]
+        if char == "\\":
+            if pattern[index + 1 : index + 2].isalnum():
+                unsupported = pattern[index : index + 2]
+            index += 2
+            after_quantifier = False
+            continue
+        if char == "[":
+            # a leading "]" (after an optional "^") is a member of the bracket expression, not its end
+            end = pattern.find(
+                "]", index + (3 if pattern.startswith("[^]", index) else 2 if pattern.startswith("[]", index) else 1)
+            )
+            if end < 0:
+                break
+            bracket = pattern[index : end + 1]
+            if "[:" in bracket[1:] or "\\" in bracket:
+                unsupported = bracket
+            index = end + 1
+            after_quantifier = False
+            continue
+        if char == "(" and pattern.startswith("(?", index):
+            unsupported = "(?"
+        elif after_quantifier and char in "?+":
+            unsupported = f"lazy or possessive quantifier '{pattern[index - 1 : index + 1]}'"
+        after_quantifier = char in "*+?}"
+        index += 1
+
+    if unsupported:
+        raise ValueError(
+            f"Pattern '{pattern}' uses {unsupported}, which `grep -E` reads differently than Python; "
+            "write it as a POSIX extended regular expression"
+        )
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern '{pattern}': {e}")
+
+
 class Task(ABC):
+    # What limits the task by default, scheduling its commands in `--background` mode; shell commands may compile
+    RESOURCE_CLASS = "cpu"
+
     def __init__(self, task_name: str) -> None:
         self.task_name: str = task_name
+        self.resource_class: str = self.RESOURCE_CLASS
+        # Execution policy, enforced by Package.install: limits of the task's commands and attempts left on failure
+        self.timeout: float | None = None
+        self.stall_timeout: float | None = None
+        self.retries: int = 0
+        # Finalizers run once for the whole run: requested when the task succeeds, run before a task needing them
+        self.finalize: list[Finalizer] = []
+        self.needs: list[Finalizer] = []
+        # Skips the task, without running needs nor requesting finalizers, when there is nothing to do
+        self.guard = TaskGuard()
 
     @abstractmethod
     def execute(self):
         pass
 
+    @abstractmethod
+    def to_shell(self) -> list[str]:
+        """
+        Compiles the task into POSIX shell lines performing the same work, for exported scripts and Dockerfiles.
+        """
+
+    def to_guarded_shell(self) -> list[str]:
+        """
+        Compiles the task like `to_shell`, skipped by the shell when its guard holds.
+        """
+        if not self.guard:
+            return self.to_shell()
+        return [f"if {self.guard.to_shell()}; then", *(f"  {line}" for line in self.to_shell()), "fi"]
+
 
 class AptTask(Task):
+    # Packages are unpacked from archives downloaded ahead of time, refreshing the indexes is a download
+    RESOURCE_CLASS = "disk"
+    # Third-party sources and their signing keys are stored here by `add_repo`
+    SOURCES_DIR = Path("/etc/apt/sources.list.d")
+    KEYRINGS_DIR = Path("/etc/apt/keyrings")
+
     def __init__(
-        self, action: str, package: str | list[str] | None = None, repo: str | None = None, verbose: bool = False
+        self,
+        action: str,
+        package: str | list[str] | None = None,
+        repo: str | None = None,
+        verbose: bool = False,
+        options: dict[str, str] | None = None,
+        key_url: str | None = None,
+        name: str | None = None,
     ) -> None:
         """
         action: accept (update, install, add_repo)
+        options: extra apt configuration passed to apt-get as `-o key=value`
+        key_url: (add_repo) the signing key of the repository, stored in /etc/apt/keyrings/<name>.(asc|gpg)
+        name: (add_repo) writes `repo`, a one-line "deb ..." entry, to /etc/apt/sources.list.d/<name>.list
+            instead of calling apt-add-repository
+
+        `add_repo` only refreshes the index of the added source, not of every configured source.
         """
         super().__init__("apt_interface")
         if not action:
@@ -44,38 +253,62 @@ class AptTask(Task):
         if action == "install" and not package:
             raise ValueError("Package cannot be empty")
 
+        if key_url and not name:
+            raise ValueError("A repository with a signing key needs a name")
+        if key_url and repo and "signed-by=" in repo:
+            raise ValueError("The signed-by option of the repository is set from its signing key, remove it")
+
         self.action: str = action
+        if action in ("update", "add_repo"):
+            self.resource_class = "network"
         self.verbose: bool = verbose
+        self.options: dict[str, str] = options or {}
         if package:
             self.package: list[str] = package
         if repo:
             self.repo: str = repo
+        self.key_url: str | None = key_url
+        self.name: str | None = name
+
+    @staticmethod
+    def __option_args(options: dict[str, str]) -> list[str]:
+        """
+        Expand apt configuration options into command line arguments.
+
+        Returns:
+            A list of `-o key=value` arguments.
+        """
+        args: list[str] = []
+        for key, value in options.items():
+            args.extend(["-o", f"{key}={value}"])
+        return args
 
     @staticmethod
-    def __update_cmd() -> list[str]:
+    def __update_cmd(options: list[str]) -> list[str]:
         """
         Update the system.
 
         Returns:
             A list of strings representing the command to execute.
         """
-        return ["sudo", "-S", "apt-get", "update", "-y"]
+        return ["sudo", "-S", "apt-get", *options, "update", "-y"]
 
     @staticmethod
-    def __install_cmd(packages: list[str]) -> list[str]:
+    def __install_cmd(packages: list[str], options: list[str]) -> list[str]:
         """
         Install packages using apt-get.
 
         Args:
             packages: The package name(s) to install (str or list of str).
+            options: The `-o key=value` arguments to pass to apt-get.
 
         Returns:
             A list of strings representing the command to execute.
 
         Examples:
-            - install_cmd(["git", "curl"])
+            - install_cmd(["git", "curl"], [])
         """
-        cmd = ["sudo", "-S", "apt-get", "install", "-y"]
+        cmd = ["sudo", "-S", "apt-get", *options, "install", "-y"]
         cmd.extend(packages)
 
         return cmd
@@ -96,16 +329,113 @@ class AptTask(Task):
         """
         return ["sudo", "-S", "apt-add-repository", "-y", repo]
 
+    @staticmethod
+    def __source_update_options(source: Path) -> list[str]:
+        """
+        Restrict `apt-get update` to a single source file.
+
+        Returns:
+            The `-o key=value` arguments reading only `source` and keeping the indexes of the other sources.
+        """
+        return [
+            "-o",
+            f"Dir::Etc::sourcelist={source}",
+            "-o",
+            "Dir::Etc::sourceparts=-",
+            "-o",
+            "APT::Get::List-Cleanup=0",
+        ]
+
+    def __add_source_script(self) -> list[str]:
+        """
+        Write the signing key (if any) and the source entry of a named repository.
+
+        The key format is only known once downloaded: an ASCII-armored key must end in .asc, a binary one in .gpg.
+
+        Returns:
+            The lines of a POSIX shell script.
+        """
+        assert self.name is not None  # noqa: S101
+        source = shlex.quote(str(self.SOURCES_DIR / f"{self.name}.list"))
+        if not self.key_url:
+            return [f"echo {shlex.quote(self.repo)} | sudo tee {source} > /dev/null"]
+
+        lines = [
+            "key=$(mktemp) && trap 'rm -f \"$key\"' EXIT",
+            f'curl -fsSL {shlex.quote(self.key_url)} -o "$key"',
+        ]
+        for condition, extension in (("if grep -q 'BEGIN PGP' \"$key\"; then", "asc"), ("else", "gpg")):
+            keyring = self.KEYRINGS_DIR / f"{self.name}.{extension}"
+            entry = _signed_entry(self.repo, str(keyring))
+            lines += [
+                condition,
+                f'  sudo install -D -m 644 "$key" {shlex.quote(str(keyring))}',
+                f"  echo {shlex.quote(entry)} | sudo tee {source} > /dev/null",
+            ]
+        return [*lines, "fi"]
+
+    def __add_repository(self, apt_options: dict[str, str]) -> None:
+        """
+        Add the repository, then update the index of its source only.
+        """
+        options = self.__option_args(apt_options)
+        if self.name:
+            run_command(["/bin/sh", "-c", "\n".join(self.__add_source_script())], verbose=self.verbose)
+            added = [self.SOURCES_DIR / f"{self.name}.list"]
+        else:
+            # apt-add-repository names the source file itself, find it by comparing the directory before and after
+            before = _source_files(self.SOURCES_DIR)
+            run_command([*self.__add_repository_cmd(self.repo), "--no-update"], verbose=self.verbose)
+            after = _source_files(self.SOURCES_DIR)
+            added = sorted(path for path, stat in after.items() if before.get(path) != stat)
+            if not added:
+                logger.info(f"Repository '{self.repo}' is already configured")
+
+        backend = get_apt_backend()
+        for source in added:
+            if backend:
+                backend.update(apt_options, sources_list=source)
+            else:
+                run_command(self.__update_cmd([*options, *self.__source_update_options(source)]), verbose=self.verbose)
+
     def execute(self):
-        if self.action == "update":
-            run_command(self.__update_cmd(), verbose=self.verbose)
+        # another apt frontend (e.g. unattended-upgrades) may hold the dpkg lock, wait instead of failing
+        try:
+            waited = wait_for_dpkg_lock()
+        except TimeoutError as e:
+            raise TaskExecutionFailedError(f"'{self.task_name}' failed: {e}")
+
+        # apt also waits for a lock taken between the probe and its start, for the rest of the timeout
+        apt_options = {**dpkg_lock_options(waited), **self.options}
+        options = self.__option_args(apt_options)
+        # the in-process backend, when enabled, replaces the apt-get calls
+        backend = get_apt_backend()
+        if self.action == "update" and backend:
+            backend.update(apt_options)
+        elif self.action == "update":
+            run_command(self.__update_cmd(options), verbose=self.verbose)
+        elif self.action == "install" and backend:
+            backend.install(self.package, apt_options)
         elif self.action == "install":
-            run_command(self.__install_cmd(self.package), verbose=self.verbose)
+            run_command(self.__install_cmd(self.package, options), verbose=self.verbose)
         elif self.action == "add_repo":
-            run_command(self.__add_repository_cmd(self.repo), verbose=self.verbose)
-        elif self.action == "add_repo":
-            run_command(self.__add_repository_cmd(self.repo), verbose=self.verbose)
-            run_command(self.__update_cmd(), verbose=self.verbose)
+            self.__add_repository(apt_options)
+
+    def to_shell(self) -> list[str]:
+        options = self.__option_args(self.options)
+        if self.action == "update":
+            cmd = self.__update_cmd(options)
+        elif self.action == "install":
+            cmd = self.__install_cmd(self.package, options)
+        elif self.name:
+            source = self.SOURCES_DIR / f"{self.name}.list"
+            cmd = self.__update_cmd([*options, *self.__source_update_options(source)])
+            return [*_subshell("\n".join(self.__add_source_script())), shlex.join(arg for arg in cmd if arg != "-S")]
+        else:
+            # without --no-update the source file name is not needed, at the cost of a full update
+            cmd = self.__add_repository_cmd(self.repo)
+        # exported scripts may be piped into sh, sudo must not read the password from their stdin
+        return [shlex.join(arg for arg in cmd if arg != "-S")]
 
 
 class CommandTask(Task):
@@ -132,16 +462,23 @@ class CommandTask(Task):
 
     def execute(self):
         try:
+            if uses_dpkg(self.command):
+                wait_for_dpkg_lock()
             run_command(self.__run_shell_cmd(self.command), verbose=self.verbose)
         except Exception as e:
             raise TaskExecutionFailedError(f"'{self.task_name}' failed: {e}")
 
+    def to_shell(self) -> list[str]:
+        return _subshell(self.command)
+
 
 class GnomeSettingsTask(Task):
     """
     Represents a task for setting or getting Gnome settings.
     """
 
+    RESOURCE_CLASS = "disk"
+
     def __init__(self, action: str, schema: str, key: str, value: str = "", verbose: bool = False) -> None:
         """
         Initializes a GnomeSettingsTask.
@@ -193,12 +530,19 @@ class GnomeSettingsTask(Task):
         elif self.action == "get":
             run_command(self.__get_gnome_settings(self.schema, self.key), verbose=self.verbose)
 
+    def to_shell(self) -> list[str]:
+        if self.action == "set":
+            return [shlex.join(self.__set_gnome_settings(self.schema, self.key, self.value))]
+        return [shlex.join(self.__get_gnome_settings(self.schema, self.key))]
+
 
 class ConfigurationTask(Task):
     """
     Represents a task for copying configuration files and optionally executing commands.
     """
 
+    RESOURCE_CLASS = "disk"
+
     def __init__(
         self,
         config_paths: list[str],
@@ -222,6 +566,7 @@ class ConfigurationTask(Task):
         self.command = command
         self.verbose = verbose
         self.clean_up_cmd = clean_up_cmd
+        self.copy_engine = CopyEngine()
 
         if not self.config_paths or not self.destinations:
             logger.warning("No configuration paths or destinations provided. Skipping task.")
@@ -282,12 +627,11 @@ class ConfigurationTask(Task):
                             shutil.copy2(config_dest, backup_dest)
 
                 config_dest.parent.mkdir(parents=True, exist_ok=True)
-                if config_source.is_dir():
-                    shutil.copytree(config_source, config_dest)
-                else:
-                    shutil.copy2(config_source, config_dest)
+                if config_source.is_file() and config_dest.is_dir():
+                    config_dest = config_dest / config_source.name
+                stats = self.copy_engine.copy(config_source, config_dest)
 
-                logger.info(f"Configuration copied from '{config_source}' to '{config_dest}'")
+                logger.info(f"Configuration copied from '{config_source}' to '{config_dest}': {stats}")
             except Exception as e:
                 raise TaskExecutionFailedError(f"Configuration task '{self.task_name}' failed: {e}")
 
@@ -298,13 +642,361 @@ class ConfigurationTask(Task):
             except Exception as e:
                 raise TaskExecutionFailedError(f"'{self.task_name}' failed: {e}")
 
+    def to_shell(self) -> list[str]:
+        lines: list[str] = _subshell(self.command) if self.command else []
+        for config_path, dest in zip(self.config_paths or [], self.destinations or [], strict=False):
+            source, destination = _shell_path(config_path), _shell_path(dest)
+            if Path(config_path).expanduser().is_dir():
+                lines.append(f"mkdir -p {destination} && cp -R {source}/. {destination}/")
+            else:
+                # like execute(), a file copied onto an existing directory lands inside it
+                lines.append(
+                    f"if [ -d {destination} ]; then cp {source} {destination}/; "
+                    f'else mkdir -p "$(dirname {destination})" && cp {source} {destination}; fi'
+                )
+        if self.clean_up_cmd:
+            lines.extend(_subshell(self.clean_up_cmd))
+        return lines
+
+
+class ArchiveTask(Task):
+    """
+    Represents a task that extracts selected members of a tar or zip archive straight to their destinations.
+
+    Tar archives are streamed from the URL and extracted on the fly, so nothing but the selected members ever
+    touches the disk. Zip archives keep their central directory at the end of the file, they are therefore
+    spooled in memory (and only spilled to a temporary file when larger than ZIP_SPOOL_SIZE) before extraction.
+
+    The extraction does not run through `run_command`, the task's timeout and stall timeout are enforced on
+    every read of the archive and on the `sudo install` writing a member.
+    """
+
+    RESOURCE_CLASS = "network"
+
+    # The size up to which zip archives are buffered in memory
+    ZIP_SPOOL_SIZE = 64 * 1024 * 1024
 
-def create_task_from_config(task_data: dict[str, Any], verbose: bool = False) -> Task:
+    # The longest a network read may block when the task sets no shorter limit
+    READ_TIMEOUT = 30.0
+
+    def __init__(
+        self,
+        source: str,
+        members: list[dict[str, Any]],
+        archive_format: str | None = None,
+        verbose: bool = False,
+    ) -> None:
+        """
+        Initializes an ArchiveTask.
+
+        Args:
+            source: The URL or local path of the archive.
+            members: The members to extract, each a dictionary with a `pattern` (glob matched against the member
+                path or its basename), a `destination` (a file path, or a directory when it ends with "/") and an
+                optional octal `mode`.
+            archive_format: "tar" or "zip". Inferred from the source when omitted.
+            verbose: Whether to display verbose output.
+        """
+        super().__init__("archive_task")
+        if not source:
+            raise ValueError("Source cannot be empty")
+        if not members:
+            raise ValueError("At least one member must be selected")
+        for member in members:
+            if not member.get("pattern") or not member.get("destination"):
+                raise ValueError("Every member requires a 'pattern' and a 'destination'")
+            mode = member.get("mode")
+            if mode is not None and not _is_file_mode(mode):
+                raise ValueError(
+                    f"Invalid mode {mode!r} for member '{member['pattern']}', expected an octal mode (e.g. \"0755\")"
+                )
+
+        archive_format = archive_format or ("zip" if source.lower().endswith(".zip") else "tar")
+        if archive_format not in ("tar", "zip"):
+            raise ValueError(f"Invalid archive format: {archive_format}")
+
+        self.source = source
+        self.members = members
+        self.archive_format = archive_format
+        self.verbose = verbose
+
+    @contextmanager
+    def __open_source(self, limits: LimitTracker) -> Iterator[IO[bytes]]:
+        """
+        Opens the archive as a stream, either from the network or from the local filesystem, read within the
+        limits of the task.
+        """
+        _check_limits(limits, self.source)
+        if "://" in self.source:
+            # a blocked read returns by the time the limits would expire
+            timeout = min(self.READ_TIMEOUT, limits.remaining() or self.READ_TIMEOUT)
+            try:
+                response = urllib.request.urlopen(self.source, timeout=timeout)  # noqa: S310
+            except (TimeoutError, urllib.error.URLError) as e:
+                if isinstance(e, TimeoutError) or isinstance(e.reason, TimeoutError):
+                    raise CommandTimeoutError(f"Connecting to '{self.source}' {limits.check() or 'timed out'}") from e
+                raise
+            with response:
+                yield cast(IO[bytes], _LimitedReader(response, limits, self.source))
+        else:
+            with Path(self.source).expanduser().open("rb") as f:
+                yield cast(IO[bytes], _LimitedReader(f, limits, self.source))
+
+    def __iter_members(self, stream: IO[bytes]) -> Iterator[tuple[str, IO[bytes]]]:
+        """
+        Yields the name and content stream of every regular file in the archive, in archive order.
+        """
+        if self.archive_format == "tar":
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                for tar_member in tar:
+                    content = tar.extractfile(tar_member) if tar_member.isfile() else None
+                    if content:
+                        yield tar_member.name, content
+            return
+
+        # zip needs random access to the central directory; local files are seekable already
+        if not stream.seekable():
+            spool = tempfile.SpooledTemporaryFile(max_size=self.ZIP_SPOOL_SIZE)
+            shutil.copyfileobj(stream, spool)
+            spool.seek(0)
+            stream = spool
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as content:
+                        yield info.filename, content
+
+    def __match(self, name: str) -> dict[str, Any] | None:
+        basename = PurePosixPath(name).name
+        for member in self.members:
+            if fnmatch.fnmatch(name, member["pattern"]) or fnmatch.fnmatch(basename, member["pattern"]):
+                return member
+        return None
+
+    @staticmethod
+    def __write(content: IO[bytes], destination: Path, mode: int | None, limits: LimitTracker) -> None:
+        """
+        Writes a member to its destination, through `sudo install` when the directory is not writable.
+
+        Raises:
+            CommandTimeoutError: If the limits of the task expire; `sudo install` is then killed before it could
+                install a truncated member.
+        """
+        if _is_writable(destination.parent):
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            partial = destination.with_name(f".{destination.name}.part")
+            with partial.open("wb") as f:
+                shutil.copyfileobj(content, f)
+            if mode is not None:
+                partial.chmod(mode)
+            partial.replace(destination)
+            return
+
+        octal_mode = f"{mode if mode is not None else 0o644:o}"
+        cmd = ["sudo", "install", "-D", "-m", octal_mode, "/dev/stdin", str(destination)]
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE) as proc:  # noqa: S603
+            try:
+                assert proc.stdin is not None  # noqa: S101
+                shutil.copyfileobj(content, proc.stdin)
+                proc.stdin.close()
+                proc.wait(timeout=limits.remaining())
+            except subprocess.TimeoutExpired as e:
+                proc.kill()
+                raise CommandTimeoutError(f"'{shlex.join(cmd)}' {limits.check() or 'timed out'}") from e
+            except BaseException:
+                proc.kill()
+                raise
+        if proc.returncode != 0:
+            raise TaskExecutionFailedError(f"Failed to install '{destination}' (exit code {proc.returncode})")
+
+    def execute(self):
+        # the extraction does not go through run_command, it is recorded and replayed as a pseudo-command
+        argv = ["setupwize-extract", self.source]
+        cassette = get_cassette()
+        if cassette and cassette.replaying:
+            output, exit_code = cassette.replay(argv, None)
+            if exit_code:
+                raise TaskExecutionFailedError(output.decode(errors="replace"))
+            logger.info(output.decode(errors="replace"))
+            return
+
+        start_time = time.time()
+        try:
+            message = self.__extract()
+        except SetUpWizeError as e:
+            if cassette:
+                cassette.record(argv, None, 1, str(e).encode(), time.time() - start_time)
+            raise
+        if cassette:
+            cassette.record(argv, None, 0, message.encode(), time.time() - start_time)
+        logger.info(message)
+
+    def __extract(self) -> str:
+        """
+        Extracts the selected members.
+
+        Returns:
+            A summary of the extraction.
+        """
+        extracted: dict[str, int] = {member["pattern"]: 0 for member in self.members}
+        limits = LimitTracker()
+        try:
+            with self.__open_source(limits) as stream:
+                for name, content in self.__iter_members(stream):
+                    member = self.__match(name)
+                    if member is None:
+                        continue
+
+                    destination = Path(member["destination"]).expanduser()
+                    if member["destination"].endswith("/"):
+                        destination = destination / PurePosixPath(name).name
+                    mode = member.get("mode")
+                    mode = mode if mode is None or isinstance(mode, int) else int(mode, 8)
+                    self.__write(content, destination, mode, limits)
+
+                    extracted[member["pattern"]] += 1
+                    if self.verbose:
+                        logger.info(f"Extracted '{name}' to '{destination}'")
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            raise TaskExecutionFailedError(f"'{self.task_name}' failed to extract '{self.source}': {e}")
+
+        missing = [pattern for pattern, count in extracted.items() if count == 0]
+        if missing:
+            raise TaskExecutionFailedError(f"'{self.task_name}' found no members matching: {', '.join(missing)}")
+        return f"Extracted {sum(extracted.values())} file(s) from '{self.source}'"
+
+    def to_shell(self) -> list[str]:
+        if "://" in self.source:
+            fetch = f'curl -fsSL {shlex.quote(self.source)} -o "$tmp/archive"'
+        else:
+            fetch = f'cp {_shell_path(self.source)} "$tmp/archive"'
+        if self.archive_format == "tar":
+            extract = 'tar -xf "$tmp/archive" -C "$tmp/files"'
+        else:
+            extract = 'unzip -q "$tmp/archive" -d "$tmp/files"'
+
+        body = ["tmp=$(mktemp -d)", "trap 'rm -rf \"$tmp\"' EXIT", fetch, 'mkdir "$tmp/files"', extract]
+        for member in self.members:
+            pattern: str = member["pattern"]
+            match = f'-path "$tmp/files/"{shlex.quote(pattern)}' if "/" in pattern else f"-name {shlex.quote(pattern)}"
+            mode = member.get("mode")
+            octal_mode = f"{mode:o}" if isinstance(mode, int) else (mode or "644")
+            # paths outside the home directory are written as root, like execute() does when they are not writable
+            sudo = "" if member["destination"].startswith("~") else "sudo "
+            destination = _shell_path(member["destination"].rstrip("/"))
+            if member["destination"].endswith("/"):
+                install = f"{sudo}install -D -m {octal_mode} -t {destination} {{}} +"
+            else:
+                install = f"{sudo}install -D -m {octal_mode} {{}} {destination} \\;"
+            body.append(f'find "$tmp/files" -type f {match} -exec {install}')
+
+        return ["(", *(f"  {line}" for line in body), ")"]
+
+
+class _LimitedReader:
+    """
+    Reads a stream within the limits of a task: every read counts as progress, and once the limits expire, or
+    a read blocks until they would, CommandTimeoutError is raised so the task can be retried.
+    """
+
+    def __init__(self, stream: IO[bytes], limits: LimitTracker, source: str):
+        self.stream = stream
+        self.limits = limits
+        self.source = source
+
+    def read(self, size: int = -1) -> bytes:
+        _check_limits(self.limits, self.source)
+        try:
+            data = self.stream.read(size)
+        except TimeoutError as e:
+            raise CommandTimeoutError(f"Reading '{self.source}' {self.limits.check() or 'timed out'}") from e
+        if data:
+            self.limits.touch()
+        return data
+
+    def __getattr__(self, name: str) -> Any:  # noqa: ANN401
+        return getattr(self.stream, name)
+
+
+def _check_limits(limits: LimitTracker, source: str) -> None:
+    if limits.check():
+        raise CommandTimeoutError(f"Reading '{source}' {limits.expired}")
+
+
+def _shell_path(path: str) -> str:
+    """
+    Quotes a path for the shell, keeping a leading `~/` expandable as "$HOME".
+    """
+    if path == "~" or path.startswith("~/"):
+        rest = path[2:]
+        return '"$HOME"' + (f"/{shlex.quote(rest)}" if rest else "")
+    return shlex.quote(path)
+
+
+def _subshell(command: str) -> list[str]:
+    """
+    Wraps a shell command in a subshell, so its `cd`, `exit` and variables do not leak into the next steps.
+    """
+    return ["(", *command.rstrip().splitlines(), ")"]
+
+
+def _signed_entry(entry: str, keyring: str) -> str:
+    """
+    Adds the signed-by option to a one-line source entry (e.g. "deb [arch=amd64] https://... stable main").
+    """
+    kind, _, rest = entry.strip().partition(" ")
+    rest = rest.lstrip()
+    if rest.startswith("["):
+        options, _, rest = rest[1:].partition("]")
+        return f"{kind} [{' '.join([*options.split(), f'signed-by={keyring}'])}] {rest.lstrip()}"
+    return f"{kind} [signed-by={keyring}] {rest}"
+
+
+def _source_files(sources_dir: Path) -> dict[Path, tuple[int, int]]:
+    """
+    Lists the apt source files of a directory with their modification time and size.
+    """
+    if not sources_dir.is_dir():
+        return {}
+    return {
+        path: (path.stat().st_mtime_ns, path.stat().st_size)
+        for path in sources_dir.iterdir()
+        if path.suffix in (".list", ".sources")
+    }
+
+
+def _is_file_mode(mode: object) -> bool:
+    """
+    Checks that a manifest mode is an octal file mode: a string of octal digits, or the number YAML reads from
+    an unquoted one.
+    """
+    if isinstance(mode, str):
+        if not mode or any(digit not in "01234567" for digit in mode):
+            return False
+        mode = int(mode, 8)
+    return isinstance(mode, int) and not isinstance(mode, bool) and 0 <= mode <= 0o7777
+
+
+def _is_writable(directory: Path) -> bool:
+    """
+    Checks whether the current user can write to (or create) a directory, judged by its closest existing ancestor.
+    """
+    while not directory.exists() and directory != directory.parent:
+        directory = directory.parent
+    return os.access(directory, os.W_OK)
+
+
+def create_task_from_config(
+    task_data: dict[str, Any],
+    verbose: bool = False,
+    apt_options: dict[str, str] | None = None,
+) -> Task:
     """
     Creates a Task object based on the provided YAML configuration.
 
     Args:
         task_data: A dictionary containing the task's type and configuration.
+        apt_options: (Optional) Extra apt configuration applied to every apt task.
 
     Returns:
         A Task object of the appropriate type.
@@ -314,20 +1006,24 @@ def create_task_from_config(task_data: dict[str, Any], verbose: bool = False) ->
     """
     task_type = task_data["type"]
 
+    task: Task
     if task_type == "apt":
-        return AptTask(
+        task = AptTask(
             action=task_data["action"],
             package=task_data.get("packages", []),
             repo=task_data.get("repo", ""),
             verbose=verbose,
+            options=apt_options,
+            key_url=task_data.get("key_url"),
+            name=task_data.get("name"),
         )
     elif task_type == "shell":
-        return CommandTask(
+        task = CommandTask(
             command=task_data["command"],
             verbose=verbose,
         )
     elif task_type == "gnome_settings":
-        return GnomeSettingsTask(
+        task = GnomeSettingsTask(
             action=task_data["action"],
             schema=task_data["schema"],
             key=task_data["key"],
@@ -335,12 +1031,36 @@ def create_task_from_config(task_data: dict[str, Any], verbose: bool = False) ->
             verbose=verbose,
         )
     elif task_type == "configuration":
-        return ConfigurationTask(
+        task = ConfigurationTask(
             config_paths=task_data.get("config_path", ""),
             destinations=task_data.get("destination", ""),
             command=task_data.get("command", []),
             clean_up_cmd=task_data.get("clean_up_cmd", ""),
             verbose=verbose,
         )
+    elif task_type == "archive":
+        task = ArchiveTask(
+            source=task_data.get("url") or task_data.get("path", ""),
+            members=task_data.get("members", []),
+            archive_format=task_data.get("format"),
+            verbose=verbose,
+        )
     else:
         raise ValueError(f"Unrecognized task type: {task_type}")
+
+    task.timeout = task_data.get("timeout")
+    task.stall_timeout = task_data.get("stall_timeout")
+    task.retries = task_data.get("retries", 0)
+    task.finalize = [Finalizer.parse(spec) for spec in _as_list(task_data.get("finalize"))]
+    task.needs = [Finalizer.parse(spec) for spec in _as_list(task_data.get("needs"))]
+    task.guard = TaskGuard.from_config(task_data)
+    task.resource_class = task_data.get("resource_class", task.resource_class)
+    if task.resource_class not in RESOURCE_CLASSES:
+        raise ValueError(f"Invalid resource class: {task.resource_class}")
+    return task
+
+
+def _as_list(value: str | list[str] | None) -> list[str]:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
@@ -0,0 +1,171 @@
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import ExitStack
+from pathlib import Path
+from typing import IO, Any
+
+logger = logging.getLogger(__name__)
+
+# The index of every archived run, one JSON entry per line and per archived output
+INDEX_FILENAME = "index.jsonl"
+
+
+class RunArchive:
+    """
+    Stores the output of every command of a run, and the run log, in a compressed per-run archive.
+
+    Each output is compressed as a separate gzip member appended to `<run>.log.gz`, so the archive is a regular
+    gzip file (`zcat` shows the whole run) while any single output can be read by seeking to its member. The
+    members are listed in the shared `index.jsonl` with their run, package, task, exit code and byte range,
+    which lets a search skip every output that does not match the query without decompressing anything.
+    """
+
+    def __init__(self, log_dir: str | Path, run_id: str, compresslevel: int = 6):
+        """
+        Initializes the RunArchive.
+
+        Args:
+            log_dir: The log directory holding the archives and the index.
+            run_id: The run identifier, also the archive name.
+            compresslevel: The gzip compression level of the members.
+        """
+        self.log_dir = Path(log_dir)
+        self.run_id = run_id
+        self.compresslevel = compresslevel
+        self.path = self.log_dir / f"{run_id}.log.gz"
+        self._archive: IO[bytes] | None = None
+        self._index: IO[str] | None = None
+        self._lock = threading.Lock()
+
+    def add(self, data: bytes, **fields: Any) -> None:  # noqa: ANN401
+        """
+        Compresses and appends an output to the archive, and indexes it.
+
+        Args:
+            data: The output.
+            **fields: The metadata stored in the index (e.g. package, task, exit_code).
+        """
+        member = gzip.compress(data, self.compresslevel, mtime=0)
+        with self._lock:
+            # the files are created on the first output, runs that stop early leave nothing behind
+            if self._archive is None or self._index is None:
+                self.log_dir.mkdir(parents=True, exist_ok=True)
+                self._archive = self.path.open("ab")
+                self._index = (self.log_dir / INDEX_FILENAME).open("a")
+            offset = self._archive.tell()
+            self._archive.write(member)
+            entry = {
+                "run": self.run_id,
+                "archive": self.path.name,
+                "time": time.time(),
+                **fields,
+                "offset": offset,
+                "length": len(member),
+                "size": len(data),
+            }
+            self._index.write(json.dumps(entry, default=str) + "\n")
+            # an interrupted run keeps every output indexed so far
+            self._archive.flush()
+            self._index.flush()
+
+    def close(self, log_file: Path | None = None) -> None:
+        """
+        Appends the run log to the archive, removes the uncompressed log and closes the archive.
+
+        Args:
+            log_file: (Optional) The log file of the run; its handlers are detached before it is archived.
+        """
+        if log_file and log_file.is_file():
+            root = logging.getLogger()
+            for handler in root.handlers[:]:
+                if isinstance(handler, logging.FileHandler) and Path(handler.baseFilename) == log_file.resolve():
+                    root.removeHandler(handler)
+                    handler.close()
+            self.add(log_file.read_bytes(), task="run_log")
+            log_file.unlink()
+        if self._archive and self._index:
+            self._archive.close()
+            self._index.close()
+
+
+_run_archive: RunArchive | None = None
+
+
+def open_run_archive(log_dir: str | Path, run_id: str) -> RunArchive:
+    """
+    Starts archiving the output of the commands run by `run_command`.
+    """
+    global _run_archive  # noqa: PLW0603
+    _run_archive = RunArchive(log_dir, run_id)
+    return _run_archive
+
+
+def get_run_archive() -> RunArchive | None:
+    """
+    Returns the archive of the current run, or None when outputs are not archived.
+    """
+    return _run_archive
+
+
+def close_run_archive(log_file: Path | None = None) -> None:
+    """
+    Archives the run log and stops archiving.
+    """
+    global _run_archive  # noqa: PLW0603
+    if _run_archive:
+        _run_archive.close(log_file)
+        _run_archive = None
+
+
+def search_logs(
+    log_dir: str | Path,
+    pattern: str | None = None,
+    packages: list[str] | None = None,
+    failed: bool = False,
+) -> Iterator[tuple[dict[str, Any], list[str]]]:
+    """
+    Searches the archived outputs of every run, oldest first.
+
+    The index is filtered on the metadata first; only the outputs left are read, each by seeking to its gzip
+    member and decompressing that member alone.
+
+    Args:
+        log_dir: The log directory holding the archives and the index.
+        pattern: (Optional) A regular expression the output lines must match.
+        packages: (Optional) Only search the outputs of these packages.
+        failed: Only search the outputs of commands that exited with a non-zero code.
+
+    Yields:
+        The index entry of every matching output, with its matching lines (all lines without a pattern).
+    """
+    log_dir = Path(log_dir)
+    index_path = log_dir / INDEX_FILENAME
+    if not index_path.is_file():
+        return
+    regex = re.compile(pattern) if pattern else None
+
+    with ExitStack() as stack, index_path.open() as index:
+        archives: dict[str, IO[bytes]] = {}
+        for line in index:
+            entry: dict[str, Any] = json.loads(line)
+            if packages and entry.get("package") not in packages:
+                continue
+            if failed and not entry.get("exit_code"):
+                continue
+
+            if entry["archive"] not in archives:
+                archives[entry["archive"]] = stack.enter_context((log_dir / entry["archive"]).open("rb"))
+            archive = archives[entry["archive"]]
+            archive.seek(entry["offset"])
+            output = gzip.decompress(archive.read(entry["length"])).decode(errors="replace")
+            lines = output.splitlines()
+            if regex:
+                lines = [output_line for output_line in lines if regex.search(output_line)]
+                if not lines:
+                    continue
+            yield entry, lines
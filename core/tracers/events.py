@@ -0,0 +1,212 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+# Events are regular log records of this logger. Without an NdjsonEventHandler attached the logger has no
+# handlers and does not propagate, so emitting an event costs a single level check.
+EVENT_LOGGER_NAME = "setupwize.events"
+_event_logger = logging.getLogger(EVENT_LOGGER_NAME)
+_event_logger.propagate = False
+_event_logger.setLevel(logging.WARNING)
+
+# Events that end a unit of work; the buffered stream is flushed after them so controllers see progress
+FLUSH_EVENTS = {"package_end", "run_end", "error"}
+
+_context = threading.local()
+
+
+def emit_event(event: str, **fields: Any) -> None:  # noqa: ANN401
+    """
+    Emits a machine-readable event, enriched with the current task scope (if any).
+
+    Args:
+        event: The event type (e.g. "package_start").
+        **fields: The event payload, must be JSON serializable.
+    """
+    if not _event_logger.isEnabledFor(logging.INFO):
+        return
+    scope: dict[str, Any] = getattr(_context, "scope", {})
+    _event_logger.info(event, extra={"event_fields": {**scope, **fields}})
+
+
+@contextmanager
+def task_scope(package: str, task: str, index: int) -> Iterator[None]:
+    """
+    Emits task_start/task_end around the block and tags the events emitted inside it with the task.
+
+    The task_end event reports the exit code of the last command run inside the block.
+    """
+    scope = {"package": package, "task": task, "index": index}
+    _context.scope = scope
+    _context.exit_code = None
+    emit_event("task_start")
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        _context.scope = {}
+        emit_event(
+            "task_end",
+            **scope,
+            status=status,
+            duration=round(time.perf_counter() - start, 6),
+            exit_code=getattr(_context, "exit_code", None),
+        )
+
+
+def current_scope() -> dict[str, Any]:
+    """
+    Returns the package and task the current thread is running, if any.
+    """
+    return dict(getattr(_context, "scope", {}))
+
+
+def record_exit_code(exit_code: int) -> None:
+    """
+    Records the exit code of the last command executed in the current task scope.
+    """
+    _context.exit_code = exit_code
+
+
+def last_exit_code() -> int | None:
+    """
+    Returns the exit code of the last command executed in the current (or last) task scope, if any.
+    """
+    return getattr(_context, "exit_code", None)
+
+
+class OutputSpool:
+    """
+    Stores the output of the executed commands in a single file, so events can reference it by byte range
+    instead of embedding it.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("ab")
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes) -> int:
+        """
+        Appends output to the spool.
+
+        Returns:
+            The offset at which the data was written.
+        """
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(data)
+            return offset
+
+    def reference(self, offset: int, length: int) -> None:
+        """
+        Emits an `output` event referencing a byte range of the spool.
+        """
+        self._file.flush()
+        emit_event("output", path=str(self.path), offset=offset, length=length)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_output_spool: OutputSpool | None = None
+
+
+def get_output_spool() -> OutputSpool | None:
+    """
+    Returns the spool command output is redirected to, or None when output goes to the terminal.
+    """
+    return _output_spool
+
+
+class NdjsonEventHandler(logging.Handler):
+    """
+    Writes events as newline-delimited JSON to a file descriptor, through a buffered writer.
+
+    The buffer is flushed after events that complete a unit of work and at most every `flush_interval`
+    seconds otherwise, so hundreds of events cost a handful of writes.
+    """
+
+    def __init__(self, fd: int = 1, flush_interval: float = 1.0):
+        """
+        Initializes the NdjsonEventHandler.
+
+        Args:
+            fd: The file descriptor to write to (1 for stdout).
+            flush_interval: The maximum time in seconds events may stay in the buffer.
+        """
+        super().__init__(logging.INFO)
+        self.run_id = uuid.uuid4().hex
+        self.flush_interval = flush_interval
+        self._stream = io.BufferedWriter(io.FileIO(os.dup(fd), "wb"), buffer_size=64 * 1024)
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        event = {
+            "ts": record.created,
+            "run": self.run_id,
+            "event": record.getMessage(),
+            **getattr(record, "event_fields", {}),
+        }
+        try:
+            with self.lock:  # type: ignore[union-attr]
+                self._stream.write(json.dumps(event, default=str).encode() + b"\n")
+                now = time.monotonic()
+                if event["event"] in FLUSH_EVENTS or now - self._last_flush >= self.flush_interval:
+                    self._stream.flush()
+                    self._last_flush = now
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        if not self._stream.closed:
+            self._stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._stream.close()
+        super().close()
+
+
+def enable_event_stream(fd: int, output_path: str | Path) -> NdjsonEventHandler:
+    """
+    Starts emitting events to a file descriptor and redirects command output to a spool file.
+
+    Args:
+        fd: The file descriptor receiving the NDJSON events.
+        output_path: The file storing the command output referenced by `output` events.
+
+    Returns:
+        The installed handler.
+    """
+    global _output_spool  # noqa: PLW0603
+    handler = NdjsonEventHandler(fd)
+    _event_logger.addHandler(handler)
+    _event_logger.setLevel(logging.INFO)
+    _output_spool = OutputSpool(output_path)
+    return handler
+
+
+def disable_event_stream() -> None:
+    """
+    Flushes and removes the event handlers and stops redirecting command output.
+    """
+    global _output_spool  # noqa: PLW0603
+    for handler in _event_logger.handlers[:]:
+        _event_logger.removeHandler(handler)
+        handler.close()
+    _event_logger.setLevel(logging.WARNING)
+    if _output_spool:
+        _output_spool.close()
+        _output_spool = None
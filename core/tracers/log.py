@@ -99,6 +99,7 @@ class LogConfig:
         rich_handler_show_time: Whether to show the timestamp in the rich console handler.
         rich_handler_show_level: Whether to show the log level in the rich console handler.
         rich_handler_show_path: Whether to show the file path and line number in the rich console handler.
+        console: Whether to log to the console at all. When False, records only go to the log file.
 
     Example:
         ```python
@@ -125,6 +126,7 @@ class LogConfig:
         rich_handler_show_time: bool = False,
         rich_handler_show_level: bool = True,
         rich_handler_show_path: bool = False,
+        console: bool = True,
     ):
         if not log_path:
             raise ValueError("log_path is required")
@@ -148,6 +150,7 @@ class LogConfig:
         self.rich_handler_show_time = rich_handler_show_time
         self.rich_handler_show_level = rich_handler_show_level
         self.rich_handler_show_path = rich_handler_show_path
+        self.console_enabled = console
 
         self.logfile_format: str = logfile_format
         self.logfile_datefmt: str = logfile_datefmt
@@ -211,7 +214,8 @@ class LogConfig:
             logger.removeHandler(handler)
 
         # Add handlers to root logger
-        logger.addHandler(self.handler)
+        if self.console_enabled:
+            logger.addHandler(self.handler)
         logger.addHandler(file_handler)
 
         # Get or create the logger for the specific source
@@ -0,0 +1,158 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PhaseTiming:
+    """
+    The time split of a profiled phase.
+
+    Attributes:
+        name: The phase name.
+        wall: The elapsed wall-clock time in seconds.
+        cpu: The CPU time spent in setupwize's own process (user + system).
+        children_cpu: The CPU time of the child processes that finished during the phase.
+        peak_memory: The peak traced Python allocation in bytes (0 without allocation tracking).
+    """
+
+    name: str
+    wall: float
+    cpu: float
+    children_cpu: float
+    peak_memory: int = 0
+
+    @property
+    def waiting(self) -> float:
+        """
+        The time the process was not running Python code, mostly spent waiting on child processes and I/O.
+        """
+        return max(self.wall - self.cpu, 0.0)
+
+
+class PhaseProfiler:
+    """
+    Profiles the phases of a run with cProfile and, optionally, tracemalloc.
+
+    Each phase writes a `<phase>.pstats` file into the output directory, and `write_summary` adds a
+    `summary.txt` with the top functions and allocations of every phase, along with the split between
+    in-process CPU time and time spent waiting on child processes. When disabled, `phase` is a no-op.
+
+    A phase may run in a worker thread: its functions are those of that thread, its CPU time is the process's.
+
+    Example:
+        ```python
+        profiler = PhaseProfiler("./logs/profile", enabled=True)
+        with profiler.phase("catalog"):
+            load_catalog()
+        profiler.write_summary()
+        ```
+    """
+
+    def __init__(self, output_dir: str | Path, enabled: bool = False, trace_memory: bool = False, top: int = 25):
+        """
+        Initializes the PhaseProfiler.
+
+        Args:
+            output_dir: The directory receiving the `.pstats` files and the summary.
+            enabled: Whether profiling is enabled.
+            trace_memory: Whether to track Python allocations with tracemalloc.
+            top: The number of entries listed per phase in the summary.
+        """
+        self.output_dir = Path(output_dir)
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.top = top
+        self.timings: list[PhaseTiming] = []
+        self._reports: list[str] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Profiles the code executed inside the `with` block as the phase `name`.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.trace_memory:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        start_times = os.times()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - start
+            end_times = os.times()
+
+            timing = PhaseTiming(
+                name=name,
+                wall=wall,
+                cpu=(end_times.user + end_times.system) - (start_times.user + start_times.system),
+                children_cpu=(end_times.children_user + end_times.children_system)
+                - (start_times.children_user + start_times.children_system),
+            )
+            snapshot = None
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                timing.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            self.timings.append(timing)
+            self._record(name, profile, snapshot)
+
+    def _record(self, name: str, profile: cProfile.Profile, snapshot: tracemalloc.Snapshot | None) -> None:
+        filename = re.sub(r"[^\w.-]", "_", name)
+        profile.dump_stats(self.output_dir / f"{filename}.pstats")
+
+        stream = io.StringIO()
+        stream.write(f"=== {name} ===\n")
+        pstats.Stats(profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if snapshot:
+            stream.write(f"Top {self.top} allocations:\n")
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                stream.write(f"  {stat}\n")
+        self._reports.append(stream.getvalue())
+
+    def summary_table(self) -> str:
+        """
+        Formats the time split of every phase as a table.
+        """
+        lines = [f"{'phase':<40} {'wall':>9} {'python':>9} {'waiting':>9} {'children':>9} {'peak mem':>10}"]
+        for t in self.timings:
+            peak = f"{t.peak_memory / 1_000_000:.1f}MB" if self.trace_memory else "-"
+            lines.append(
+                f"{t.name:<40} {t.wall:>8.3f}s {t.cpu:>8.3f}s {t.waiting:>8.3f}s {t.children_cpu:>8.3f}s {peak:>10}"
+            )
+        return "\n".join(lines)
+
+    def write_summary(self) -> Path | None:
+        """
+        Writes `summary.txt` into the output directory and logs the time split.
+
+        Returns:
+            The path of the summary, or None when profiling is disabled or nothing was profiled.
+        """
+        if not self.enabled or not self.timings:
+            return None
+
+        table = self.summary_table()
+        summary_path = self.output_dir / "summary.txt"
+        summary_path.write_text(table + "\n\n" + "\n".join(self._reports))
+        logger.info(f"Profile summary written to '{summary_path}':\n{table}")
+        return summary_path
@@ -0,0 +1,172 @@
+import logging
+import os
+import resource
+import subprocess
+import threading
+from dataclasses import asdict, dataclass, fields
+from typing import Any
+
+from core.tracers.events import current_scope
+
+logger = logging.getLogger(__name__)
+
+# ru_inblock and ru_oublock count 512-byte sectors on Linux
+BLOCK_SIZE = 512
+
+
+@dataclass
+class ResourceUsage:
+    """
+    The resources used by the process trees of one or more commands, as reported by `wait4`.
+
+    The usage of a command includes every descendant it waited for, so a shell script accounts for the tools
+    it ran. Descendants left running in the background are not included.
+
+    Attributes:
+        wall: The elapsed wall-clock time of the commands in seconds.
+        user_cpu: The CPU time spent in user mode in seconds.
+        system_cpu: The CPU time spent in the kernel in seconds.
+        max_rss: The peak resident set size of the largest process in KiB. The kernel counts a child from the
+            memory it was forked with, so this is never below the size of setupwize itself.
+        read_bytes: The bytes read from block devices (page cache hits are free).
+        written_bytes: The bytes written to block devices.
+        voluntary_switches: The context switches while waiting on I/O, locks or the network.
+        involuntary_switches: The context switches caused by preemption, high when CPU-bound.
+        processes: The number of commands run (each command's own children are not counted).
+    """
+
+    wall: float = 0.0
+    user_cpu: float = 0.0
+    system_cpu: float = 0.0
+    max_rss: int = 0
+    read_bytes: int = 0
+    written_bytes: int = 0
+    voluntary_switches: int = 0
+    involuntary_switches: int = 0
+    processes: int = 0
+
+    @classmethod
+    def from_rusage(cls, rusage: resource.struct_rusage, wall: float = 0.0) -> "ResourceUsage":
+        return cls(
+            wall=wall,
+            user_cpu=rusage.ru_utime,
+            system_cpu=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss,
+            read_bytes=rusage.ru_inblock * BLOCK_SIZE,
+            written_bytes=rusage.ru_oublock * BLOCK_SIZE,
+            voluntary_switches=rusage.ru_nvcsw,
+            involuntary_switches=rusage.ru_nivcsw,
+            processes=1,
+        )
+
+    def __add__(self, other: "ResourceUsage") -> "ResourceUsage":
+        combined = {field.name: getattr(self, field.name) + getattr(other, field.name) for field in fields(self)}
+        combined["max_rss"] = max(self.max_rss, other.max_rss)
+        return ResourceUsage(**combined)
+
+    @property
+    def cpu(self) -> float:
+        return self.user_cpu + self.system_cpu
+
+    @property
+    def bound(self) -> str:
+        """
+        A rough guess of what limited the commands: the CPU, the disk, or waiting (mostly the network).
+        """
+        if not self.wall:
+            return "-"
+        if self.cpu / self.wall >= 0.5:
+            return "cpu"
+        if (self.read_bytes + self.written_bytes) / self.wall >= 20 * 1024 * 1024:
+            return "disk"
+        return "waiting"
+
+    def as_dict(self) -> dict[str, Any]:
+        return {key: round(value, 6) if isinstance(value, float) else value for key, value in asdict(self).items()}
+
+    def describe(self) -> str:
+        return (
+            f"cpu {self.cpu:.2f}s (user {self.user_cpu:.2f}s, sys {self.system_cpu:.2f}s) in {self.wall:.2f}s, "
+            f"peak rss {self.max_rss / 1024:.1f} MiB, "
+            f"io {self.read_bytes / 1_000_000:.1f} MB read / {self.written_bytes / 1_000_000:.1f} MB written, "
+            f"{self.voluntary_switches} voluntary / {self.involuntary_switches} involuntary switches, "
+            f"{self.processes} command(s)"
+        )
+
+
+def wait_with_usage(proc: subprocess.Popen) -> tuple[int, resource.struct_rusage | None]:
+    """
+    Waits for a process with `wait4`, which also returns the resource usage of its process tree.
+
+    Returns:
+        The exit code and the resource usage, None if the process was already reaped (e.g. by `poll`).
+    """
+    if proc.returncode is not None:
+        return proc.returncode, None
+    _, status, rusage = os.wait4(proc.pid, 0)
+    # Popen must not wait for the reaped process again
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, rusage
+
+
+class ResourceLedger:
+    """
+    Accumulates the resource usage of the commands of every task in the run.
+    """
+
+    def __init__(self) -> None:
+        self.tasks: dict[tuple[str, str, int], ResourceUsage] = {}
+        self._lock = threading.Lock()
+
+    def add(self, usage: ResourceUsage, package: str = "", task: str = "", index: int = -1) -> None:
+        key = (package, task, index)
+        with self._lock:
+            self.tasks[key] = self.tasks.get(key, ResourceUsage()) + usage
+
+    def get(self, package: str, task: str, index: int) -> ResourceUsage | None:
+        return self.tasks.get((package, task, index))
+
+    def summary_table(self, top: int = 10) -> str:
+        """
+        Formats the tasks that used the most CPU time, with their wall time, memory, I/O and likely bottleneck.
+        """
+        ranked = sorted(self.tasks.items(), key=lambda item: (item[1].cpu, item[1].wall), reverse=True)[:top]
+        lines = [
+            f"Top {len(ranked)} resource consumers:",
+            f"  {'task':<36} {'wall':>8} {'cpu':>8} {'rss MiB':>8} {'read MB':>8} {'write MB':>8} {'ctxsw':>8} bound",
+        ]
+        for (package, task, index), usage in ranked:
+            name = f"{package or '(run)'}/{task or '-'}" + (f"#{index}" if index >= 0 else "")
+            lines.append(
+                f"  {name[:36]:<36} {usage.wall:>7.1f}s {usage.cpu:>7.1f}s {usage.max_rss / 1024:>8.1f} "
+                f"{usage.read_bytes / 1_000_000:>8.1f} {usage.written_bytes / 1_000_000:>8.1f} "
+                f"{usage.voluntary_switches + usage.involuntary_switches:>8} {usage.bound}"
+            )
+        return "\n".join(lines)
+
+    def log_summary(self, top: int = 10) -> None:
+        """
+        Logs the top consumers, unless no command was accounted.
+        """
+        if self.tasks:
+            logger.info(self.summary_table(top))
+
+
+_ledger = ResourceLedger()
+
+
+def record_usage(rusage: resource.struct_rusage, wall: float) -> None:
+    """
+    Adds the resource usage of a command to the task the current thread is running.
+    """
+    scope = current_scope()
+    _ledger.add(
+        ResourceUsage.from_rusage(rusage, wall), scope.get("package", ""), scope.get("task", ""), scope.get("index", -1)
+    )
+
+
+def get_resource_ledger() -> ResourceLedger:
+    """
+    Returns the resource usage of the run so far.
+    """
+    return _ledger
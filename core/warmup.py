@@ -0,0 +1,165 @@
+import logging
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from types import TracebackType
+from typing import Any
+
+from core.exceptions import MissingAnswerError
+from core.packages import Package, create_packages_from_yaml
+from core.prefetch import AptPrefetcher
+from core.requirements import resolve_requirements
+from core.tracers.profiler import PhaseProfiler
+from parser.yaml_parser import YamlParser
+from utils import LockHolder, SystemFacts, dpkg_lock_holder
+
+logger = logging.getLogger(__name__)
+
+
+def sudo_cached() -> bool:
+    """
+    Checks whether sudo runs without asking for a password (cached credentials or NOPASSWD), refreshing the
+    cached credentials if so. Never prompts.
+    """
+    try:
+        return subprocess.run(["sudo", "-n", "true"], capture_output=True, check=False).returncode == 0  # noqa: S607
+    except OSError:
+        return False
+
+
+class PreflightWarmup:
+    """
+    Runs the preflight work that does not depend on the user's answers in the background, while the first
+    prompts wait for input: parsing the catalog, checking the sudo credentials, probing the dpkg lock and, once
+    the packages are known, resolving the plan, creating the packages and prefetching their apt archives.
+
+    Each result is waited for where it is first needed, so the installation starts with everything warmed.
+
+    Example:
+        ```python
+        with PreflightWarmup(yaml_parser, facts, apt_options, prefetcher) as warmup:
+            warmup.plan(["git", "docker"])
+            upgrade = confirm_system_upgrade()
+            packages = warmup.packages()
+        ```
+    """
+
+    def __init__(
+        self,
+        yaml_parser: YamlParser,
+        facts: SystemFacts,
+        apt_options: dict[str, str] | None = None,
+        prefetcher: AptPrefetcher | None = None,
+        verbose: bool = False,
+        sudo: bool = True,
+        profiler: PhaseProfiler | None = None,
+    ):
+        """
+        Initializes the PreflightWarmup and starts the work that needs no answer.
+
+        Args:
+            yaml_parser: The parser of the package catalog.
+            facts: The system facts the manifests are expanded with.
+            apt_options: (Optional) The apt options of the run, given to the created packages.
+            prefetcher: (Optional) The prefetcher the first packages of the plan are scheduled on.
+            verbose: Whether the created packages display the output of their commands.
+            sudo: Whether to check the sudo credentials (not when the commands are replayed or nothing is installed).
+            profiler: (Optional) The profiler of the run; the catalog parse is profiled in its thread as the
+                "catalog" phase.
+        """
+        self.yaml_parser = yaml_parser
+        self.facts = facts
+        self.apt_options = apt_options or {}
+        self.prefetcher = prefetcher
+        self.verbose = verbose
+        self.profiler = profiler
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="warmup")
+        self._catalog = self._executor.submit(self._load_catalog)
+        self._sudo: Future[bool] | None = self._executor.submit(sudo_cached) if sudo else None
+        self._lock_holder = self._executor.submit(dpkg_lock_holder)
+        self._names: Future[list[str]] | None = None
+        self._packages: Future[list[Package]] | None = None
+
+    def __enter__(self) -> "PreflightWarmup":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _load_catalog(self) -> list[dict[str, Any]]:
+        with self.profiler.phase("catalog") if self.profiler else nullcontext():
+            return self.yaml_parser.load_all_packages()
+
+    def catalog(self) -> list[dict[str, Any]]:
+        """
+        Returns the parsed package files, waiting for the parse to finish.
+        """
+        return self._catalog.result()
+
+    def plan(self, package_names: list[str]) -> None:
+        """
+        Starts resolving the requirements of the selected packages and creating them, then schedules the first
+        ones on the prefetcher. Only the first call is taken into account.
+        """
+        if self._names is None:
+            self._names = self._executor.submit(resolve_requirements, package_names, self.yaml_parser)
+            self._packages = self._executor.submit(self._create_packages, self._names)
+
+    def _create_packages(self, names: Future[list[str]]) -> list[Package]:
+        packages = create_packages_from_yaml(
+            names.result(), self.yaml_parser, self.verbose, self.apt_options, self.facts
+        )
+        if self.prefetcher:
+            self.prefetcher.schedule(packages)
+        return packages
+
+    def package_names(self) -> list[str]:
+        """
+        Returns the planned packages with their requirements, each once and after its requirements.
+
+        Raises:
+            SetUpWizeError: If a package or requirement does not exist, or the requirements form a cycle.
+        """
+        if self._names is None:
+            raise RuntimeError("No package selection was planned")
+        return self._names.result()
+
+    def packages(self) -> list[Package]:
+        """
+        Returns the created packages of the plan, in installation order.
+        """
+        if self._packages is None:
+            raise RuntimeError("No package selection was planned")
+        return self._packages.result()
+
+    def ensure_sudo(self, interactive: bool) -> None:
+        """
+        Validates the sudo credentials in the foreground when they were not cached, so the password is asked
+        once, before the installation starts, rather than by its first privileged command.
+
+        Args:
+            interactive: Whether the password may be asked; an unattended run never prompts.
+
+        Raises:
+            MissingAnswerError: If the run is unattended and sudo needs a password.
+        """
+        if self._sudo is None or self._sudo.result():
+            return
+        if not interactive:
+            raise MissingAnswerError(
+                "Unattended runs need sudo without a password: cache the credentials with `sudo -v` "
+                "or allow NOPASSWD for this user"
+            )
+        logger.info("Administrator privileges are needed for the installation")
+        subprocess.run(["sudo", "-v"], check=False)  # noqa: S607
+
+    def lock_holder(self) -> LockHolder | None:
+        """
+        Returns the dpkg lock holder found when the run started, if any.
+        """
+        return self._lock_holder.result()
@@ -0,0 +1,247 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import shutil
+import struct
+import time
+from pathlib import Path
+
+from core.copy_engine import CopyEngine
+from core.packages import Package
+from core.tasks import ConfigurationTask
+
+logger = logging.getLogger(__name__)
+
+# Temporary files written by editors while saving, they are never synced
+IGNORED_PATTERNS = ["*.swp", "*.swx", "*~", ".#*", "4913", "*.part"]
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def configuration_mappings(packages: list[Package]) -> dict[Path, Path]:
+    """
+    Maps every configuration source declared by the packages to its destination.
+
+    Args:
+        packages: The packages of the catalog.
+
+    Returns:
+        A dictionary mapping absolute source paths to expanded destination paths.
+    """
+    mappings: dict[Path, Path] = {}
+    for package in packages:
+        for task in package.tasks:
+            if not isinstance(task, ConfigurationTask) or not task.config_paths:
+                continue
+            for config_path, dest in zip(task.config_paths, task.destinations, strict=False):
+                source = Path(config_path).expanduser().resolve()
+                destination = Path(dest).expanduser()
+                if source.is_file() and destination.is_dir():
+                    destination = destination / source.name
+                mappings[source] = destination
+    return mappings
+
+
+class _InotifyBackend:
+    """
+    Reports changed paths using Linux inotify through libc.
+    """
+
+    def __init__(self, roots: list[Path]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: dict[int, Path] = {}
+        for root in roots:
+            self._watch_tree(root if root.is_dir() else root.parent)
+
+    def _watch_tree(self, directory: Path) -> None:
+        for root, _, _ in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for '{root}'")
+            self._watches[wd] = Path(root)
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed: set[Path] = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            directory = self._watches.get(wd)
+            if directory is None or mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            path = directory / name if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # watch new directories and sync whatever they already contain
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    # removed again before it could be watched
+                    logger.debug(f"Not watching '{path}': {e}")
+                changed.add(path)
+            elif mask & IN_CREATE and not mask & IN_ISDIR:
+                # wait for IN_CLOSE_WRITE, the file is still being written
+                continue
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _PollingBackend:
+    """
+    Reports changed paths by comparing periodic snapshots of file sizes and modification times.
+    """
+
+    def __init__(self, roots: list[Path], interval: float = 0.5):
+        self.roots = roots
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snapshot: dict[Path, tuple[int, int]] = {}
+        for root in self.roots:
+            paths = [Path(directory) / name for directory, _, names in os.walk(root) for name in names]
+            for path in paths if root.is_dir() else [root]:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout: float | None) -> set[Path]:
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {
+            path for path in snapshot.keys() | self._snapshot.keys() if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class ConfigurationWatcher:
+    """
+    Watches the configuration sources and re-applies only the files that changed to their destinations.
+
+    Bursts of events (an editor saving several files, a `git checkout`) are batched: after the first event the
+    watcher keeps collecting until no event arrived for `debounce` seconds, then syncs the batch at once.
+    """
+
+    def __init__(self, mappings: dict[Path, Path], debounce: float = 0.05, polling: bool = False):
+        """
+        Initializes the ConfigurationWatcher.
+
+        Args:
+            mappings: The configuration sources mapped to their destinations.
+            debounce: The quiet period in seconds that ends a batch of events.
+            polling: Force the polling backend instead of inotify.
+        """
+        if not mappings:
+            raise ValueError("No configuration paths to watch")
+        self.mappings = mappings
+        self.debounce = debounce
+        self.copy_engine = CopyEngine()
+
+        roots = list(mappings)
+        self._backend: _InotifyBackend | _PollingBackend
+        if polling:
+            self._backend = _PollingBackend(roots)
+        else:
+            try:
+                self._backend = _InotifyBackend(roots)
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify unavailable ({e}), falling back to polling")
+                self._backend = _PollingBackend(roots)
+
+    def run(self) -> None:
+        """
+        Watches and syncs until interrupted.
+        """
+        logger.info(f"Watching {len(self.mappings)} configuration path(s), press Ctrl+C to stop")
+        try:
+            while True:
+                batch = self._backend.wait(None)
+                while batch:
+                    more = self._backend.wait(self.debounce)
+                    if not more:
+                        break
+                    batch |= more
+                self.sync(batch)
+        finally:
+            self._backend.close()
+
+    def sync(self, paths: set[Path]) -> int:
+        """
+        Applies the changed source paths to their destinations, deleting the ones that were removed. A path that
+        fails to sync (e.g. deleted during the copy, or not permitted) is logged and skipped, the next change
+        to it syncs it again.
+
+        Args:
+            paths: The changed source paths.
+
+        Returns:
+            The number of synced paths.
+        """
+        start = time.perf_counter()
+        synced = 0
+        for path in sorted(paths):
+            if any(fnmatch.fnmatch(path.name, pattern) for pattern in IGNORED_PATTERNS):
+                continue
+            target = self._target(path)
+            if target is None:
+                continue
+
+            try:
+                if path.exists():
+                    self.copy_engine.copy(path, target)
+                elif target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(target)
+                else:
+                    target.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Could not sync '{path}' -> '{target}': {e}")
+                continue
+            logger.info(f"Synced '{path}' -> '{target}'")
+            synced += 1
+
+        if synced:
+            logger.info(f"Synced {synced} path(s) in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return synced
+
+    def _target(self, path: Path) -> Path | None:
+        for source, destination in self.mappings.items():
+            if path == source:
+                return destination
+            if path.is_relative_to(source):
+                return destination / path.relative_to(source)
+        return None
@@ -1,3 +1,4 @@
+from .template import render_template
 from .yaml_parser import YamlParser
 
-__all__ = ["YamlParser"]
+__all__ = ["YamlParser", "render_template"]
@@ -0,0 +1,47 @@
+import re
+from typing import Any
+
+from core.exceptions import InvalidYamlFormatError
+
+# Matches `{{ facts.arch }}` style placeholders. Placeholders such as Go templates (`{{.Names}}`) are not
+# identifiers and are left untouched.
+TEMPLATE_PATTERN = re.compile(r"\{\{\s*([A-Za-z_]\w*(?:\.\w+)*)\s*\}\}")
+
+
+def render_template(value: Any, variables: dict[str, Any]) -> Any:  # noqa: ANN401
+    """
+    Expands `{{ namespace.name }}` placeholders in strings, lists and dictionaries.
+
+    Only placeholders whose first component is a key of `variables` are expanded, everything else is kept
+    as-is so shell syntax and other template languages pass through unchanged.
+
+    Args:
+        value: The parsed YAML value to render.
+        variables: The template namespaces (e.g. {"facts": {...}}).
+
+    Returns:
+        A copy of `value` with all known placeholders expanded.
+
+    Raises:
+        InvalidYamlFormatError: If a placeholder references an unknown name inside a known namespace.
+    """
+    if isinstance(value, str):
+        return TEMPLATE_PATTERN.sub(lambda match: _lookup(match, variables), value)
+    if isinstance(value, list):
+        return [render_template(item, variables) for item in value]
+    if isinstance(value, dict):
+        return {key: render_template(item, variables) for key, item in value.items()}
+    return value
+
+
+def _lookup(match: re.Match[str], variables: dict[str, Any]) -> str:
+    namespace, *path = match.group(1).split(".")
+    if namespace not in variables:
+        return match.group(0)
+
+    current: Any = variables[namespace]
+    for name in path:
+        if not isinstance(current, dict) or name not in current:
+            raise InvalidYamlFormatError(f"Unknown template variable '{match.group(1)}'")
+        current = current[name]
+    return str(current)
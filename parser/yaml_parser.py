@@ -20,11 +20,17 @@ class YamlParser:
         """
         self.packages_dir = Path(packages_dir)
 
+    def package_path(self, package_name: str) -> Path:
+        """
+        Returns the path of the YAML file defining the specified package.
+        """
+        return self.packages_dir / f"{package_name}.yaml"
+
     def load_package(self, package_name: str) -> dict[str, Any]:
         """
         Loads and parses the YAML file for the specified package.
         """
-        package_file = self.packages_dir / f"{package_name}.yaml"
+        package_file = self.package_path(package_name)
 
         if not package_file.exists():
             raise PackageNotFoundError(f"Package '{package_name}' not found.")
@@ -0,0 +1,68 @@
+#!/bin/sh
+# Generated by setupwize for: docker zellij lazygit
+set -e
+export DEBIAN_FRONTEND=noninteractive
+# configuration sources are relative to the directory of the script
+cd "$(dirname "$0")"
+
+# system facts, probed where the script runs
+SETUPWIZE_ARCH=$(dpkg --print-architecture)
+SETUPWIZE_CODENAME=$(. /etc/os-release && echo "$VERSION_CODENAME")
+SETUPWIZE_MACHINE=$(uname -m)
+
+# apt packages
+sudo apt-get update -y
+sudo apt-get install -y ca-certificates curl
+
+# docker
+(
+key=$(mktemp) && trap 'rm -f "$key"' EXIT
+curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o "$key"
+if grep -q 'BEGIN PGP' "$key"; then
+  sudo install -D -m 644 "$key" /etc/apt/keyrings/docker.asc
+  echo 'deb [arch='"${SETUPWIZE_ARCH}"' signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu '"${SETUPWIZE_CODENAME}"' stable' | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
+else
+  sudo install -D -m 644 "$key" /etc/apt/keyrings/docker.gpg
+  echo 'deb [arch='"${SETUPWIZE_ARCH}"' signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu '"${SETUPWIZE_CODENAME}"' stable' | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
+fi
+)
+sudo apt-get -o Dir::Etc::sourcelist=/etc/apt/sources.list.d/docker.list -o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0 update -y
+sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin docker-ce-rootless-extras
+(
+sudo mkdir -p /etc/docker
+echo '{"log-driver":"json-file","log-opts":{"max-size":"10m","max-file":"5"}}' | sudo tee /etc/docker/daemon.json
+)
+(
+docker --version
+)
+
+# zellij
+if [ ! -e /usr/local/bin/zellij ]; then
+  (
+    tmp=$(mktemp -d)
+    trap 'rm -rf "$tmp"' EXIT
+    curl -fsSL https://github.com/zellij-org/zellij/releases/latest/download/zellij-"${SETUPWIZE_MACHINE}"-unknown-linux-musl.tar.gz -o "$tmp/archive"
+    mkdir "$tmp/files"
+    tar -xf "$tmp/archive" -C "$tmp/files"
+    find "$tmp/files" -type f -name zellij -exec sudo install -D -m 0755 {} /usr/local/bin/zellij \;
+  )
+fi
+
+# lazygit
+if ! command -v lazygit >/dev/null 2>&1; then
+  (
+  set -e
+  LAZYGIT_VERSION=$(curl -fsS "https://api.github.com/repos/jesseduffield/lazygit/releases/latest" | grep '"tag_name":' | sed -E 's/.*"tag_name": "v([^"]+)".*/\1/')
+  curl -fLo /tmp/lazygit.tar.gz "https://github.com/jesseduffield/lazygit/releases/latest/download/lazygit_${LAZYGIT_VERSION}_Linux_x86_64.tar.gz"
+  tar xf /tmp/lazygit.tar.gz -C /tmp
+  sudo install /tmp/lazygit /usr/local/bin
+  rm /tmp/lazygit.tar.gz /tmp/lazygit
+  )
+fi
+
+# zellij
+mkdir -p "$HOME"/.config/zellij && cp -R ./configurations/zellij/. "$HOME"/.config/zellij/
+
+# finalizers
+if command -v usermod >/dev/null 2>&1; then sudo usermod -aG docker "$USER"; fi
+if command -v systemctl >/dev/null 2>&1; then sudo systemctl restart docker; fi
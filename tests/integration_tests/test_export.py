@@ -0,0 +1,35 @@
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+from core.export import export_dockerfile, export_facts, export_shell
+from core.packages import Package, create_packages_from_yaml
+from core.requirements import resolve_requirements
+from parser.yaml_parser import YamlParser
+
+import pytest
+
+PACKAGES_DIR = Path(__file__).parents[2] / "packages"
+GOLDEN_DIR = Path(__file__).parent / "golden"
+
+# apt repositories and installs, shell tasks and finalizers (docker), an archive and configurations (zellij),
+# a guarded shell task (lazygit)
+PACKAGES = ["docker", "zellij", "lazygit"]
+
+
+@pytest.mark.parametrize(
+    ("export", "golden"),
+    [(export_shell, "setup.sh"), (export_dockerfile, "Dockerfile")],
+)
+def test_export_matches_golden_file(export: Callable[[list[Package]], str], golden: str) -> None:
+    """
+    Run with UPDATE_GOLDEN=1 to regenerate the golden files after an intended change.
+    """
+    yaml_parser = YamlParser(str(PACKAGES_DIR))
+    packages = create_packages_from_yaml(resolve_requirements(PACKAGES, yaml_parser), yaml_parser, facts=export_facts())
+    output = export(packages)
+
+    golden_path = GOLDEN_DIR / golden
+    if os.environ.get("UPDATE_GOLDEN"):
+        golden_path.write_text(output)
+    assert output == golden_path.read_text()
@@ -1,17 +1,36 @@
+from utils.download import RateLimiter, download_file
+from utils.dpkg_lock import LockHolder, dpkg_lock_holder, dpkg_lock_options, uses_dpkg, wait_for_dpkg_lock
+from utils.facts import SystemFacts
 from utils.utils import (
     check_cmd,
+    command_exists,
     confirm_reboot,
     confirm_system_upgrade,
+    file_contains,
+    installed_apt_packages,
     is_running_gnome,
     is_running_on_ubuntu,
     is_ubuntu_version_at_least,
+    read_os_release,
 )
 
 __all__ = [
+    "LockHolder",
+    "RateLimiter",
+    "SystemFacts",
     "check_cmd",
+    "command_exists",
+    "confirm_reboot",
+    "confirm_system_upgrade",
+    "download_file",
+    "dpkg_lock_holder",
+    "dpkg_lock_options",
+    "file_contains",
+    "installed_apt_packages",
     "is_running_gnome",
     "is_running_on_ubuntu",
     "is_ubuntu_version_at_least",
-    "confirm_reboot",
-    "confirm_system_upgrade",
+    "read_os_release",
+    "uses_dpkg",
+    "wait_for_dpkg_lock",
 ]
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read from the network before they are written to disk
+CHUNK_SIZE = 64 * 1024
+
+
+class RateLimiter:
+    """
+    A thread-safe bandwidth limiter shared by concurrent downloads.
+
+    Every consumer reserves a time slot proportional to the number of bytes it
+    has read, so the combined throughput of all threads never exceeds `rate`.
+    """
+
+    def __init__(self, rate: int):
+        """
+        Initializes the RateLimiter.
+
+        Args:
+            rate: The maximum throughput in bytes per second.
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be a positive number of bytes per second")
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        """
+        Blocks until `amount` bytes may be transferred without exceeding the rate.
+
+        Args:
+            amount: The number of bytes that were (or are about to be) transferred.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot = max(now, self._next_slot) + amount / self.rate
+            delay = self._next_slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def download_file(
+    url: str,
+    destination: str | Path,
+    checksum: str | None = None,
+    rate_limiter: RateLimiter | None = None,
+    timeout: float = 30,
+) -> Path:
+    """
+    Downloads a file to `destination` atomically.
+
+    The content is written to a `.part` file next to the destination and only renamed into place once the
+    download (and the optional checksum verification) succeeded, so readers never observe partial files.
+
+    Args:
+        url: The URL to download.
+        destination: The final path of the downloaded file.
+        checksum: (Optional) An apt-style checksum such as `SHA256:<hex>` to verify the content against.
+        rate_limiter: (Optional) A RateLimiter shared with other downloads.
+        timeout: The socket timeout in seconds.
+
+    Returns:
+        The path of the downloaded file.
+
+    Raises:
+        ValueError: If the checksum does not match or uses an unknown algorithm.
+    """
+    destination = Path(destination).expanduser()
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_name(f"{destination.name}.part")
+
+    digest = None
+    algorithm, _, expected = (checksum or "").partition(":")
+    if checksum:
+        algorithm = {"md5sum": "md5"}.get(algorithm.lower(), algorithm.lower())
+        if algorithm not in hashlib.algorithms_available:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        digest = hashlib.new(algorithm)
+
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response, partial.open("wb") as f:  # noqa: S310
+            while chunk := response.read(CHUNK_SIZE):
+                if rate_limiter:
+                    rate_limiter.consume(len(chunk))
+                if digest:
+                    digest.update(chunk)
+                f.write(chunk)
+
+        if digest and digest.hexdigest() != expected.lower():
+            raise ValueError(f"Checksum mismatch for '{url}'")
+
+        partial.replace(destination)
+    finally:
+        partial.unlink(missing_ok=True)
+
+    logger.debug(f"Downloaded '{url}' to '{destination}'")
+    return destination
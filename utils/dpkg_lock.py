@@ -0,0 +1,144 @@
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# apt frontends take lock-frontend for the whole transaction, dpkg alone only takes lock
+DPKG_LOCKS = (Path("/var/lib/dpkg/lock-frontend"), Path("/var/lib/dpkg/lock"))
+
+# How long apt tasks wait for the dpkg lock in total
+DPKG_LOCK_TIMEOUT = 1800
+
+# Matches commands that run apt or dpkg, but not paths such as /etc/apt/keyrings
+DPKG_COMMAND = re.compile(r"(?:^|[\s;&|(])(?:apt|apt-get|aptitude|dpkg)\s")
+
+
+@dataclass(frozen=True)
+class LockHolder:
+    """
+    A process holding a dpkg lock.
+
+    Attributes:
+        path: The held lock file.
+        pid: The process ID, or None for open file description locks, which do not record their owner.
+        command: The process name (e.g. "unattended-upgr"), or None if unknown.
+    """
+
+    path: Path
+    pid: int | None
+    command: str | None
+
+    def __str__(self) -> str:
+        if self.pid is None:
+            return f"an unknown process (on '{self.path}')"
+        return f"'{self.command or '?'}' (pid {self.pid}, on '{self.path}')"
+
+
+def dpkg_lock_holder(lock_paths: tuple[Path, ...] = DPKG_LOCKS, proc_locks: str = "/proc/locks") -> LockHolder | None:
+    """
+    Finds the process holding a dpkg lock without taking or waiting for it.
+
+    The lock files are only readable by root, so instead of probing them with fcntl the lock table of the kernel
+    is searched for their device and inode. This needs no privileges and never blocks.
+
+    Args:
+        lock_paths: The lock files to check, in order.
+        proc_locks: The kernel lock table.
+
+    Returns:
+        The first lock holder found, or None if no lock is held.
+    """
+    inodes: dict[tuple[int, int, int], Path] = {}
+    for path in lock_paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        inodes[(os.major(stat.st_dev), os.minor(stat.st_dev), stat.st_ino)] = path
+    if not inodes:
+        return None
+
+    try:
+        with open(proc_locks) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    holders: dict[Path, LockHolder] = {}
+    for line in lines:
+        # 1: POSIX  ADVISORY  WRITE 1234 fd:01:5767 0 EOF   ("->" lines are blocked waiters)
+        fields = line.split()
+        if len(fields) < 6 or fields[1] == "->":
+            continue
+        major, minor, inode = fields[5].split(":")
+        path = inodes.get((int(major, 16), int(minor, 16), int(inode)))
+        if path is None or path in holders:
+            continue
+        pid = int(fields[4])
+        holders[path] = LockHolder(path, pid, _process_name(pid)) if pid > 0 else LockHolder(path, None, None)
+
+    return next((holders[path] for path in lock_paths if path in holders), None)
+
+
+def _process_name(pid: int) -> str | None:
+    try:
+        return Path(f"/proc/{pid}/comm").read_text().strip()
+    except OSError:
+        return None
+
+
+def wait_for_dpkg_lock(timeout: float = DPKG_LOCK_TIMEOUT, max_delay: float = 30, initial_delay: float = 1) -> float:
+    """
+    Waits until no process holds a dpkg lock, polling with exponential backoff.
+
+    Args:
+        timeout: The maximum time to wait in seconds.
+        max_delay: The upper bound of the delay between two probes.
+        initial_delay: The delay after the first probe, doubled after every probe.
+
+    Returns:
+        The time waited in seconds.
+
+    Raises:
+        TimeoutError: If the lock is still held after `timeout` seconds.
+    """
+    start = time.monotonic()
+    delay = initial_delay
+    reported: LockHolder | None = None
+    while holder := dpkg_lock_holder():
+        waited = time.monotonic() - start
+        if waited >= timeout:
+            raise TimeoutError(f"The dpkg lock is still held by {holder} after {waited:.0f}s")
+        if holder != reported:
+            logger.warning(f"The dpkg lock is held by {holder}, waiting for it to be released...")
+            reported = holder
+        time.sleep(min(delay, timeout - waited))
+        delay = min(delay * 2, max_delay)
+
+    waited = time.monotonic() - start
+    if reported:
+        logger.info(f"The dpkg lock was released after {waited:.0f}s")
+    return waited
+
+
+def dpkg_lock_options(waited: float = 0, timeout: float = DPKG_LOCK_TIMEOUT) -> dict[str, str]:
+    """
+    Returns the apt configuration making apt itself wait for the dpkg lock for the rest of the timeout: another
+    process may take the lock between a free probe and the start of apt, which would otherwise fail at once.
+
+    Args:
+        waited: The time already waited for the lock, in seconds.
+        timeout: The total time to wait for the lock, in seconds.
+    """
+    return {"DPkg::Lock::Timeout": str(max(int(timeout - waited), 1))}
+
+
+def uses_dpkg(command: str) -> bool:
+    """
+    Checks whether a shell command runs apt or dpkg, and therefore needs the dpkg lock.
+    """
+    return DPKG_COMMAND.search(command) is not None
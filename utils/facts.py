@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from utils.utils import read_os_release
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACTS_CACHE = Path("~/.cache/setupwize/facts.json")
+
+# uname machine names mapped to the Debian architecture names reported by `dpkg --print-architecture`
+DEBIAN_ARCHITECTURES: dict[str, str] = {
+    "x86_64": "amd64",
+    "aarch64": "arm64",
+    "armv7l": "armhf",
+    "i686": "i386",
+    "ppc64le": "ppc64el",
+    "s390x": "s390x",
+    "riscv64": "riscv64",
+}
+
+
+@dataclass(frozen=True)
+class SystemFacts:
+    """
+    Facts about the host, collected once per run and exposed to manifests as `{{ facts.<name> }}`.
+
+    Attributes:
+        distro: The distribution id from os-release (e.g. "ubuntu").
+        version: The distribution version (e.g. "24.04").
+        codename: The distribution codename (e.g. "noble").
+        arch: The Debian architecture (e.g. "amd64").
+        machine: The kernel machine name (e.g. "x86_64").
+        desktop: The current desktop environment (e.g. "ubuntu:GNOME").
+        session_type: The graphical session type ("wayland", "x11" or "tty").
+        cpu_count: The number of CPUs available to the process.
+        memory_mb: The total memory in MiB.
+    """
+
+    distro: str
+    version: str
+    codename: str
+    arch: str
+    machine: str
+    desktop: str
+    session_type: str
+    cpu_count: int
+    memory_mb: int
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def collect(cls, cache_path: str | Path | None = None) -> "SystemFacts":
+        """
+        Collects the facts of the running system.
+
+        Args:
+            cache_path: (Optional) A JSON file used to cache the probed facts. The cache is reused until the
+                os-release file changes or the machine reboots. Session related facts are always read from the
+                environment since they differ between logins.
+
+        Returns:
+            A SystemFacts instance.
+        """
+        session: dict[str, Any] = {
+            "desktop": os.environ.get("XDG_CURRENT_DESKTOP", ""),
+            "session_type": os.environ.get("XDG_SESSION_TYPE", "tty"),
+        }
+
+        cache_file = Path(cache_path).expanduser() if cache_path else None
+        cache_key = _cache_key()
+        if cache_file and cache_file.is_file():
+            try:
+                cached = json.loads(cache_file.read_text())
+                if cached.get("key") == cache_key:
+                    return cls(**cached["facts"], **session)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.debug(f"Ignoring invalid facts cache '{cache_file}': {e}")
+
+        os_release = read_os_release()
+        machine = platform.machine()
+        facts: dict[str, Any] = {
+            "distro": os_release.get("ID", "").lower(),
+            "version": os_release.get("VERSION_ID", ""),
+            "codename": os_release.get("VERSION_CODENAME", ""),
+            "arch": DEBIAN_ARCHITECTURES.get(machine) or _dpkg_architecture() or machine,
+            "machine": machine,
+            "cpu_count": len(os.sched_getaffinity(0)),
+            "memory_mb": _total_memory_mb(),
+        }
+
+        if cache_file:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                cache_file.write_text(json.dumps({"key": cache_key, "facts": facts}))
+            except OSError as e:
+                logger.debug(f"Could not write facts cache '{cache_file}': {e}")
+
+        return cls(**facts, **session)
+
+
+def _cache_key() -> str:
+    """
+    Identifies the state the cached facts were collected in: the current boot and the os-release revision.
+    """
+    boot_id_path = Path("/proc/sys/kernel/random/boot_id")
+    boot_id = boot_id_path.read_text().strip() if boot_id_path.is_file() else ""
+    os_release_path = Path("/etc/os-release")
+    os_release_mtime = os_release_path.stat().st_mtime if os_release_path.exists() else 0
+    return f"{boot_id}:{os_release_mtime}"
+
+
+def _dpkg_architecture() -> str:
+    """
+    Falls back to asking dpkg for architectures missing from DEBIAN_ARCHITECTURES.
+    """
+    if not shutil.which("dpkg"):
+        return ""
+    result = subprocess.run(["dpkg", "--print-architecture"], check=False, capture_output=True, text=True)  # noqa: S607
+    return result.stdout.strip()
+
+
+def _total_memory_mb() -> int:
+    """
+    Reads the total memory from /proc/meminfo.
+    """
+    meminfo = Path("/proc/meminfo")
+    if meminfo.is_file():
+        with meminfo.open() as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    return 0
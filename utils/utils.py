@@ -1,5 +1,7 @@
+import functools
 import logging
 import os
+import re
 import shutil
 from pathlib import Path
 
@@ -23,6 +25,69 @@ def check_cmd(cmd: str) -> bool:
     return shutil.which(cmd) is not None
 
 
+def command_exists(name: str) -> bool:
+    """
+    Checks whether a command is found in PATH, like `command -v` but without spawning a shell.
+
+    The listing of each PATH directory is cached until the directory changes, so repeated lookups only stat it.
+
+    Args:
+        name: The command name, or a path to an executable.
+
+    Returns:
+        True if an executable of that name is found, False otherwise.
+    """
+    if "/" in name:
+        return os.access(Path(name).expanduser(), os.X_OK)
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        try:
+            mtime_ns = os.stat(directory or ".").st_mtime_ns
+        except OSError:
+            continue
+        if name in _list_directory(directory or ".", mtime_ns) and os.access(os.path.join(directory, name), os.X_OK):
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=64)
+def _list_directory(directory: str, mtime_ns: int) -> frozenset[str]:
+    try:
+        return frozenset(os.listdir(directory))
+    except OSError:
+        return frozenset()
+
+
+def file_contains(path: str, pattern: str) -> bool:
+    """
+    Checks whether a line of a file matches a regular expression, without spawning `grep`.
+
+    The result is cached until the file changes.
+
+    Args:
+        path: The path of the file; a leading `~` is expanded.
+        pattern: The regular expression searched in each line.
+
+    Returns:
+        True if a line matches, False otherwise or if the file cannot be read.
+    """
+    file = Path(path).expanduser()
+    try:
+        stat = file.stat()
+    except OSError:
+        return False
+    return _search_file(str(file), pattern, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=64)
+def _search_file(path: str, pattern: str, mtime_ns: int, size: int) -> bool:
+    regex = re.compile(pattern)
+    try:
+        with open(path, errors="replace") as f:
+            return any(regex.search(line) for line in f)
+    except OSError:
+        return False
+
+
 def is_running_gnome() -> bool:
     """
     Checks if the script is running on the GNOME desktop environment.
@@ -33,23 +98,39 @@ def is_running_gnome() -> bool:
     return "GNOME" in os.environ.get("XDG_CURRENT_DESKTOP", "")
 
 
-def is_running_on_ubuntu() -> bool:
+@functools.lru_cache(maxsize=1)
+def read_os_release(path: str = "/etc/os-release") -> dict[str, str]:
     """
-    Checks if the script is running on an Ubuntu system.
+    Parses the os-release file once per process.
+
+    Args:
+        path: The path to the os-release file.
 
     Returns:
-        True if running on Ubuntu, False otherwise.
+        A dictionary mapping the os-release keys (e.g. "ID", "VERSION_ID") to their unquoted values.
+        Empty if the file does not exist.
     """
-    os_release_path = Path("/etc/os-release")
+    os_release_path = Path(path)
     if not os_release_path.is_file():
-        return False
+        return {}
 
+    values: dict[str, str] = {}
     with os_release_path.open() as f:
         for line in f:
-            if line.startswith("ID="):
-                distro_id = line.split("=")[1].strip().lower()
-                return distro_id == "ubuntu"
-    return False
+            key, sep, value = line.strip().partition("=")
+            if sep:
+                values[key] = value.strip().strip("\"'")
+    return values
+
+
+def is_running_on_ubuntu() -> bool:
+    """
+    Checks if the script is running on an Ubuntu system.
+
+    Returns:
+        True if running on Ubuntu, False otherwise.
+    """
+    return read_os_release().get("ID", "").lower() == "ubuntu"
 
 
 def is_ubuntu_version_at_least(min_version: float) -> bool:
@@ -62,20 +143,46 @@ def is_ubuntu_version_at_least(min_version: float) -> bool:
     Returns:
         True if the Ubuntu version is at least min_version, False otherwise.
     """
-    os_release_path = Path("/etc/os-release")
-    if not os_release_path.is_file():
+    distro_version = read_os_release().get("VERSION_ID")
+    if distro_version is None:
         return False
 
-    with os_release_path.open() as f:
+    try:
+        return float(distro_version) >= min_version
+    except ValueError:
+        logger.warning(f"Could not parse Ubuntu version: {distro_version}")
+        return False
+
+
+def installed_apt_packages(status_path: str = "/var/lib/dpkg/status") -> set[str]:
+    """
+    Reads the names of the installed apt packages from the dpkg status database, without spawning dpkg.
+
+    The result is cached until the status file changes.
+
+    Args:
+        status_path: The path to the dpkg status file.
+
+    Returns:
+        A set of installed package names (empty if the status file does not exist).
+    """
+    path = Path(status_path)
+    if not path.is_file():
+        return set()
+    return _parse_dpkg_status(str(path), path.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_dpkg_status(status_path: str, mtime_ns: int) -> set[str]:
+    installed: set[str] = set()
+    name = ""
+    with open(status_path) as f:
         for line in f:
-            if line.startswith("VERSION_ID="):
-                distro_version = line.split("=")[1].strip().split('"')[1]
-                try:
-                    return float(distro_version) >= min_version
-                except ValueError:
-                    logger.warning(f"Could not parse Ubuntu version: {distro_version}")
-                    return False
-    return False
+            if line.startswith("Package:"):
+                name = line.split(":", 1)[1].strip()
+            elif line.startswith("Status:") and line.split()[-1] == "installed":
+                installed.add(name)
+    return installed
 
 
 def confirm_reboot() -> bool: